@@ -1,24 +1,78 @@
+import time
+START_T0 = time.perf_counter()  # početak uvoza modula; od njega se meri start prozora
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 from tkinter.scrolledtext import ScrolledText
-import pandas as pd
+from xml.sax.saxutils import escape as xml_escape
 import xml.etree.ElementTree as ET
 from decimal import Decimal, InvalidOperation
 from datetime import datetime
-import os, csv, traceback
+import os, io, re, csv, gzip, zipfile, traceback, warnings, itertools, contextlib, collections, bisect
+from collections.abc import Mapping
+import sqlite3, threading, queue, json, importlib
+import sys, glob, argparse, cProfile, signal
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 
-try:
-    import pyodbc
-except Exception:
-    pyodbc = None
-try:
-    import pymssql
-except Exception:
-    pymssql = None
+class LazyModule:
+    """Modul koji se uvozi tek pri prvom pristupu atributu, da bi se prozor pojavio pre pandas-a i drajvera.
+
+    optional=True: ako modul nije instaliran, proxy je lažan (if not pyodbc: ...) umesto greške pri uvozu.
+    """
+    def __init__(self, name, optional=False):
+        self._lazy_name = name
+        self._lazy_optional = optional
+        self._lazy_mod = None
+
+    def _lazy_load(self):
+        if self._lazy_mod is None:
+            try:
+                self._lazy_mod = importlib.import_module(self._lazy_name)
+            except Exception:
+                if not self._lazy_optional: raise
+                self._lazy_mod = False
+        return self._lazy_mod
+
+    def __getattr__(self, attr):
+        mod = self._lazy_load()
+        if mod is False: raise ImportError(f'{self._lazy_name} nije instaliran')
+        return getattr(mod, attr)
+
+    def __bool__(self):
+        return bool(self._lazy_load())
+
+pd = LazyModule('pandas')
+np = LazyModule('numpy')
+openpyxl = LazyModule('openpyxl')
+pyodbc = LazyModule('pyodbc', optional=True)
+pymssql = LazyModule('pymssql', optional=True)
+pq = LazyModule('pyarrow.parquet', optional=True)  # samo za Parquet ulaz
+LAZY_MODULES = (pd, np, openpyxl, pyodbc, pymssql)
+STARTUP_TARGET_S = 1.0  # cilj: od pokretanja do prvog prikaza prozora (proverava benchmarks/bench_startup.py)
+
+def warm_up_modules(modules=LAZY_MODULES):
+    """Uvozi odložene module (u pozadinskoj niti, posle prvog prikaza prozora); vraća {modul: sekunde}."""
+    times = {}
+    for m in modules:
+        t0 = time.perf_counter()
+        m._lazy_load()
+        times[m._lazy_name] = time.perf_counter() - t0
+    return times
 
 EMBEDDED_KONTA_MAP = {}
 EMBEDDED_KONTA_META = {}
 
+CACHE_DIR = os.path.join(os.environ.get('LOCALAPPDATA') or os.path.expanduser('~'), 'mppXML')
+KONTA_CACHE_DB = os.path.join(CACHE_DIR, 'konta_cache.sqlite')
+SQL_DRIVERS_FILE = os.path.join(CACHE_DIR, 'sql_drivers.json')
+SETTINGS_FILE = os.path.join(CACHE_DIR, 'settings.json')  # SQL parametri (bez lozinke), preduzeće, automatsko povezivanje
+METRICS_FILE = os.path.join(CACHE_DIR, 'run_metrics.jsonl')  # jedna JSON linija po poslu
+LOG_FILE = os.path.join(CACHE_DIR, 'mppxml.log')  # ceo log; u prozoru je samo poslednjih LOG_MAX_LINES linija
+LOG_FILE_MAX_BYTES = 5 * 2**20  # pri pokretanju se veći log premešta u mppxml.log.1
+LOG_MAX_LINES = 1000
+LOG_FLUSH_S = 0.25
+SQL_HEALTH_IDLE_S = 30  # posle ovoliko sekundi mirovanja konekcija se proverava sa SELECT 1
+
 TIP_MAP = {
     'Tekući promet': 0,
     'Otvaranje p. knjiga': 1,
@@ -41,6 +95,20 @@ TIP_MAP = {
 TIP_OPCIJE = list(TIP_MAP.keys())
 
 MAIN_REQUIRED = ['konto','duguje','potražuje','poslovni partner','dokument','datum promene','opis']
+PREVIEW_ROWS = 20
+CHUNK_ROWS = 10000
+
+NALOG_ID_BASE = 900000
+NALOG_ID_STRIDE = 100000
+MAX_STAVKI_PER_NALOG = NALOG_ID_STRIDE - 1  # stavka id = nalog_id + rb mora ostati ispod sledećeg naloga
+MAX_SHARDS = (2**31 - NALOG_ID_BASE) // NALOG_ID_STRIDE  # id-evi naloga i stavki su int (32 bita) u MPP bazi
+SPLIT_MODES = ('rows', 'dokument', 'month')
+SPLIT_OPCIJE = {'Bez podele': None, 'Po broju stavki': 'rows', 'Po dokumentu': 'dokument', 'Po mesecu': 'month'}
+# Izlaz se bira po ekstenziji; .xml.gz i .zip se komprimuju dok se pišu (XML se ponavlja, ~30x manji)
+OUTPUT_FORMATS = {'xml': '.xml', 'gzip': '.xml.gz', 'zip': '.zip'}
+OUTPUT_FILETYPES = [('XML', '*.xml'), ('XML, gzip', '*.xml.gz'), ('XML u ZIP-u', '*.zip'), ('Svi fajlovi', '*.*')]
+OUTPUT_COMPRESSLEVEL = 6
+MEMORY_OUTPUT = '<memorija>'  # naziv izlaza u logu/rezultatu kad se piše u io.BytesIO
 
 def normalize_header(h): return (h or '').strip().lower()
 
@@ -99,8 +167,1939 @@ def parse_date_to_iso_tz(x):
     if pd.isna(dt): return None
     return dt.strftime('%Y-%m-%dT00:00:00+02:00')
 
+# --- Vektorska priprema kolona (ceo DataFrame odjednom) ---
+SKIP_KONTO_EMPTY = 'konto empty'
+SKIP_NOT_IN_MAP = 'konto not in map'
+SKIP_ZERO = 'zero amounts'
+
+def _text_series(s):
+    if pd.api.types.is_float_dtype(s.dtype):  # tipizovane kolone (Parquet): celi brojevi bez '.0', kao iz XLSX-a
+        s = s.astype(object).map(_xlsx_cell, na_action='ignore')
+    return s.where(s.notna(), '').astype(str)
+
+def norm_konto_series(s):
+    s = _text_series(s).str.replace(r'\.0$', '', regex=True).str.strip()
+    return s.str.replace(r'[ .\-/\\]', '', regex=True)
+
+def _decimal_4(s):
+    try:
+        q = Decimal(s); return f'{q:.4f}'
+    except InvalidOperation:
+        return None
+
+def _typed_amount_series(s):
+    """Iznosi iz numeričke kolone (Parquet): bez prepoznavanja decimalnog zareza i hiljada."""
+    out = pd.Series(None, index=s.index, dtype=object)
+    ok = s.notna()
+    if pd.api.types.is_integer_dtype(s.dtype):
+        out[ok] = s[ok].astype(str) + '.0000'
+        return out
+    st = s[ok].astype(str)
+    fast = st.str.fullmatch(r'-?(?:0|[1-9]\d*)(?:\.\d{1,4})?')
+    parts = st[fast].str.partition('.')
+    out[fast[fast].index] = parts[0] + '.' + parts[2].str.pad(4, side='right', fillchar='0')
+    rest = fast[~fast].index
+    out[rest] = st[~fast].map(_decimal_4)
+    return out
+
+def parse_amount_series(s):
+    """Vektorska verzija parse_amount: vraća string sa 4 decimale ili None."""
+    if pd.api.types.is_numeric_dtype(s.dtype) and not pd.api.types.is_bool_dtype(s.dtype):
+        return _typed_amount_series(s)
+    st = _text_series(s).str.strip()
+    has_c = st.str.contains(',', regex=False)
+    has_d = st.str.contains('.', regex=False)
+    comma_dec = has_c & (~has_d | (st.str.rfind(',') > st.str.rfind('.')))
+    comma_thousands = has_c & has_d & ~comma_dec
+    st = st.mask(comma_dec, st.str.replace('.', '', regex=False).str.replace(',', '.', regex=False))
+    st = st.mask(comma_thousands, st.str.replace(',', '', regex=False))
+    out = pd.Series(None, index=s.index, dtype=object)
+    # Brzi put: obični brojevi do 4 decimale formatiraju se čisto string operacijama (bez Decimal)
+    fast = st.str.fullmatch(r'-?(?:0|[1-9]\d*)(?:\.\d{1,4})?')
+    if fast.any():
+        parts = st[fast].str.partition('.')
+        out[fast] = parts[0] + '.' + parts[2].str.pad(4, side='right', fillchar='0')
+    rest = ~fast & (st != '')
+    if rest.any():
+        out[rest] = st[rest].map(_decimal_4)
+    return out
+
+def _nonzero_amounts(a):
+    nz = a.notna() & a.fillna('').str.contains('[1-9]')
+    odd = a.notna() & ~a.fillna('').str.fullmatch(r'-?\d+\.\d{4}')
+    if odd.any():
+        nz[odd] = a[odd].map(lambda v: float(v) != 0.0)
+    return nz
+
+def parse_date_series(s):
+    """Parsira kolonu datuma jednom: samo jedinstvene vrednosti, format se pogađa za celu kolonu."""
+    if pd.api.types.is_datetime64_any_dtype(s.dtype):  # već tipizovano (Parquet)
+        out = s.dt.strftime('%Y-%m-%dT00:00:00+02:00').astype(object)
+        return out.where(s.notna(), None)
+    uniq = pd.Series(pd.unique(s[s.notna()]), dtype=object)
+    if uniq.empty:
+        return pd.Series(None, index=s.index, dtype=object)
+    # ISO vrednosti (Excel datum ćelije) kao ISO, ostalo sa dayfirst; rezultat ne zavisi od redosleda/delova
+    dt = pd.to_datetime(uniq, format='ISO8601', errors='coerce')
+    rest = dt.isna()
+    if rest.any():
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', UserWarning)
+            dt[rest] = pd.to_datetime(uniq[rest], dayfirst=True, errors='coerce')
+    iso = dt.dt.strftime('%Y-%m-%dT00:00:00+02:00').astype(object)
+    iso[dt.isna()] = None
+    # Vrednosti koje ne odgovaraju pogođenom formatu parsiraju se pojedinačno, kao ranije
+    for i in uniq.index[dt.isna()]:
+        iso[i] = parse_date_to_iso_tz(uniq[i])
+    out = s.map(dict(zip(uniq, iso))).astype(object)
+    return out.where(out.notna(), None)
+
+def _skip_reason(konto_norm, konto_id, duguje, potrazuje):
+    reason = pd.Series('', index=konto_norm.index, dtype=object)
+    reason[duguje.isna() & potrazuje.isna()] = SKIP_ZERO
+    reason[konto_id.isna()] = SKIP_NOT_IN_MAP
+    reason[konto_norm == ''] = SKIP_KONTO_EMPTY
+    return reason
+
+def skip_reasons(df, mapping, konta_map):
+    """Samo razlog preskakanja po redu (kao skip_reason iz prepare_frame), bez datuma i teksta."""
+    konto_norm = norm_konto_series(df[mapping['konto']])
+    konto_id = konto_norm.map({k: konta_map.get(k) for k in konto_norm.unique()})
+    duguje = parse_amount_series(df[mapping['duguje']])
+    potrazuje = parse_amount_series(df[mapping['potražuje']])
+    return _skip_reason(konto_norm, konto_id, duguje.where(_nonzero_amounts(duguje), None),
+                        potrazuje.where(_nonzero_amounts(potrazuje), None))
+
+def prepare_frame(df, mapping, konta_map):
+    """Normalizuje konta, iznose i datume za ceo DataFrame. Vraća pripremljeni frame sa kolonom skip_reason."""
+    konto_raw = df[mapping['konto']]
+    konto_norm = norm_konto_series(konto_raw)
+    uniq = konto_norm.unique()
+    konto_id = konto_norm.map({k: konta_map.get(k) for k in uniq}).astype('Int64')
+    duguje = parse_amount_series(df[mapping['duguje']])
+    potrazuje = parse_amount_series(df[mapping['potražuje']])
+    duguje = duguje.where(_nonzero_amounts(duguje), None)
+    potrazuje = potrazuje.where(_nonzero_amounts(potrazuje), None)
+    reason = _skip_reason(konto_norm, konto_id, duguje, potrazuje)
+    return pd.DataFrame({
+        'row': df.index + 2,  # Excel red (1-based + header)
+        'konto_raw': _text_series(konto_raw),
+        'konto_norm': konto_norm,
+        'konto_id': konto_id,
+        'datum': parse_date_series(df[mapping['datum promene']]),
+        'dokument': _text_series(df[mapping['dokument']]).str.strip(),
+        'duguje': duguje,
+        'potrazuje': potrazuje,
+        'opis': _text_series(df[mapping['opis']]).str.strip(),
+        'skip_reason': reason,
+    }, index=df.index)
+
+def split_header_date(prepared):
+    """Iz niza pripremljenih delova vraća prvi datum (za zaglavlje naloga) i isti niz delova."""
+    pending = []
+    it = iter(prepared)
+    for prep in it:
+        pending.append(prep)
+        dates = prep['datum'].dropna()
+        if len(dates): return dates.iloc[0], itertools.chain(pending, it)
+    return None, iter(pending)
+
+class JobCancelled(Exception):
+    """Posao je prekinut na zahtev korisnika."""
+
+# --- Merenje po fazama (vreme, redova/s, SQL round-trip, memorija) ---
+_metrics_local = threading.local()
+
+def _peak_rss_mb():
+    """Vršna memorija procesa u MB (None ako nije dostupna)."""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / (2**20 if sys.platform == 'darwin' else 2**10), 1)
+    except ImportError:
+        pass
+    try:
+        import ctypes
+        from ctypes import wintypes
+        class PMC(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD)] + \
+                       [(n, ctypes.c_size_t) for n in ('PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage',
+                                                      'QuotaPagedPoolUsage', 'QuotaPeakNonPagedPoolUsage',
+                                                      'QuotaNonPagedPoolUsage', 'PagefileUsage', 'PeakPagefileUsage')]
+        k32 = ctypes.windll.kernel32
+        k32.GetCurrentProcess.restype = wintypes.HANDLE
+        k32.K32GetProcessMemoryInfo.argtypes = [wintypes.HANDLE, ctypes.c_void_p, wintypes.DWORD]
+        pmc = PMC(); pmc.cb = ctypes.sizeof(PMC)
+        if not k32.K32GetProcessMemoryInfo(k32.GetCurrentProcess(), ctypes.byref(pmc), pmc.cb): return None
+        return round(pmc.PeakWorkingSetSize / 2**20, 1)
+    except Exception:
+        return None
+
+class RunMetrics:
+    """Metrike jednog posla po fazama: vreme, redovi, SQL round-trip-ovi i vršna memorija procesa.
+
+    Dok je aktivna (active()), SQL pozivi u toj niti se broje automatski. Rezime ide u log,
+    a as_dict()/append() daju jednu JSON liniju po poslu.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.started = datetime.now()
+        self.status = None
+        self.seconds = None
+        self.sql_round_trips = 0
+        self.stages = {}
+        self.info = {}
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds, rows=0, sql=0):
+        with self._lock:
+            s = self.stages.setdefault(stage, {'seconds': 0.0, 'rows': 0, 'sql': 0})
+            s['seconds'] += seconds
+            s['rows'] += rows
+            s['sql'] += sql
+            s['peak_rss_mb'] = _peak_rss_mb()
+
+    @contextlib.contextmanager
+    def stage(self, stage):
+        """Meri blok; u vraćeni rečnik se može upisati 'rows'."""
+        t0, sql0, extra = time.perf_counter(), self.sql_round_trips, {}
+        try:
+            yield extra
+        finally:
+            self.add(stage, time.perf_counter() - t0, extra.get('rows', 0), self.sql_round_trips - sql0)
+
+    def exclude(self, stage, *inner):
+        """Oduzima vreme faza koje su se izvršavale unutar stage (npr. čitanje unutar pisanja)."""
+        with self._lock:
+            s = self.stages.get(stage)
+            if s: s['seconds'] = max(0.0, s['seconds'] - sum(self.stages[i]['seconds'] for i in inner if i in self.stages))
+
+    @contextlib.contextmanager
+    def active(self):
+        prev = getattr(_metrics_local, 'current', None)
+        _metrics_local.current = self
+        try:
+            yield self
+        finally:
+            _metrics_local.current = prev
+
+    def finish(self, status='ok'):
+        self.status = status
+        self.seconds = time.perf_counter() - self._t0
+        return self
+
+    def as_dict(self):
+        seconds = self.seconds if self.seconds is not None else time.perf_counter() - self._t0
+        return dict({
+            'job': self.name,
+            'started': self.started.isoformat(timespec='seconds'),
+            'status': self.status,
+            'seconds': round(seconds, 3),
+            'sql_round_trips': self.sql_round_trips,
+            'peak_rss_mb': _peak_rss_mb(),
+            'stages': {k: {'seconds': round(v['seconds'], 3), 'rows': v['rows'],
+                           'rows_per_s': round(v['rows'] / v['seconds']) if v['rows'] and v['seconds'] else None,
+                           'sql': v['sql'], 'peak_rss_mb': v.get('peak_rss_mb')}
+                       for k, v in self.stages.items()},
+        }, **self.info)
+
+    def summary(self):
+        d = self.as_dict()
+        parts = []
+        for k, v in d['stages'].items():
+            p = f"{k} {v['seconds']:.2f} s"
+            if v['rows_per_s']: p += f" ({v['rows_per_s']} red/s)"
+            if v['sql']: p += f", SQL {v['sql']}"
+            parts.append(p)
+        mem = f", mem {d['peak_rss_mb']} MB" if d['peak_rss_mb'] else ''
+        return f"Metrike [{self.name}]: {d['seconds']:.2f} s, SQL round-trip {d['sql_round_trips']}{mem}" + \
+               (' | ' + '; '.join(parts) if parts else '')
+
+    def append(self, path=METRICS_FILE):
+        append_jsonl(path, self.as_dict())
+
+def append_jsonl(path, record):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+def current_metrics():
+    return getattr(_metrics_local, 'current', None)
+
+def count_sql_round_trip(n=1):
+    m = current_metrics()
+    if m is not None:
+        with m._lock: m.sql_round_trips += n
+
+@contextlib.contextmanager
+def metrics_stage(stage):
+    """Kao RunMetrics.stage za aktivne metrike u ovoj niti; bez njih ne radi ništa."""
+    m = current_metrics()
+    if m is None:
+        yield {}
+        return
+    with m.stage(stage) as extra:
+        yield extra
+
+# --- Strimovano čitanje XLSX (openpyxl read-only) ---
+def _xlsx_cell(v):
+    # Isto kao pd.read_excel(dtype=str): celi brojevi bez '.0', ostalo kao str()
+    if v is None: return None
+    if isinstance(v, float) and v.is_integer(): return str(int(v))
+    return str(v)
+
+def _xlsx_headers(row):
+    headers, seen = [], {}
+    for i, h in enumerate(row):
+        h = f'Unnamed: {i}' if h is None else _xlsx_cell(h)
+        if h in seen:
+            seen[h] += 1; h = f'{h}.{seen[h]}'
+        else:
+            seen[h] = 0
+        headers.append(h)
+    return headers
+
+class XlsxReader:
+    """Čita prvi list XLSX-a u read-only režimu: brz pregled i redovi u delovima (bez celog lista u memoriji)."""
+    def __init__(self, path):
+        self.path = path
+        self.columns = None
+        self.total_rows = None
+
+    def _rows(self):
+        wb = openpyxl.load_workbook(self.path, read_only=True, data_only=True)
+        try:
+            ws = wb.worksheets[0]
+            self.total_rows = ws.max_row
+            it = enumerate(ws.iter_rows(values_only=True), start=1)
+            for _, row in it:
+                if any(v is not None for v in row):
+                    self.columns = _xlsx_headers(row); break
+            else:
+                self.columns = []; return
+            width = len(self.columns)
+            for row_num, row in it:
+                if any(v is not None for v in row):
+                    row = [_xlsx_cell(v) for v in row[:width]]
+                    if len(row) < width: row += [None] * (width - len(row))
+                    yield row_num, row
+        finally:
+            wb.close()
+
+    def iter_chunks(self, chunksize=CHUNK_ROWS, columns=None, cancel=None):
+        """DataFrame-ovi od po `chunksize` redova; indeks je Excel red - 2, kao kod pd.read_excel."""
+        rows, idx = [], []
+        pos = None
+        for row_num, row in self._rows():
+            if cancel is not None and row_num % 1000 == 0 and cancel.is_set(): raise JobCancelled()
+            if pos is None:
+                pos = [self.columns.index(c) for c in columns] if columns else list(range(len(self.columns)))
+                names = [self.columns[i] for i in pos]
+            rows.append([row[i] for i in pos]); idx.append(row_num - 2)
+            if len(rows) >= chunksize:
+                yield pd.DataFrame(rows, columns=names, index=idx, dtype=object)
+                rows, idx = [], []
+        if rows:
+            yield pd.DataFrame(rows, columns=names, index=idx, dtype=object)
+
+    def preview(self, n=PREVIEW_ROWS):
+        with contextlib.closing(self._rows()) as it:
+            rows = list(itertools.islice(it, n))
+        return pd.DataFrame([r for _, r in rows], columns=self.columns, index=[i - 2 for i, _ in rows], dtype=object)
+
+# --- CSV i Parquet ulaz (isti interfejs kao XlsxReader) ---
+CSV_SNIFF_BYTES = 64 * 1024
+CSV_DELIMITERS = ';,\t|'
+_COMMA_DECIMAL = re.compile(r'-?\d{1,3}(?:\.\d{3})+(?:,\d+)?|-?\d+,\d+')
+_DOT_DECIMAL = re.compile(r'-?\d{1,3}(?:,\d{3})+(?:\.\d+)?|-?\d+\.\d+')
+# Iznos sa grupama hiljada (1.234.567 ili 1.234,56); samo takve vrednosti CsvReader svodi po prepoznatom separatoru
+_THOUSANDS = {',': r'-?\d{1,3}(?:\.\d{3})+(?:,\d+)?', '.': r'-?\d{1,3}(?:,\d{3})+(?:\.\d+)?'}
+
+def detect_decimal(values):
+    """',' ili '.' ako uzorak iznosa nedvosmisleno koristi taj decimalni separator, inače None."""
+    comma = dot = 0
+    for v in values:
+        v = (v or '').strip()
+        c, d = bool(_COMMA_DECIMAL.fullmatch(v)), bool(_DOT_DECIMAL.fullmatch(v))
+        comma += c and not d
+        dot += d and not c
+    if comma and not dot: return ','
+    if dot and not comma: return '.'
+    return None
+
+_CSV_EXTRA = '\0višak'  # ime dodatne kolone iza zaglavlja, ne može se poklopiti sa pravim nazivom
+
+def _csv_too_wide(path, line, ncols):
+    return ValueError(f'{os.path.basename(path)}: red {line} ima više kolona od zaglavlja ({ncols})')
+
+def _csv_chunks(it, path, ncols):
+    """Delovi iz pd.read_csv; neispravan red postaje ValueError sa imenom fajla i brojem reda."""
+    while True:
+        try:
+            chunk = next(it)
+        except StopIteration:
+            return
+        except pd.errors.ParserError as e:
+            line = re.search(r'in line (\d+)', str(e))
+            if line: raise _csv_too_wide(path, line[1], ncols) from None
+            raise ValueError(f'{os.path.basename(path)}: neispravan red u CSV-u ({str(e).strip()})') from None
+        yield chunk
+
+class CsvReader:
+    """CSV/TXT: separator kolona, kodna strana i decimalni separator iznosa se prepoznaju iz početka fajla.
+
+    Čita se u delovima (pandas C parser), sve kao tekst, pa ostatak pipeline-a radi isto kao za XLSX.
+    Kad je decimalni separator prepoznat, iznosi sa grupama hiljada (1.234 ili 1.234,56) se svode na oblik
+    1234.56; ostale vrednosti (npr. 1,5 u fajlu sa decimalnom tačkom) parsiraju se kao iz XLSX-a.
+    Red sa više kolona od zaglavlja je greška (ValueError sa brojem linije), ne tiho preskakanje.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f: raw = f.read(CSV_SNIFF_BYTES)
+        try:
+            sample, self.encoding = raw.decode('utf-8-sig'), 'utf-8-sig'
+        except UnicodeDecodeError as e:
+            if e.start < len(raw) - 3:  # ne samo presečen znak na kraju uzorka
+                sample, self.encoding = raw.decode('cp1250', errors='replace'), 'cp1250'
+            else:
+                sample, self.encoding = raw[:e.start].decode('utf-8-sig'), 'utf-8-sig'
+        lines = sample.splitlines()
+        if len(raw) == CSV_SNIFF_BYTES and len(lines) > 1: lines = lines[:-1]  # poslednja linija je možda presečena
+        try:
+            self.delimiter = csv.Sniffer().sniff('\n'.join(lines[:50]), delimiters=CSV_DELIMITERS).delimiter
+        except csv.Error:
+            self.delimiter = ';'
+        rows = list(csv.reader(lines, delimiter=self.delimiter))
+        self._header_line = next((i for i, r in enumerate(rows) if any(v.strip() for v in r)), 0)
+        rows = [r for r in rows[self._header_line:] if any(v.strip() for v in r)]
+        self.columns = _xlsx_headers([v if v.strip() else None for v in rows[0]]) if rows else []
+        mapping, _ = find_columns(pd.DataFrame(columns=self.columns), ['duguje', 'potražuje'])
+        self.amount_columns = list(dict.fromkeys(mapping.values()))
+        pos = [self.columns.index(c) for c in self.amount_columns]
+        self.decimal = detect_decimal(r[i] for r in rows[1:] for i in pos if i < len(r))
+        size = os.path.getsize(path)
+        # procena za traku napretka (kao max_row kod XLSX-a): veličina fajla / prosečna dužina reda
+        self.total_rows = round(size / (len(raw) / len(lines))) if lines and raw else 1
+
+    def _normalize_amounts(self, df):
+        if self.decimal is None: return df
+        thousands = '.' if self.decimal == ',' else ','
+        for c in self.amount_columns:
+            if c in df.columns:
+                v = df[c].str.strip()
+                grouped = v.str.fullmatch(_THOUSANDS[self.decimal], na=False)
+                df[c] = v.mask(grouped, v[grouped].str.replace(thousands, '', regex=False).str.replace(self.decimal, '.', regex=False))
+        return df
+
+    def iter_chunks(self, chunksize=CHUNK_ROWS, columns=None, cancel=None):
+        """DataFrame-ovi od po `chunksize` redova; indeks je broj linije - 2 (kao Excel red kod XLSX-a)."""
+        if not self.columns: return
+        names = list(columns) if columns else self.columns
+        # Kolona više od zaglavlja hvata red sa viškom polja: C parser takav red na početku dela ne prijavljuje,
+        # nego ga skraćuje. Prazne linije ostaju u čitanju (pa ih dropna izbaci), da bi broj reda bio broj linije.
+        it = pd.read_csv(self.path, sep=self.delimiter, encoding=self.encoding, header=None, skiprows=self._header_line + 1,
+                         names=self.columns + [_CSV_EXTRA], index_col=False, dtype=str, keep_default_na=False,
+                         na_values=[''], chunksize=chunksize, engine='c', on_bad_lines='error', skip_blank_lines=False)
+        with contextlib.closing(it):
+            for chunk in _csv_chunks(it, self.path, len(self.columns)):
+                if cancel is not None and cancel.is_set(): raise JobCancelled()
+                chunk.index += self._header_line
+                extra = chunk[_CSV_EXTRA].notna()
+                if extra.any(): raise _csv_too_wide(self.path, chunk.index[extra][0] + 2, len(self.columns))
+                chunk = self._normalize_amounts(chunk[names].dropna(how='all'))
+                if chunk.empty: continue
+                yield chunk.astype(object).where(chunk.notna(), None)
+
+    def preview(self, n=PREVIEW_ROWS):
+        for chunk in self.iter_chunks(chunksize=max(n, 1)):
+            return chunk.head(n)
+        return pd.DataFrame(columns=self.columns, dtype=object)
+
+class ParquetReader:
+    """Parquet (pyarrow), po grupama redova i samo potrebne kolone.
+
+    Numeričke kolone i datumi ostaju tipizovani, pa se iznosi i datumi ne parsiraju iz teksta;
+    ostale kolone postaju tekst kao kod XLSX-a.
+    """
+    def __init__(self, path):
+        if not pq:
+            raise RuntimeError("Parquet ulaz traži pyarrow. 'pip install pyarrow'")
+        self.path = path
+        self._file = pq.ParquetFile(path)
+        self.columns = list(self._file.schema_arrow.names)
+        self.total_rows = self._file.metadata.num_rows + 1  # kao max_row kod XLSX-a (sa zaglavljem)
+
+    @staticmethod
+    def _frame(batch, start):
+        df = batch.to_pandas(date_as_object=False)
+        df.index = pd.RangeIndex(start, start + len(df))
+        for field in batch.schema:
+            c, t = field.name, df[field.name].dtype
+            if str(field.type) in ('string', 'large_string'):
+                continue  # već str/None
+            if not (pd.api.types.is_numeric_dtype(t) or pd.api.types.is_datetime64_any_dtype(t)) or pd.api.types.is_bool_dtype(t):
+                df[c] = df[c].astype(object).map(_xlsx_cell, na_action='ignore')
+                df[c] = df[c].where(df[c].notna(), None)
+        return df.dropna(how='all')
+
+    def iter_chunks(self, chunksize=CHUNK_ROWS, columns=None, cancel=None):
+        """DataFrame-ovi od po `chunksize` redova; indeks je redni broj reda (Excel red - 2, kao da postoji zaglavlje)."""
+        start = 0
+        for batch in self._file.iter_batches(batch_size=chunksize, columns=columns):
+            if cancel is not None and cancel.is_set(): raise JobCancelled()
+            df = self._frame(batch, start)
+            start += batch.num_rows
+            if not df.empty: yield df
+
+    def preview(self, n=PREVIEW_ROWS):
+        for chunk in self.iter_chunks(chunksize=max(n, 1)):
+            return chunk.head(n)
+        return pd.DataFrame(columns=self.columns, dtype=object)
+
+INPUT_READERS = {'.xlsx': XlsxReader, '.xlsm': XlsxReader, '.csv': CsvReader, '.txt': CsvReader,
+                 '.parquet': ParquetReader, '.pq': ParquetReader}
+INPUT_FILETYPES = [('Svi podržani', ' '.join('*' + e for e in INPUT_READERS)), ('Excel', '*.xlsx *.xlsm'),
+                   ('CSV', '*.csv *.txt'), ('Parquet', '*.parquet *.pq')]
+
+def open_reader(path):
+    """Čitač po ekstenziji fajla; svi daju columns, total_rows, preview() i iter_chunks()."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in INPUT_READERS:
+        raise ValueError(f"Nepodržan format ulaza '{ext}' (podržano: {', '.join(INPUT_READERS)})")
+    return INPUT_READERS[ext](path)
+
+# --- SQL Server ---
+PREDUZECA_SQL = 'SELECT cp_preduzece_id, CAST(sifra AS varchar(64)) AS sifra, CAST(naziv AS varchar(255)) AS naziv FROM dbo.cp_preduzece ORDER BY sifra'
+KONTA_SQL = ('SELECT fk_kp_konto_id, CAST(Broj AS varchar(64)) AS Broj, '
+             'CAST(Naziv AS varchar(255)) AS Naziv FROM dbo.fk_kp_konto')
+# Broj normalizovan na serveru isto kao norm_konto (bez razmaka, '.', '-', '/', '\')
+KONTA_BROJ_NORM_SQL = ("REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(LTRIM(RTRIM(CAST(Broj AS varchar(64)))), "
+                       "' ', ''), '.', ''), '-', ''), '/', ''), '\\', '')")
+KONTA_LOOKUP_BATCH = 500  # SQL Server dozvoljava najviše 2100 parametara po upitu
+# Jeftina provera promena: broj redova + checksum + najveći id
+KONTA_SIG_SQL = ('SELECT COUNT(*), CHECKSUM_AGG(BINARY_CHECKSUM(fk_kp_konto_id, Broj, Naziv)), '
+                 'MAX(fk_kp_konto_id) FROM dbo.fk_kp_konto')
+
+def sql_target(params):
+    if params['instance']: return f"{params['server']}\\{params['instance']}"
+    if params['port']: return f"{params['server']},{params['port']}"
+    return params['server']
+
+def konta_cache_key(params):
+    """server|baza (malim slovima): ključ keša konta, zapamćenog ODBC drivera i kontnog plana u KontaIndex-u."""
+    return f"{sql_target(params)}|{params['database']}".lower()
+
+def open_sql(params, log, info=None):
+    server, instance, port, database = params['server'], params['instance'], params['port'], params['database']
+    log(f"Priprema konekcije: server='{server}', instance='{instance}', port='{port}', baza='{database}'")
+    if params['windows_auth']:
+        if not pyodbc:
+            raise RuntimeError("Windows auth tražen, ali pyodbc nije instaliran. 'pip install pyodbc'")
+        target = sql_target(params)
+        drivers_pref = ['ODBC Driver 18 for SQL Server','ODBC Driver 17 for SQL Server','SQL Server Native Client 11.0','SQL Server']
+        try: available = list(pyodbc.drivers())
+        except Exception: available = []
+        log(f'Dostupni ODBC driveri: {available}')
+        for drv in drivers_pref:
+            if (not available) or (drv in available):
+                cs = f"DRIVER={{{drv}}};SERVER={target};DATABASE={database};Trusted_Connection=Yes;TrustServerCertificate=Yes;Encrypt=No;"
+                log(f"Pokušavam ODBC driver: '{drv}' → SERVER={target}; DATABASE={database} (Windows auth)")
+                try:
+                    count_sql_round_trip()
+                    cn = pyodbc.connect(cs, timeout=5)
+                    log(f"ODBC uspeh sa driverom: '{drv}'")
+                    if info is not None: info.update(driver=drv, cs=cs)
+                    return cn
+                except Exception as e:
+                    log(f"ODBC neuspeh sa '{drv}': {e}")
+                    continue
+        raise RuntimeError('ODBC Windows auth nije dostupan ili konekcija odbijena.')
+    if not pymssql:
+        raise RuntimeError("pymssql nije instaliran. 'pip install pymssql'")
+    user = params['username']
+    port_i = int(port or '1433')
+    log(f'Pokušavam pymssql (SQL auth) → server={server}, port={port_i}, baza={database}, user={user}')
+    count_sql_round_trip()
+    cn = pymssql.connect(server=server, user=user, password=params['password'], database=database, port=port_i, tds_version='7.4', login_timeout=5)
+    log('pymssql konekcija uspešna.')
+    return cn
+
+def sql_fetchall(cn, q, args=()):
+    count_sql_round_trip()
+    cur = cn.cursor()
+    cur.execute(q, args) if args else cur.execute(q)
+    return cur.fetchall()
+
+def sql_fetch_sets(cn, queries):
+    """Više SELECT upita u jednom batch-u (jedan round-trip); vraća rezultate redom.
+
+    Ako driver ne vrati sve skupove preko nextset(), ostatak se čita posebnim upitima.
+    """
+    count_sql_round_trip()
+    cur = cn.cursor()
+    cur.execute('SET NOCOUNT ON; ' + '; '.join(queries))
+    sets = [cur.fetchall()]
+    while len(sets) < len(queries) and cur.nextset():
+        sets.append(cur.fetchall())
+    return sets + [sql_fetchall(cn, q) for q in queries[len(sets):]]
+
+def sql_placeholder(cn):
+    return '%s' if type(cn).__module__.startswith('pymssql') else '?'
+
+def fetch_konta_for(cn, konta, batch=KONTA_LOOKUP_BATCH):
+    """Traži samo zadata (normalizovana) konta na serveru, u grupama, parametrizovanim IN upitom."""
+    konta, rows = sorted(konta), []
+    ph = sql_placeholder(cn)
+    for i in range(0, len(konta), batch):
+        part = konta[i:i + batch]
+        cur = cn.cursor()
+        count_sql_round_trip()
+        cur.execute(f"{KONTA_SQL} WHERE {KONTA_BROJ_NORM_SQL} IN ({', '.join([ph] * len(part))})", tuple(part))
+        while True:
+            got = cur.fetchmany(1000)
+            if not got: break
+            rows.extend(got)
+    return rows
+
+def workbook_konta(reader, konto_col):
+    """Skup jedinstvenih normalizovanih konta iz cele tabele (čita se samo kolona konta)."""
+    konta = set()
+    for chunk in reader.iter_chunks(columns=[konto_col]):
+        konta.update(norm_konto_series(chunk[konto_col]).unique())
+    konta.discard('')
+    return konta
+
+class SqlSession:
+    """Jedna deljena SQL konekcija za celu sesiju.
+
+    Driver i connection string koji su proradili pamte se po cilju (i između pokretanja),
+    pa se ODBC driveri probaju samo prvi put ili posle greške. Posle mirovanja konekcija
+    se proverava sa SELECT 1, a pukla konekcija se tiho otvara ponovo.
+    """
+    def __init__(self, state_path=SQL_DRIVERS_FILE):
+        self.state_path = state_path
+        self._lock = threading.RLock()
+        self._cn = None
+        self._ident = None
+        self._last_used = 0.0
+        try:
+            with open(state_path, encoding='utf-8') as f: self._drivers = json.load(f)
+        except Exception:
+            self._drivers = {}
+
+    def _save_drivers(self):
+        try:
+            os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+            with open(self.state_path, 'w', encoding='utf-8') as f: json.dump(self._drivers, f, indent=1)
+        except Exception:
+            pass
+
+    @staticmethod
+    def _identity(params):
+        return tuple(params[k] for k in ('server','instance','port','database','windows_auth','username','password'))
+
+    def _healthy(self):
+        try:
+            sql_fetchall(self._cn, 'SELECT 1'); return True
+        except Exception:
+            return False
+
+    def _connect(self, params, log):
+        key = konta_cache_key(params)
+        known = self._drivers.get(key) if params['windows_auth'] and pyodbc else None
+        if known:
+            log(f"Zapamćen ODBC driver: '{known['driver']}' → SERVER={sql_target(params)}; DATABASE={params['database']}")
+            try:
+                count_sql_round_trip()
+                return pyodbc.connect(known['cs'], timeout=5)
+            except Exception as e:
+                log(f"Zapamćen driver ne radi ({e}), probam sve drivere ponovo.")
+                self._drivers.pop(key, None)
+        info = {}
+        cn = open_sql(params, log, info)
+        if info:
+            self._drivers[key] = info
+            self._save_drivers()
+        return cn
+
+    def connection(self, params, log):
+        with self._lock:
+            ident = self._identity(params)
+            if self._cn is not None and self._ident == ident:
+                if time.monotonic() - self._last_used < SQL_HEALTH_IDLE_S or self._healthy():
+                    self._last_used = time.monotonic()
+                    return self._cn
+                log('SQL konekcija više ne važi, ponovo se povezujem.')
+            self.close()
+            with metrics_stage('sql_connect'):
+                self._cn = self._connect(params, log)
+            self._ident = ident
+            self._last_used = time.monotonic()
+            return self._cn
+
+    def run(self, params, log, fn):
+        """Izvršava fn(cn) na deljenoj konekciji; ako je konekcija pukla usput, jednom se ponovo povezuje."""
+        with self._lock:
+            cn = self.connection(params, log)
+            try:
+                result = fn(cn)
+            except Exception as e:
+                if self._healthy(): raise  # greška u upitu, ne u konekciji
+                log(f'SQL konekcija prekinuta ({e}), ponovo se povezujem.')
+                self.close()
+                result = fn(self.connection(params, log))
+            self._last_used = time.monotonic()
+            return result
+
+    def close(self):
+        with self._lock:
+            if self._cn is not None:
+                try: self._cn.close()
+                except Exception: pass
+            self._cn = None
+            self._ident = None
+
+class KontaMeta(Mapping):
+    """Pogled id -> {'Broj', 'Naziv'} nad KontaChart; rečnici se prave tek kad zatrebaju (blok Konto u XML-u)."""
+    def __init__(self, by_id):
+        self._by_id = by_id
+
+    def __getitem__(self, kid):
+        broj, naziv = self._by_id[kid]
+        return {'Broj': broj, 'Naziv': naziv}
+
+    def __iter__(self):
+        return iter(self._by_id)
+
+    def __len__(self):
+        return len(self._by_id)
+
+class KontaChart(Mapping):
+    """Jedan kontni plan: normalizovan Broj -> id (rečnik, O(1)) i sortirani brojevi za prefiks/najbliže.
+
+    Brojevi i nazivi su internovani (sys.intern), pa više planova u KontaIndex deli iste stringove.
+    Koristi se svuda gde i obična mapa konta; meta je KontaMeta.
+    """
+    def __init__(self, rows):
+        ids, by_id = {}, {}
+        for r in rows:
+            kid = int(r[0]); broj = norm_konto(str(r[1] or '').strip())
+            if not broj: continue
+            ids[sys.intern(broj)] = kid
+            by_id[kid] = (sys.intern(broj), sys.intern(str(r[2] or '')))
+        self._ids = ids
+        self._by_id = by_id
+        self._sorted = sorted(ids)
+        self.meta = KontaMeta(by_id)
+
+    @classmethod
+    def from_maps(cls, konta_map, konta_meta):
+        if isinstance(konta_map, cls): return konta_map
+        return cls((kid, broj, (konta_meta.get(kid) or {}).get('Naziv', '')) for broj, kid in konta_map.items())
+
+    def __getitem__(self, broj):
+        return self._ids[broj]
+
+    def get(self, broj, default=None):
+        return self._ids.get(broj, default)
+
+    def __contains__(self, broj):
+        return broj in self._ids
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def suggest(self, konto, n=5):
+        """Rangirani predlozi za konto van plana: [(Broj, id, Naziv)], najduži zajednički prefiks prvi.
+
+        Kandidati su sintetika (najduži postojeći prefiks), analitike ispod konta i susedi u sortiranom
+        redosledu; bisect, bez prolaska kroz ceo plan.
+        """
+        k = norm_konto(str(konto or '').strip())
+        if not k: return []
+        cands = set()
+        for length in range(len(k) - 1, 0, -1):
+            if k[:length] in self._ids:
+                cands.add(k[:length]); break
+        i = bisect.bisect_left(self._sorted, k)
+        for b in self._sorted[max(0, i - n):i + n]:
+            cands.add(b)
+        def common(b):
+            return len(os.path.commonprefix([k, b]))
+        ranked = sorted((b for b in cands if b != k and common(b)), key=lambda b: (-common(b), abs(len(b) - len(k)), b))
+        return [(b, self._ids[b], self._by_id[self._ids[b]][1]) for b in ranked[:n]]
+
+class KontaIndex:
+    """Više kontnih planova odjednom (po serveru i bazi), npr. pri prelasku između preduzeća."""
+    def __init__(self):
+        self._charts = {}
+
+    def add(self, key, chart):
+        self._charts[key] = chart
+
+    def get(self, key):
+        return self._charts.get(key)
+
+    def __len__(self):
+        return len(self._charts)
+
+def suggest_konta(konta_map, konta_meta, konta, n=3):
+    """Predlozi za više konta van mape odjednom: {konto: [(Broj, id, Naziv)]}."""
+    chart = KontaChart.from_maps(konta_map, konta_meta)
+    return {k: chart.suggest(k, n) for k in konta}
+
+def build_konta_maps(rows):
+    """Iz redova (fk_kp_konto_id, Broj, Naziv) pravi mapu normalizovan Broj -> id (KontaChart) i meta po id-u."""
+    chart = KontaChart(rows)
+    return chart, chart.meta
+
+def konta_signature(row):
+    return [None if v is None else int(v) for v in row]
+
+def fetch_konta_signature(cn):
+    return konta_signature(sql_fetchall(cn, KONTA_SIG_SQL)[0])
+
+def load_settings(path=SETTINGS_FILE):
+    try:
+        with open(path, encoding='utf-8') as f: s = json.load(f)
+    except Exception:
+        return {}
+    return s if isinstance(s, dict) else {}
+
+def save_settings(settings, path=SETTINGS_FILE):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path + '.part', 'w', encoding='utf-8') as f: json.dump(settings, f, ensure_ascii=False, indent=1)
+    os.replace(path + '.part', path)
+
+class KontaCache:
+    """Lokalni SQLite keš kontnog plana (dbo.fk_kp_konto), po serveru i bazi. Radi i bez mreže."""
+    def __init__(self, path=KONTA_CACHE_DB):
+        self.path = path
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        db = sqlite3.connect(self.path)
+        db.execute('CREATE TABLE IF NOT EXISTS konta_sig (cache_key TEXT PRIMARY KEY, cnt INTEGER, chksum INTEGER, max_id INTEGER, fetched_at TEXT)')
+        db.execute('CREATE TABLE IF NOT EXISTS konta (cache_key TEXT, kid INTEGER, broj TEXT, naziv TEXT)')
+        db.execute('CREATE INDEX IF NOT EXISTS konta_key ON konta (cache_key)')
+        return db
+
+    def load(self, key):
+        """Vraća (rows, signature, fetched_at) ili None ako keš za ključ ne postoji."""
+        if not os.path.exists(self.path): return None
+        with contextlib.closing(self._connect()) as db:
+            sig = db.execute('SELECT cnt, chksum, max_id, fetched_at FROM konta_sig WHERE cache_key=?', (key,)).fetchone()
+            if sig is None: return None
+            rows = db.execute('SELECT kid, broj, naziv FROM konta WHERE cache_key=?', (key,)).fetchall()
+        return rows, list(sig[:3]), sig[3]
+
+    def save(self, key, rows, signature):
+        with contextlib.closing(self._connect()) as db, db:
+            db.execute('DELETE FROM konta WHERE cache_key=?', (key,))
+            db.executemany('INSERT INTO konta VALUES (?,?,?,?)', ((key, int(r[0]), str(r[1] or ''), str(r[2] or '')) for r in rows))
+            db.execute('INSERT OR REPLACE INTO konta_sig VALUES (?,?,?,?,?)', (key, *signature, datetime.now().isoformat(timespec='seconds')))
+
+def _xml_field(tag, text):
+    # Isto kao ElementTree: prazan tekst -> <tag />, tekst se escapuje (&, <, >)
+    if not text:
+        return f'<{tag} />'
+    return f'<{tag}>{xml_escape(text)}</{tag}>'
+
+class DokumentiXmlWriter:
+    """Strimuje <Dokumenti> direktno u fajl, element po element, bez stabla u memoriji."""
+    def __init__(self, f):
+        self.f = f
+        f.write("<?xml version='1.0' encoding='utf-8'?>\n<Dokumenti>")
+
+    def element(self, tag, fields):
+        self.f.write(f'<{tag}>' + ''.join(_xml_field(t, v) for t, v in fields) + f'</{tag}>')
+
+    def close(self):
+        self.f.write('</Dokumenti>')
+
+def stavka_tail(r):
+    """Deo stavke posle Redni_x0020_broj (ne zavisi od pozicije u nalogu), zajedno sa zatvaranjem elementa."""
+    fields = []
+    if r.datum: fields.append(('Datum_x0020_promene', r.datum))
+    if r.dokument: fields.append(('Broj_x0020_dokumenta', r.dokument))
+    if r.duguje: fields.append(('Duguje', r.duguje))
+    if r.potrazuje: fields.append(('Potrazuje', r.potrazuje))
+    if r.opis: fields.append(('Opis', r.opis))
+    fields += [('Subanalitika', ''), ('Valuta_x0020_ID', '1'), ('Kurs', '0')]
+    return ''.join(_xml_field(t, v) for t, v in fields) + '</Stavka_naloga_za_knjizenje>'
+
+class Job:
+    """Stanje pozadinskog posla: zahtev za prekid, napredak (obrađeno redova / ukupno) i metrike."""
+    def __init__(self, name, total=None):
+        self.name = name
+        self.total = total
+        self.done_rows = 0
+        self.started = time.monotonic()
+        self.cancel_event = threading.Event()
+        self.metrics = RunMetrics(name)
+
+    def progress(self, done_rows):
+        self.done_rows = done_rows
+
+def split_output_ext(path):
+    """Kao os.path.splitext, ali .xml.gz ostaje jedna ekstenzija: ('izlaz/nalog', '.xml.gz')."""
+    if path.lower().endswith('.xml.gz'): return path[:-7], path[-7:]
+    return os.path.splitext(path)
+
+def output_kind(target):
+    """'memory' za binarni objekat (io.BytesIO), inače po ekstenziji putanje: 'gzip', 'zip' ili 'xml'."""
+    if not isinstance(target, (str, os.PathLike)): return 'memory'
+    ext = split_output_ext(os.fspath(target))[1].lower()
+    return {'.xml.gz': 'gzip', '.zip': 'zip'}.get(ext, 'xml')
+
+class OutputSink:
+    """Odredište jednog XML-a: open() daje tekstualni tok, commit() ga objavljuje, abort() poništava.
+
+    Fajl se piše u <putanja>.part i preimenuje tek u commit(), pa prekid ne ostavlja polovičan izlaz.
+    .xml.gz i .zip (jedan XML u arhivi) komprimuju se dok se piše. Za binarni objekat (io.BytesIO)
+    XML ostaje u memoriji, za API pozivaoce kojima fajl ne treba.
+    """
+    def __init__(self, target):
+        self.target = target
+        self.kind = output_kind(target)
+        self.name = MEMORY_OUTPUT if self.kind == 'memory' else os.fspath(target)
+        self.part_path = None if self.kind == 'memory' else self.name + '.part'
+        self._text = self._raw = self._zip = None
+
+    def open(self):
+        text = dict(encoding='utf-8', newline='')
+        if self.kind == 'memory':
+            self._start = self.target.tell()
+            self._text = io.TextIOWrapper(self.target, **text)
+        elif self.kind == 'xml':
+            self._text = open(self.part_path, 'w', buffering=1 << 20, **text)
+        elif self.kind == 'gzip':
+            self._raw = open(self.part_path, 'wb')
+            member = os.path.basename(self.name)[:-3]
+            gz = gzip.GzipFile(member, 'wb', OUTPUT_COMPRESSLEVEL, self._raw)
+            self._text = io.TextIOWrapper(io.BufferedWriter(gz, 1 << 20), **text)
+        else:
+            self._zip = zipfile.ZipFile(self.part_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=OUTPUT_COMPRESSLEVEL)
+            # ZipInfo zbog vremena izmene (sa samim imenom član dobija 1980-01-01). open(ZipInfo) ne preuzima
+            # nivo od arhive: do Python 3.13 važi podrazumevani nivo zlib-a (6, isto što i OUTPUT_COMPRESSLEVEL).
+            member = zipfile.ZipInfo(split_output_ext(os.path.basename(self.name))[0] + '.xml', time.localtime()[:6])
+            member.compress_type = zipfile.ZIP_DEFLATED
+            if hasattr(member, 'compress_level'): member.compress_level = OUTPUT_COMPRESSLEVEL
+            self._text = io.TextIOWrapper(self._zip.open(member, 'w', force_zip64=True), **text)
+        return self._text
+
+    def _close(self):
+        text, self._text = self._text, None
+        if text is not None:
+            if self.kind == 'memory':
+                text.flush()
+                text.detach()  # zatvaranje omotača bi zatvorilo i BytesIO pozivaoca
+            else:
+                text.close()
+        for f in (self._zip, self._raw):
+            if f is not None: f.close()
+        self._zip = self._raw = None
+
+    def commit(self):
+        self._close()
+        if self.part_path: os.replace(self.part_path, self.name)
+
+    def abort(self):
+        try: self._close()
+        except Exception: pass
+        if self.part_path:
+            try: os.remove(self.part_path)
+            except Exception: pass
+        elif hasattr(self, '_start'):
+            self.target.seek(self._start)
+            self.target.truncate()
+
+def open_output(source):
+    """Binarni tok sa XML-om iz izlaza koji piše OutputSink (putanja .xml/.xml.gz/.zip ili io.BytesIO)."""
+    kind = output_kind(source)
+    if kind == 'memory': return io.BytesIO(source.getvalue())
+    if kind == 'gzip': return gzip.open(source, 'rb')
+    if kind == 'zip':
+        # zatvaranjem arhive otvoren član ostaje čitljiv; fajl se zatvara kad se zatvori i član
+        with zipfile.ZipFile(source) as zf:
+            names = [n for n in zf.namelist() if n.lower().endswith('.xml')]
+            if len(names) != 1:
+                raise ValueError(f'{os.path.basename(source)}: ZIP treba da sadrži tačno jedan XML (ima {len(names)})')
+            return zf.open(names[0])
+    return open(source, 'rb')
+
+def output_size(target):
+    """Veličina izlaza u bajtovima (na disku, dakle posle kompresije)."""
+    if output_kind(target) == 'memory': return target.getbuffer().nbytes
+    return os.path.getsize(target) if os.path.exists(target) else 0
+
+_DEBUG_SEQ = itertools.count(1)
+
+def debug_log_path(out_path):
+    """<ime>_debug_<vreme>_<pid>_<n>.csv pored izlaza: jedinstveno po procesu i pozivu, pa se paralelni poslovi
+    (convert_many, watch, više GUI-ja) ne gaze ni kad počnu u istoj sekundi."""
+    stem = split_output_ext(out_path)[0]
+    return _unique_path(f"{stem}_debug_{datetime.now():%Y%m%d_%H%M%S}_{os.getpid()}_{next(_DEBUG_SEQ)}.csv")
+
+def write_nalog_xml(prepared, out_path, sifra, tip_name, napomena, konta_meta, debug_rows,
+                    nalog_id=NALOG_ID_BASE, progress=None, cancel=None):
+    """Upisuje jedan Nalog_za_knjiženje iz pripremljenih delova (prepare_frame) u out_path.
+
+    out_path je putanja (.xml, .xml.gz, .zip) ili io.BytesIO, vidi OutputSink. Ako delovi imaju kolonu 'tail' (FragmentCache), ona se koristi umesto ponovnog sklapanja stavke;
+    ID-evi i Redni_x0020_broj se uvek dodeljuju pri pisanju. Preskočeni redovi se dodaju u debug_rows (lista ili SkipLog). Vraća (broj stavki, broj konta van mape).
+    Pri grešci ili prekidu (cancel je threading.Event) ne ostaje polovičan fajl.
+    """
+    tip_id = TIP_MAP.get(tip_name, 24)
+    # Zaglavlje čeka prvi datum iz podataka
+    header_date, prepared = split_header_date(prepared)
+    header_date = header_date or datetime.now().strftime('%Y-%m-%dT00:00:00+02:00')
+    used_kids = set()
+    rb = 1
+    n = 0
+    not_in_map = 0
+    # Sink piše u privremeni fajl i preimenuje ga tek na kraju, da prekid ne ostavi polovičan XML
+    sink = OutputSink(out_path)
+    try:
+        f = sink.open()
+        xw = DokumentiXmlWriter(f)
+        xw.element('Nalog_za_knjiženje', [
+            ('Šifra_x0020_preduzeca', sifra),
+            ('fk_nk_nalog_za_knjizenje_id', str(nalog_id)),
+            ('Status', '2'),
+            ('tip_x0020_id', str(tip_id)),
+            ('Tip', tip_name),
+            ('Broj', f'<{nalog_id}>'),
+            ('Org_x0020_broj', f'<{nalog_id}>'),
+            ('Datum', header_date),
+            ('Napomena', napomena),
+            ('Spoljni_x0020_broj', napomena),
+        ])
+        for r in itertools.chain.from_iterable(p.itertuples(index=False) for p in prepared):
+            n += 1
+            if n % 2000 == 0:
+                if cancel is not None and cancel.is_set(): raise JobCancelled()
+                if progress: progress(n)
+            if r.skip_reason:
+                if r.skip_reason == SKIP_NOT_IN_MAP: not_in_map += 1
+                # kao i ranije: konto iz mape dobija Konto blok i kad su svi njegovi redovi sa nultim iznosom
+                elif r.skip_reason == SKIP_ZERO: used_kids.add(int(r.konto_id))
+                debug_rows.append({'row': r.row, 'status':'SKIP','reason':r.skip_reason,'konto_raw':r.konto_raw,'konto_norm':r.konto_norm})
+                continue
+            konto_id = int(r.konto_id)
+            used_kids.add(konto_id)
+            f.write('<Stavka_naloga_za_knjizenje>'
+                    f'<fk_nk_stavka_naloga_za_knjizenje_id>{nalog_id + rb}</fk_nk_stavka_naloga_za_knjizenje_id>'
+                    f'<fk_nk_nalog_za_knjizenje_id>{nalog_id}</fk_nk_nalog_za_knjizenje_id>'
+                    f'<fk_kp_konto_id>{konto_id}</fk_kp_konto_id>'
+                    f'<Redni_x0020_broj>{rb}</Redni_x0020_broj>' + (getattr(r, 'tail', None) or stavka_tail(r)))
+            rb += 1
+        for kid in sorted(used_kids):
+            meta = konta_meta.get(kid, {'Broj':'', 'Naziv':''})
+            xw.element('Konto', [
+                ('fk_kp_konto_id', str(kid)),
+                ('Broj', str(meta.get('Broj',''))),
+                ('Naziv', str(meta.get('Naziv',''))),
+                ('Dozvoljeno_x0020_knjiženje', '1'),
+                ('Devizni', '0'),
+            ])
+        xw.close()
+        if cancel is not None and cancel.is_set(): raise JobCancelled()
+        sink.commit()
+    except BaseException:
+        sink.abort()
+        raise
+    if progress: progress(n)
+    return rb - 1, not_in_map
+
+def _amount_total(col):
+    return sum((Decimal(v) for v in col.dropna()), Decimal(0))
+
+def _document_runs(doc):
+    """Početak i dužina svakog niza uzastopnih redova sa istim dokumentom (doc je niz vrednosti kolone)."""
+    starts = np.flatnonzero(np.r_[True, doc[1:] != doc[:-1]]) if len(doc) else np.arange(0)
+    return starts, np.diff(np.r_[starts, len(doc)])
+
+def _pack_bounds(sizes, max_stavki, new_group=None):
+    """Granice delova (od, do) u redovima, za uzastopne dokumente dužina sizes.
+
+    Celi dokumenti se pakuju u delove do max_stavki stavki. Dokument veći od toga ide ceo u svoj deo,
+    jer je svaki deo zaseban nalog i mora biti uravnotežen; deli se tek preko MAX_STAVKI_PER_NALOG.
+    new_group[i] je True kad dokument i počinje novu grupu (mesec), koju deo ne prelazi.
+    """
+    bounds, start, pos = [], 0, 0
+    for i, n in enumerate(sizes.tolist()):
+        if pos > start and (pos - start + n > max_stavki or (new_group is not None and new_group[i])):
+            bounds.append((start, pos))
+            start = pos
+        if n > MAX_STAVKI_PER_NALOG:
+            bounds += [(a, min(a + MAX_STAVKI_PER_NALOG, pos + n)) for a in range(pos, pos + n, MAX_STAVKI_PER_NALOG)]
+            start = pos + n
+        pos += n
+    if pos > start: bounds.append((start, pos))
+    return bounds
+
+def _shard_key(doc, a, b):
+    """Ključ dela u manifestu: dokument, ili 'prvi … poslednji' kad deo ima više dokumenata."""
+    return doc[a] if (doc[a:b] == doc[a]).all() else f'{doc[a]} … {doc[b - 1]}'
+
+def _month_order(ok):
+    """Redosled redova za podelu po mesecu: dokumenti po mesecu prvog datuma promene, zatim redom iz fajla.
+
+    Vraća (pozicije redova, mesec po redu u tom redosledu).
+    """
+    codes = pd.factorize(ok['dokument'])[0]
+    month = ok['datum'].str[:7]
+    doc_month = month.groupby(codes).first().reindex(range(codes.max() + 1)).fillna('').to_numpy(dtype=object)
+    row_month = doc_month[codes]
+    order = np.lexsort((codes, row_month))
+    return order, row_month[order]
+
+def write_sharded(prepared, out_path, sifra, tip_name, napomena, konta_meta, debug_rows, split_by='rows',
+                  max_stavki=MAX_STAVKI_PER_NALOG, workers=None, progress=None, cancel=None):
+    """Deli izlaz na više XML fajlova (po broju stavki, dokumentu ili mesecu datuma promene).
+
+    Svaki deo je zaseban Nalog_za_knjiženje sa svojim nalog id-em (NALOG_ID_BASE + i * NALOG_ID_STRIDE),
+    pa su i id-evi stavki jedinstveni. MPP svaki deo uvozi kao poseban nalog, pa se u svim načinima celi
+    dokumenti pakuju u delove do max_stavki stavki (vidi _pack_bounds): 'rows' uzima uzastopne redove istog
+    dokumenta i piše delove dok čita (memorija ne raste sa veličinom fajla), 'dokument' skuplja sve redove
+    dokumenta, a 'month' još i ne meša mesece (mesec dokumenta je mesec njegovog prvog datuma promene).
+    Delovi se pišu paralelno, u formatu koji daje ekstenzija out_path (.xml, .xml.gz, .zip), a uz njih
+    i manifest (JSON). Ako bi delova bilo više od MAX_SHARDS (id-evi bi prešli int32), ValueError.
+    Vraća rečnik sa rezimeom i listom delova.
+    """
+    if split_by not in SPLIT_MODES:
+        raise ValueError(f'Nepoznat način podele: {split_by}')
+    if output_kind(out_path) == 'memory':
+        raise ValueError('Podeljen izlaz (više fajlova i manifest) zahteva putanju, ne bafer u memoriji')
+    max_stavki = max(1, min(int(max_stavki), MAX_STAVKI_PER_NALOG))
+    counts = {'rows': 0, 'not_in_map': 0}
+    def ok_frames():
+        for prep in prepared:
+            if cancel is not None and cancel.is_set(): raise JobCancelled()
+            skip = prep['skip_reason'] != ''
+            counts['not_in_map'] += int((prep['skip_reason'] == SKIP_NOT_IN_MAP).sum())
+            debug_rows.extend({'row': r.row, 'status':'SKIP','reason':r.skip_reason,'konto_raw':r.konto_raw,'konto_norm':r.konto_norm}
+                              for r in prep[skip].itertuples(index=False))
+            counts['rows'] += len(prep)
+            if progress: progress(counts['rows'])
+            yield prep[~skip]
+    def sliced(frame, month=None, final=True):
+        """Delovi iz frame (dokumenti su u njemu uzastopni); bez final poslednji deo ostaje otvoren i vraća se."""
+        doc = frame['dokument'].to_numpy(dtype=object)
+        starts, sizes = _document_runs(doc)
+        new_group = None if month is None else np.r_[False, month[starts][1:] != month[starts][:-1]]
+        bounds = _pack_bounds(sizes, max_stavki, new_group)
+        if not final and bounds: bounds, rest = bounds[:-1], bounds[-1][0]
+        else: rest = len(frame)
+        return [(month[a] if month is not None else _shard_key(doc, a, b), frame.iloc[a:b]) for a, b in bounds], frame.iloc[rest:]
+    def pieces():
+        if split_by == 'rows':
+            # uzastopni redovi istog dokumenta; u memoriji je samo deo koji se još puni i tekući blok
+            buf = None
+            for f in ok_frames():
+                buf = f if buf is None else pd.concat([buf, f])
+                done, buf = sliced(buf, final=False)
+                yield from done
+            if buf is not None: yield from sliced(buf)[0]
+            return
+        ok = [f for f in ok_frames() if len(f)]
+        if not ok: return
+        ok = pd.concat(ok)
+        if split_by == 'dokument':
+            # svi redovi dokumenta zajedno, dokumenti po prvom pojavljivanju
+            yield from sliced(ok.iloc[np.argsort(pd.factorize(ok['dokument'])[0], kind='stable')])[0]
+        else:
+            order, month = _month_order(ok)
+            yield from sliced(ok.iloc[order], month)[0]
+    stem, ext = split_output_ext(out_path)
+    shards, stavki = [], 0
+    def write(i, g):
+        # ukupan broj delova se ne zna dok se čita, pa napomena nosi samo redni broj dela
+        write_nalog_xml([g], shards[i]['file'], sifra, tip_name, f'{napomena} (deo {i + 1})',
+                        konta_meta, [], nalog_id=shards[i]['nalog_id'], cancel=cancel)
+    workers = workers or 4
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            running = set()
+            for key, g in pieces():
+                if len(shards) == MAX_SHARDS:
+                    raise ValueError(f'Podela daje više od {MAX_SHARDS} delova (id-evi naloga bi prešli opseg int32). '
+                                     f'Povećaj najviše stavki po nalogu ili izaberi drugu podelu.')
+                i = len(shards)
+                sh = {
+                    'file': f'{stem}_{i + 1:03d}{ext or ".xml"}',
+                    'key': key,
+                    'nalog_id': NALOG_ID_BASE + i * NALOG_ID_STRIDE,
+                    'stavki': len(g),
+                    'first_row': int(g['row'].iloc[0]),
+                    'last_row': int(g['row'].iloc[-1]),
+                    'duguje': str(_amount_total(g['duguje'])),
+                    'potrazuje': str(_amount_total(g['potrazuje'])),
+                }
+                shards.append(sh)
+                stavki += len(g)
+                running.add(pool.submit(write, i, g))
+                if len(running) >= 2 * workers:  # čitanje ne sme da odmakne pisanju (memorija)
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    for fut in done: fut.result()
+            for fut in running: fut.result()
+    except BaseException:
+        for sh in shards:
+            try: os.remove(sh['file'])
+            except Exception: pass
+        raise
+    manifest = stem + '_manifest.json'
+    if shards:
+        with open(manifest, 'w', encoding='utf-8') as f:
+            json.dump({
+                'created': datetime.now().isoformat(timespec='seconds'),
+                'split_by': split_by,
+                'max_stavki': max_stavki,
+                'stavki': stavki,
+                'shards': [dict(sh, file=os.path.basename(sh['file'])) for sh in shards],
+            }, f, ensure_ascii=False, indent=1)
+    return {'stavki': stavki, 'not_in_map': counts['not_in_map'], 'shards': shards, 'manifest': manifest if shards else None}
+
+# --- Provera generisanog XML-a (pre uvoza u MPP) ---
+VERIFY_MAX_MESSAGES = 50  # toliko grešaka/upozorenja se navodi, ostala se samo broje
+
+class IdRanges:
+    """Skup celih brojeva kao sortirani disjunktni intervali: uzastopni id-evi zauzimaju jedan interval."""
+    def __init__(self):
+        self._starts, self._ends = [], []
+
+    def add(self, x):
+        """Dodaje x; vraća False ako je x već u skupu."""
+        i = bisect.bisect_right(self._starts, x) - 1
+        if i >= 0 and x <= self._ends[i]: return False
+        left = i >= 0 and self._ends[i] == x - 1
+        right = i + 1 < len(self._starts) and self._starts[i + 1] == x + 1
+        if left and right:
+            self._ends[i] = self._ends[i + 1]
+            del self._starts[i + 1], self._ends[i + 1]
+        elif left:
+            self._ends[i] = x
+        elif right:
+            self._starts[i + 1] = x
+        else:
+            self._starts.insert(i + 1, x)
+            self._ends.insert(i + 1, x)
+        return True
+
+    def __len__(self):
+        return len(self._starts)
+
+_XML_DATE = re.compile(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}[+-]\d{2}:\d{2}')  # kao pri pisanju: 2024-01-31T00:00:00+02:00
+
+def _int_text(el, tag):
+    try:
+        return int(el.findtext(tag))
+    except (TypeError, ValueError):
+        return None
+
+class XmlVerifier:
+    """Provera Dokumenti XML-a u jednom linearnom prolazu (iterparse), u konstantnoj memoriji.
+
+    Proverava ispravnost XML-a, jedinstvenost id-eva stavki i naloga (i između delova), da svaka stavka
+    ima svoj nalog i Konto blok u istom fajlu, format i ispravnost datuma (Datum naloga, Datum_x0020_promene)
+    i da je zbir duguje jednak zbiru potražuje (Decimal, tačno), ukupno i u svakom nalogu.
+    Više fajlova (delovi iz manifesta) proverava se kao jedna celina; rezultat daje finish().
+    """
+    def __init__(self):
+        self.files = []
+        self.errors, self.warnings = [], []
+        self.error_count = self.warning_count = 0
+        self.stavki = self.konta = self.bytes = 0
+        self.duguje = self.potrazuje = Decimal(0)
+        self.nalozi = {}  # nalog id -> {'stavki', 'duguje', 'potrazuje'}
+        self._ids = IdRanges()
+        self._dates = set()  # već proverene ispravne vrednosti datuma (ponavljaju se)
+        self._t0 = time.perf_counter()
+        self._result = None
+
+    def error(self, msg):
+        self.error_count += 1
+        if len(self.errors) < VERIFY_MAX_MESSAGES: self.errors.append(msg)
+
+    def warning(self, msg):
+        self.warning_count += 1
+        if len(self.warnings) < VERIFY_MAX_MESSAGES: self.warnings.append(msg)
+
+    def feed(self, path, progress=None):
+        """Proverava jedan izlaz (vidi open_output); progress(pročitano bajtova XML-a) se zove na svakih 10000 stavki."""
+        name = os.path.basename(path) if output_kind(path) != 'memory' else MEMORY_OUTPUT
+        self.files.append(name)
+        totals, headers, referenced, konta, last_rb = {}, set(), {}, set(), {}
+        try:
+            with open_output(path) as f:
+                root = None
+                for event, el in ET.iterparse(f, events=('start', 'end')):
+                    if root is None:
+                        root = el
+                        if el.tag != 'Dokumenti': self.error(f'{name}: koreni element je <{el.tag}>, a ne <Dokumenti>')
+                    if event == 'start': continue
+                    if el.tag == 'Stavka_naloga_za_knjizenje':
+                        self._stavka(name, el, totals, referenced, last_rb)
+                        if progress and self.stavki % 10000 == 0: progress(self.bytes + f.tell())
+                    elif el.tag == 'Nalog_za_knjiženje':
+                        self._nalog(name, el, totals, headers)
+                    elif el.tag == 'Konto':
+                        kid = _int_text(el, 'fk_kp_konto_id')
+                        if kid is None: self.error(f'{name}: Konto bez fk_kp_konto_id')
+                        elif kid in konta: self.warning(f'{name}: Konto {kid} je naveden više puta')
+                        else: konta.add(kid)
+                    else:
+                        continue  # polja stavke/naloga ostaju u roditelju dok se on ne obradi
+                    root.clear()  # obrađeni elementi se ne drže u memoriji
+                self.bytes += f.tell()
+        except ET.ParseError as e:
+            self.error(f'{name}: neispravan XML ({e})'); return
+        except (OSError, EOFError, ValueError, zipfile.BadZipFile) as e:
+            self.error(f'{name}: {e}'); return
+        for kid, sid in referenced.items():
+            if kid not in konta: self.error(f'{name}: konto {kid} (npr. stavka {sid}) nema Konto blok')
+        for kid in sorted(konta - referenced.keys()):
+            self.warning(f'{name}: Konto {kid} se ne koristi ni u jednoj stavci')
+        if not headers: self.error(f'{name}: nema Nalog_za_knjiženje')
+        for nid, t in totals.items():
+            if nid not in headers:
+                self.error(f'{name}: stavke upućuju na nalog {nid}, koji ne postoji u fajlu'); continue
+            if not t['stavki']: self.error(f'{name}: nalog {nid} nema nijednu stavku')
+            if nid in self.nalozi: self.error(f'{name}: id naloga {nid} se ponavlja (i u drugom fajlu)')
+            self.nalozi[nid] = t
+        self.konta += len(konta)
+
+    def _date_ok(self, text):
+        if text in self._dates: return True
+        if not _XML_DATE.fullmatch(text): return False
+        try:
+            datetime.fromisoformat(text)
+        except ValueError:  # npr. 2024-02-30
+            return False
+        self._dates.add(text)
+        return True
+
+    def _nalog(self, name, el, totals, headers):
+        nid = _int_text(el, 'fk_nk_nalog_za_knjizenje_id')
+        if nid is None:
+            self.error(f'{name}: Nalog_za_knjiženje bez fk_nk_nalog_za_knjizenje_id'); return
+        if nid in headers: self.error(f'{name}: nalog {nid} je naveden više puta')
+        headers.add(nid)
+        datum = el.findtext('Datum')
+        if datum is None: self.error(f'{name}: nalog {nid} nema Datum')
+        elif not self._date_ok(datum): self.error(f'{name}: nalog {nid}: Datum nije ispravan ({datum!r})')
+        totals.setdefault(nid, {'stavki': 0, 'duguje': Decimal(0), 'potrazuje': Decimal(0)})
+
+    def _stavka(self, name, el, totals, referenced, last_rb):
+        self.stavki += 1
+        sid = _int_text(el, 'fk_nk_stavka_naloga_za_knjizenje_id')
+        label = f'{name}: stavka {sid if sid is not None else "#" + str(self.stavki)}'
+        if sid is None: self.error(f'{label} nema fk_nk_stavka_naloga_za_knjizenje_id')
+        elif not self._ids.add(sid): self.error(f'{label}: id stavke se ponavlja')
+        kid = _int_text(el, 'fk_kp_konto_id')
+        if kid is None: self.error(f'{label} nema fk_kp_konto_id')
+        else: referenced.setdefault(kid, sid)
+        nid = _int_text(el, 'fk_nk_nalog_za_knjizenje_id')
+        if nid is None:
+            self.error(f'{label} nema fk_nk_nalog_za_knjizenje_id'); return
+        t = totals.setdefault(nid, {'stavki': 0, 'duguje': Decimal(0), 'potrazuje': Decimal(0)})
+        t['stavki'] += 1
+        datum = el.findtext('Datum_x0020_promene')
+        if datum is not None and not self._date_ok(datum):
+            self.error(f'{label}: Datum_x0020_promene nije ispravan ({datum!r})')
+        rb = _int_text(el, 'Redni_x0020_broj')
+        if rb is not None:
+            if rb != last_rb.get(nid, 0) + 1: self.warning(f'{label}: redni broj {rb} posle {last_rb.get(nid, 0)}')
+            last_rb[nid] = rb
+        amounts = 0
+        for tag, key in (('Duguje', 'duguje'), ('Potrazuje', 'potrazuje')):
+            text = el.findtext(tag)
+            if text is None: continue
+            try:
+                v = Decimal(text)
+            except InvalidOperation:
+                v = None
+            if v is None or not v.is_finite():
+                self.error(f'{label}: {tag} nije broj ({text!r})'); continue
+            t[key] += v
+            amounts += 1
+        if not amounts: self.warning(f'{label} nema iznos')
+
+    def finish(self):
+        """Zbirne provere (ravnoteža) i rezime kao rečnik; 'ok' je False ako postoji bar jedna greška."""
+        if self._result is not None: return self._result
+        for t in self.nalozi.values():
+            self.duguje += t['duguje']
+            self.potrazuje += t['potrazuje']
+        diff = self.duguje - self.potrazuje
+        if diff:
+            self.error(f'Nalog nije uravnotežen: duguje {self.duguje} ≠ potražuje {self.potrazuje} (razlika {diff})')
+        if len(self.nalozi) > 1:  # MPP svaki nalog uvozi zasebno i odbija neuravnotežen
+            for nid, t in self.nalozi.items():
+                if t['duguje'] != t['potrazuje']:
+                    self.error(f"Nalog {nid} sam za sebe nije uravnotežen (razlika {t['duguje'] - t['potrazuje']})")
+        self._result = {
+            'ok': not self.error_count,
+            'files': self.files,
+            'naloga': len(self.nalozi),
+            'stavki': self.stavki,
+            'konta': self.konta,
+            'duguje': str(self.duguje),
+            'potrazuje': str(self.potrazuje),
+            'difference': str(diff),
+            'bytes': self.bytes,
+            'seconds': round(time.perf_counter() - self._t0, 3),
+            'error_count': self.error_count,
+            'errors': self.errors,
+            'warning_count': self.warning_count,
+            'warnings': self.warnings,
+        }
+        return self._result
+
+def verify_output(path, progress=None):
+    """Proverava generisani XML, ili za *_manifest.json sve delove zajedno i njihove zbirove prema manifestu."""
+    v = XmlVerifier()
+    if isinstance(path, str) and path.lower().endswith('.json'):
+        with open(path, encoding='utf-8') as f: manifest = json.load(f)
+        base = os.path.dirname(os.path.abspath(path))
+        for sh in manifest.get('shards', []):
+            v.feed(os.path.join(base, sh['file']), progress)
+            t = v.nalozi.get(sh['nalog_id'])
+            if t is None:
+                v.error(f"{sh['file']}: nema naloga {sh['nalog_id']} iz manifesta")
+            elif (t['stavki'], t['duguje'], t['potrazuje']) != (sh['stavki'], Decimal(sh['duguje']), Decimal(sh['potrazuje'])):
+                v.error(f"{sh['file']}: stavke/zbirovi ({t['stavki']}, {t['duguje']}, {t['potrazuje']}) se razlikuju "
+                        f"od manifesta ({sh['stavki']}, {sh['duguje']}, {sh['potrazuje']})")
+    else:
+        v.feed(path, progress)
+    return v.finish()
+
+def verify_lines(result, top=5):
+    """Rezime provere za log: jedna linija i prvih top grešaka/upozorenja."""
+    head = (f"Provera XML-a: {'OK' if result['ok'] else 'GREŠKE ' + str(result['error_count'])}; "
+            f"naloga {result['naloga']}, stavki {result['stavki']}, duguje {result['duguje']}, "
+            f"potražuje {result['potrazuje']}, {result['seconds']} s")
+    if result['warning_count']: head += f", upozorenja {result['warning_count']}"
+    return [head] + ['   ' + e for e in result['errors'][:top]] + ['   upozorenje: ' + w for w in result['warnings'][:top]]
+
+DEBUG_FIELDS = ['row','status','reason','konto_raw','konto_norm']
+
+class SkipLog:
+    """Preskočeni redovi: upisuju se u debug CSV čim se pojave i broje po razlogu i po kontu.
+
+    Ponaša se kao lista za write_nalog_xml/write_sharded (append, extend, len), ali ne čuva redove u memoriji.
+    CSV se piše u <path>.part i objavljuje tek pri uspešnom zatvaranju; posle greške ili prekida (izuzetak
+    u with bloku) briše se, kao i polovičan XML.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.count = 0
+        self.by_reason = collections.Counter()
+        self.by_konto = collections.Counter()  # (razlog, konto) -> broj redova
+        self._lock = threading.Lock()
+        self._f = self._w = None
+        if path:
+            self._f = open(path + '.part', 'w', newline='', encoding='utf-8', buffering=1 << 16)
+            self._w = csv.DictWriter(self._f, fieldnames=DEBUG_FIELDS)
+            self._w.writeheader()
+
+    def append(self, rec):
+        self.extend((rec,))
+
+    def extend(self, recs):
+        with self._lock:
+            for rec in recs:
+                self.count += 1
+                self.by_reason[rec['reason']] += 1
+                self.by_konto[(rec['reason'], rec['konto_norm'] or rec['konto_raw'] or '')] += 1
+                if self._w: self._w.writerow(rec)
+
+    def __len__(self):
+        return self.count
+
+    def close(self, keep=True):
+        with self._lock:
+            if self._f is not None:
+                self._f.close()
+                self._f = self._w = None
+                if keep:
+                    os.replace(self.path + '.part', self.path)
+                else:
+                    try: os.remove(self.path + '.part')
+                    except OSError: pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        self.close(keep=exc_type is None)
+
+    def top_konta(self, reason=SKIP_NOT_IN_MAP, n=10):
+        return [(k, c) for (r, k), c in self.by_konto.most_common() if r == reason][:n]
+
+    def as_dict(self, top=20):
+        return {'skipped': self.count, 'by_reason': dict(self.by_reason),
+                'not_in_map_konta': dict(self.top_konta(n=top)),
+                'not_in_map_distinct': sum(1 for r, _ in self.by_konto if r == SKIP_NOT_IN_MAP)}
+
+def skip_summary_lines(summary, top=10):
+    """Rezime preskočenih redova za log (iz SkipLog.as_dict): po razlogu i najčešća konta van mape."""
+    if not summary or not summary['skipped']: return []
+    by_reason = sorted(summary['by_reason'].items(), key=lambda kv: -kv[1])
+    lines = [f"Preskočeno {summary['skipped']} redova: " + ', '.join(f'{r} {c}' for r, c in by_reason)]
+    if summary['not_in_map_distinct']:
+        konta = list(summary['not_in_map_konta'].items())[:top]
+        lines.append(f"Konta van mape ({summary['not_in_map_distinct']} različitih), najčešća: " +
+                     ', '.join(f'{k or "(prazno)"} ×{c}' for k, c in konta))
+        for k, _ in konta:
+            sug = summary.get('suggestions', {}).get(k)
+            if sug: lines.append(f'   {k} → možda: ' + ', '.join(f'{b} ({naziv})' if naziv else b for b, _, naziv in sug))
+    return lines
+
+SUGGESTION_FIELDS = ['konto', 'redova', 'predlog_1', 'predlog_2', 'predlog_3']
+
+def write_suggestions_csv(path, skips, konta_map, konta_meta):
+    """Za svako konto van mape: broj redova i do tri predloga iz kontnog plana. Vraća predloge po kontu."""
+    counts = [(k, c) for (r, k), c in skips.by_konto.most_common() if r == SKIP_NOT_IN_MAP]
+    sug = suggest_konta(konta_map, konta_meta, [k for k, _ in counts])
+    if path:
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            w = csv.writer(f)
+            w.writerow(SUGGESTION_FIELDS)
+            for k, c in counts:
+                w.writerow([k, c] + [f'{b} {naziv}'.strip() for b, _, naziv in sug[k]])
+    return sug
+
+# --- Biblioteka / bez GUI-ja ---
+def _timed_chunks(chunks, metrics, stage):
+    """Prosleđuje delove iz chunks i meri vreme provedeno u njihovom čitanju."""
+    chunks = iter(chunks)
+    while True:
+        t0 = time.perf_counter()
+        chunk = next(chunks, None)
+        if chunk is None:
+            metrics.add(stage, time.perf_counter() - t0)
+            return
+        metrics.add(stage, time.perf_counter() - t0, len(chunk))
+        yield chunk
+
+FRAGMENT_COLS = ['konto_raw', 'konto_norm', 'konto_id', 'datum', 'dokument', 'duguje', 'potrazuje', 'opis', 'skip_reason', 'tail']
+
+def konta_map_version(konta_map):
+    return hash(frozenset(konta_map.items()))
+
+def _file_signature(path):
+    st = os.stat(path)
+    return (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+
+class FragmentCache:
+    """Keš pripremljenih redova između dva generisanja istog XLSX-a (u memoriji, za jednu radnu svesku).
+
+    Ključ reda je otisak sadržaja mapiranih ćelija (pd.util.hash_pandas_object); uz njega se čuva
+    pripremljen red i gotov XML stavke bez ID-eva (stavka_tail). Posle izmene par ćelija ponovo se
+    pripremaju samo izmenjeni redovi; ID-evi i Redni_x0020_broj dodeljuju se pri pisanju. Ako se
+    fajl uopšte nije menjao (veličina, vreme izmene), ni XLSX se ne čita ponovo. Promena mape konta
+    ili kolona briše keš.
+    """
+    def __init__(self):
+        self.version = None
+        self.rows = {}
+        self.layout = None  # (potpis fajla, [(indeks, otisci) po delu])
+        self.hits = self.misses = 0
+
+    def frames(self, reader, mapping, konta_map, cancel=None, prepare=None):
+        """Pripremljeni delovi (kao prepare_frame, plus kolona 'tail') za ceo list."""
+        prepare = prepare or (lambda chunk: prepare_frame(chunk, mapping, konta_map))
+        version = (konta_map_version(konta_map), tuple(sorted(mapping.items())))
+        if version != self.version:
+            self.version, self.rows, self.layout = version, {}, None
+        self.hits = self.misses = 0
+        sig = _file_signature(reader.path)
+        if self.layout is not None and self.layout[0] == sig:
+            for index, hashes in self.layout[1]:
+                if cancel is not None and cancel.is_set(): raise JobCancelled()
+                self.hits += len(hashes)
+                yield self._frame(index, hashes)
+            return
+        layout = []
+        cols = list(dict.fromkeys(mapping.values()))
+        for chunk in reader.iter_chunks(columns=cols, cancel=cancel):
+            hashes = pd.util.hash_pandas_object(chunk, index=False).to_numpy()
+            miss = np.fromiter((h not in self.rows for h in hashes), dtype=bool, count=len(hashes))
+            if miss.any():
+                prep = prepare(chunk[miss])
+                prep['tail'] = [None if r.skip_reason else stavka_tail(r) for r in prep.itertuples(index=False)]
+                prep['konto_id'] = prep['konto_id'].astype(object).where(prep['konto_id'].notna(), None)
+                self.rows.update(zip(hashes[miss], prep[FRAGMENT_COLS].itertuples(index=False, name=None)))
+            self.misses += int(miss.sum())
+            self.hits += int(len(miss) - miss.sum())
+            layout.append((chunk.index.to_numpy(), hashes))
+            yield self._frame(layout[-1][0], hashes)
+        live = {h for _, hashes in layout for h in hashes}
+        if len(live) < len(self.rows):
+            self.rows = {h: self.rows[h] for h in live}
+        self.layout = (sig, layout)
+
+    def _frame(self, index, hashes):
+        df = pd.DataFrame.from_records([self.rows[h] for h in hashes], columns=FRAGMENT_COLS, index=index)
+        df.insert(0, 'row', index + 2)
+        df['konto_id'] = df['konto_id'].astype('Int64')
+        return df
+
+def convert_file(xlsx_path, out_path, sifra, konta_map, konta_meta, tip_name='Tekući promet',
+                 napomena='Generisano iz XLSX', debug_csv=None, progress=None, cancel=None,
+                 split_by=None, max_stavki=MAX_STAVKI_PER_NALOG, workers=None, metrics=None, profile=None,
+                 fragments=None, verify=True):
+    """Konvertuje jedan XLSX u MPP XML bez GUI-ja. Vraća rečnik sa rezimeom (stavki, preskočeno, ...).
+
+    Preskočeni redovi se upisuju u debug_csv dok se fajl obrađuje (SkipLog), a u rezultatu su
+    zbirno po razlogu i kontu (skip_summary).
+    out_path može biti .xml, .xml.gz ili .zip (komprimuje se dok se piše) ili io.BytesIO (XML ostaje u memoriji).
+    Sa split_by ('rows', 'dokument', 'month') izlaz se deli na više fajlova, vidi write_sharded.
+    Sa fragments (FragmentCache) ponovo se pripremaju samo redovi izmenjeni od prethodnog poziva.
+    Sa verify izlaz se posle pisanja proverava (verify_output); rezime je u result['verify'].
+    Ako nije nastala nijedna stavka, izlaz se ne zadržava, a result['error'] opisuje zašto (kao u GUI-ju).
+    Vreme po fazama (open, read, prepare, write) beleži se u metrics (RunMetrics);
+    sa profile=putanja čitanje/priprema/pisanje se profiliše (cProfile) u taj fajl.
+    """
+    t0 = time.perf_counter()
+    own_metrics = metrics is None
+    metrics = metrics or RunMetrics('convert')
+    with metrics.stage('open'):
+        reader = open_reader(xlsx_path)
+        mapping, missing = find_columns(reader.preview(1), MAIN_REQUIRED)
+    if missing:
+        raise ValueError('Nedostaju kolone: ' + ', '.join(missing))
+    skips = SkipLog(debug_csv)
+    def prepare(chunk):
+        with metrics.stage('prepare') as st:
+            st['rows'] = len(chunk)
+            return prepare_frame(chunk, mapping, konta_map)
+    if fragments is not None:
+        # čitanje i priprema izmenjenih redova su ovde jedna faza
+        prepared = _timed_chunks(fragments.frames(reader, mapping, konta_map, cancel, prepare), metrics, 'read')
+    else:
+        chunks = _timed_chunks(reader.iter_chunks(columns=list(dict.fromkeys(mapping.values())), cancel=cancel), metrics, 'read')
+        prepared = (prepare(chunk) for chunk in chunks)
+    napomena = napomena or 'Generisano iz XLSX'
+    shards = None
+    profiler = cProfile.Profile() if profile else None
+    with metrics.stage('write') as st, skips:
+        if profiler: profiler.enable()
+        try:
+            if split_by:
+                res = write_sharded(prepared, out_path, sifra, tip_name, napomena, konta_meta, skips, split_by,
+                                    max_stavki, workers, progress=progress, cancel=cancel)
+                stavki, not_in_map, shards = res['stavki'], res['not_in_map'], res['shards']
+                out_path = res['manifest']
+            else:
+                stavki, not_in_map = write_nalog_xml(prepared, out_path, sifra, tip_name, napomena,
+                                                     konta_meta, skips, progress=progress, cancel=cancel)
+        finally:
+            if profiler:
+                profiler.disable()
+                profiler.dump_stats(profile)
+        st['rows'] = stavki
+    # čitanje i priprema teku unutar pisanja (generator), pa se oduzimaju
+    if fragments is not None: metrics.exclude('read', 'prepare')
+    metrics.exclude('write', 'read', 'prepare')
+    # Predlozi iz kontnog plana za konta van mape (svi u CSV pored debug loga, najčešći u rezimeu)
+    summary = skips.as_dict()
+    sug_csv = os.path.splitext(debug_csv)[0] + '_predlozi.csv' if debug_csv and summary['not_in_map_distinct'] else None
+    sug = write_suggestions_csv(sug_csv, skips, konta_map, konta_meta) if summary['not_in_map_distinct'] else {}
+    summary['suggestions'] = {k: sug[k] for k in summary['not_in_map_konta']}
+    in_memory = output_kind(out_path) == 'memory'
+    if stavki == 0 and not split_by and not in_memory:
+        try: os.remove(out_path)
+        except Exception: pass
+    checked = None
+    if verify and stavki:
+        with metrics.stage('verify') as st:
+            checked = verify_output(out_path)
+            st['rows'] = checked['stavki']
+    result = {
+        'input': xlsx_path,
+        'output': (MEMORY_OUTPUT if in_memory else out_path) if stavki else None,
+        'output_bytes': (sum(output_size(sh['file']) for sh in shards) if shards is not None else output_size(out_path)) if stavki else 0,
+        'debug_csv': debug_csv,
+        'suggestions_csv': sug_csv,
+        'stavki': stavki,
+        'skipped': len(skips),
+        'not_in_map': not_in_map,
+        'skip_summary': summary,
+        'seconds': round(time.perf_counter() - t0, 3),
+    }
+    if shards is not None:
+        result['shards'] = [os.path.basename(sh['file']) for sh in shards]
+    if profile:
+        result['profile'] = profile
+    if fragments is not None:
+        result['fragments'] = {'reused': fragments.hits, 'prepared': fragments.misses}
+    if checked is not None:
+        result['verify'] = checked
+    if not stavki:
+        result['error'] = 'Nijedna stavka nije generisana (verovatno neprepoznata konta ili nula iznosi); vidi debug log'
+    metrics.info.update(input=xlsx_path, output=result['output'], stavki=stavki, skipped=len(skips))
+    if own_metrics: metrics.finish()
+    result['metrics'] = metrics.as_dict()
+    return result
+
+_WORKER_KONTA = None
+
+def _init_worker(konta_map, konta_meta):
+    # Mapa konta stiže u svaki proces jednom (initializer), ne uz svaki fajl
+    global _WORKER_KONTA
+    _WORKER_KONTA = (konta_map, konta_meta)
+
+def _convert_job(xlsx_path, out_path, debug_csv, sifra, tip_name, napomena, split_by=None,
+                 max_stavki=MAX_STAVKI_PER_NALOG, profile=None):
+    try:
+        return convert_file(xlsx_path, out_path, sifra, *_WORKER_KONTA, tip_name=tip_name,
+                            napomena=napomena, debug_csv=debug_csv, split_by=split_by, max_stavki=max_stavki,
+                            profile=profile)
+    except Exception as e:
+        return {'input': xlsx_path, 'output': None, 'debug_csv': None, 'error': f'{type(e).__name__}: {e}'}
+
+def expand_inputs(patterns):
+    """Fajlovi, direktorijumi (svi podržani ulazi: XLSX, CSV, Parquet) i glob šabloni -> sortirana lista putanja."""
+    found = []
+    for p in patterns:
+        if os.path.isdir(p):
+            found += [q for q in glob.glob(os.path.join(p, '*')) if os.path.splitext(q)[1].lower() in INPUT_READERS]
+        elif glob.has_magic(p):
+            found += glob.glob(p)
+        else:
+            found.append(p)
+    return sorted({os.path.abspath(p) for p in found if not os.path.basename(p).startswith('~$')})
+
+def convert_many(inputs, out_dir, sifra, konta_map, konta_meta, tip_name='Tekući promet',
+                 napomena='Generisano iz XLSX', workers=None, log=print, split_by=None, max_stavki=MAX_STAVKI_PER_NALOG,
+                 profile=False, compress=None):
+    """Paralelno konvertuje više XLSX fajlova (process pool). Svaki dobija svoj XML i debug CSV (i .prof uz profile).
+
+    Ulazi sa istim imenom (x.xlsx, x.csv, drugi/x.xlsx) dobijaju x.xml, x_2.xml, ... po redosledu u inputs.
+    compress ('gzip' ili 'zip', vidi OUTPUT_FORMATS) komprimuje XML dok se piše.
+    Ako proces padne, taj fajl (i oni koje pad pool-a povuče) dobija 'error', a ostali rezultati ostaju.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    results = []
+    names = set()  # imena izlaza dodeljena u ovom pokretanju (x.xlsx i x.csv ne smeju u isti x.xml)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(konta_map, konta_meta)) as pool:
+        futures = {}
+        for path in inputs:
+            stem = name = os.path.splitext(os.path.basename(path))[0]
+            for i in itertools.count(2):
+                if name.lower() not in names: break
+                name = f'{stem}_{i}'
+            names.add(name.lower())
+            out_path = os.path.join(out_dir, name + OUTPUT_FORMATS[compress or 'xml'])
+            debug_csv = debug_log_path(out_path)
+            prof = os.path.join(out_dir, name + '.prof') if profile else None
+            futures[pool.submit(_convert_job, path, out_path, debug_csv, sifra, tip_name, napomena, split_by,
+                                max_stavki, prof)] = (path, out_path, debug_csv)
+        for fut in as_completed(futures):
+            try:
+                res = fut.result()
+            except Exception as e:  # proces je pao (npr. bez memorije: BrokenProcessPool); ostali fajlovi se i dalje beleže
+                path, out_path, debug_csv = futures[fut]
+                res = {'input': path, 'output': None, 'debug_csv': None, 'error': f'{type(e).__name__}: {e}'}
+                for part in (out_path + '.part', debug_csv + '.part'):
+                    try: os.remove(part)
+                    except OSError: pass
+            results.append(res)
+            if res.get('error'):
+                log(f"GREŠKA {res['input']}: {res['error']}")
+            else:
+                log(f"OK {res['input']} → {res['output']}: stavki {res['stavki']}, preskočeno {res['skipped']}, {res['seconds']} s")
+            if res.get('skip_summary'):
+                for line in skip_summary_lines(res['skip_summary'], top=5): log('   ' + line)
+            if res.get('verify'):
+                for line in verify_lines(res['verify']): log('   ' + line)
+    results.sort(key=lambda r: r['input'])
+    return results
+
+# --- Pregled svih redova (virtuelna tabela) ---
+SKIP_TAGS = {SKIP_NOT_IN_MAP: 'skip_map', SKIP_ZERO: 'skip_zero', SKIP_KONTO_EMPTY: 'skip_empty'}
+ALL_COLUMNS = '(sve kolone)'
+
+class PreviewGrid(ttk.Frame):
+    """Pregled celog lista u Treeview-u sa stalnim brojem redova-widgeta.
+
+    Pri skrolovanju se samo menjaju vrednosti postojećih stavki. Filter po koloni, skok na Excel red
+    i isticanje redova koje bi generate preskočio (razlozi se računaju jednom, za ceo list).
+    """
+    def __init__(self, master, page=PREVIEW_ROWS):
+        super().__init__(master)
+        self.df = None
+        self._values = None
+        self._rows = None
+        self._reasons = None
+        self._view = ()  # numpy niz tek u set_data: bez uvoza numpy-ja pri startu
+        self._offset = 0
+        self._page = page
+        self.filter_col = tk.StringVar(value=ALL_COLUMNS)
+        self.filter_text = tk.StringVar()
+        self.only_skipped = tk.BooleanVar(value=False)
+        self.goto_row = tk.StringVar()
+        self.info = tk.StringVar(value='')
+
+        bar = ttk.Frame(self)
+        bar.pack(side='top', fill='x', pady=(0, 5))
+        ttk.Label(bar, text='Filter:').pack(side='left')
+        self.col_combo = ttk.Combobox(bar, textvariable=self.filter_col, state='readonly', width=18, values=[ALL_COLUMNS])
+        self.col_combo.pack(side='left', padx=5)
+        e = ttk.Entry(bar, textvariable=self.filter_text, width=20)
+        e.pack(side='left')
+        e.bind('<Return>', lambda _: self.apply_filter())
+        ttk.Checkbutton(bar, text='Samo preskočeni', variable=self.only_skipped, command=lambda: self.apply_filter()).pack(side='left', padx=5)
+        ttk.Button(bar, text='Primeni', command=lambda: self.apply_filter()).pack(side='left')
+        ttk.Label(bar, text='Red:').pack(side='left', padx=(15, 5))
+        g = ttk.Entry(bar, textvariable=self.goto_row, width=8)
+        g.pack(side='left')
+        g.bind('<Return>', lambda _: self.jump())
+        ttk.Button(bar, text='Idi', command=self.jump).pack(side='left', padx=5)
+        ttk.Label(bar, textvariable=self.info).pack(side='right')
+
+        self.tree = ttk.Treeview(self, show='headings', selectmode='browse')
+        self.tree.tag_configure('skip_map', background='#f8d7da')
+        self.tree.tag_configure('skip_zero', background='#fff3cd')
+        self.tree.tag_configure('skip_empty', background='#e2e3e5')
+        self.vbar = ttk.Scrollbar(self, orient='vertical', command=self._on_scroll)
+        xscroll = ttk.Scrollbar(self, orient='horizontal', command=self.tree.xview)
+        self.tree.configure(xscrollcommand=xscroll.set)
+        self.vbar.pack(side='right', fill='y')
+        xscroll.pack(side='bottom', fill='x')
+        self.tree.pack(fill='both', expand=True)
+        for seq in ('<MouseWheel>', '<Button-4>', '<Button-5>'):
+            self.tree.bind(seq, self._on_wheel)
+        self.tree.bind('<Prior>', lambda _: self._scroll_by(-self._page) or 'break')
+        self.tree.bind('<Next>', lambda _: self._scroll_by(self._page) or 'break')
+        self.tree.bind('<Configure>', self._on_resize)
+
+    def set_data(self, df, reasons=None):
+        """df: ceo list (indeks = Excel red - 2); reasons: razlog preskakanja po redu ili None."""
+        self.df = df
+        self._values = df.to_numpy(dtype=object)
+        self._rows = df.index.to_numpy() + 2
+        cols = ['#'] + list(df.columns) + ['Razlog']
+        self.tree['columns'] = cols
+        for col in cols:
+            self.tree.heading(col, text=col)
+            self.tree.column(col, width=60 if col == '#' else 140, stretch=col != '#')
+        self.col_combo['values'] = [ALL_COLUMNS] + list(df.columns)
+        if self.filter_col.get() not in self.col_combo['values']: self.filter_col.set(ALL_COLUMNS)
+        self._reasons = None
+        self._offset = 0
+        self.set_reasons(reasons)
+
+    def set_reasons(self, reasons):
+        self._reasons = None if reasons is None else reasons.to_numpy(dtype=object)
+        self.apply_filter(keep_position=True)
+
+    def apply_filter(self, keep_position=False):
+        if self.df is None: return
+        if not keep_position: self._offset = 0
+        mask = np.ones(len(self.df), dtype=bool)
+        text = self.filter_text.get().strip()
+        if text:
+            cols = list(self.df.columns) if self.filter_col.get() == ALL_COLUMNS else [self.filter_col.get()]
+            hit = np.zeros(len(self.df), dtype=bool)
+            for c in cols:
+                # prazne ćelije se traže kao prazan tekst (kako se i prikazuju), ne kao 'None'/'nan'
+                col = self.df[c]
+                col = col.where(col.notna(), '').astype(str)
+                hit |= col.str.contains(text, case=False, regex=False, na=False).to_numpy()
+            mask &= hit
+        if self.only_skipped.get() and self._reasons is not None:
+            mask &= self._reasons != ''
+        self._view = np.flatnonzero(mask)
+        self._offset = min(self._offset, max(len(self._view) - self._page, 0))
+        self._render()
+
+    def jump(self):
+        try:
+            row = int(self.goto_row.get())
+        except ValueError:
+            return
+        if not len(self._view): return
+        k = int(np.searchsorted(self._rows[self._view], row))
+        k = min(k, len(self._view) - 1)
+        self._offset = max(0, min(k, len(self._view) - self._page))
+        self._render(select=k - self._offset)
+
+    def _ensure_items(self):
+        items = self.tree.get_children()
+        for _ in range(self._page - len(items)):
+            self.tree.insert('', 'end', values=())
+        for iid in items[self._page:]:
+            self.tree.delete(iid)
+        return self.tree.get_children()
+
+    def _render(self, select=None):
+        items = self._ensure_items()
+        n = len(self._view)
+        for i, iid in enumerate(items):
+            k = self._offset + i
+            if k >= n:
+                self.tree.item(iid, values=(), tags=()); continue
+            pos = self._view[k]
+            reason = self._reasons[pos] if self._reasons is not None else ''
+            vals = [int(self._rows[pos])] + ['' if pd.isna(v) else v for v in self._values[pos]] + [reason]
+            self.tree.item(iid, values=vals, tags=(SKIP_TAGS[reason],) if reason in SKIP_TAGS else ())
+        if select is not None and 0 <= select < len(items):
+            self.tree.selection_set(items[select]); self.tree.focus(items[select])
+        if n:
+            self.vbar.set(self._offset / n, min(1.0, (self._offset + self._page) / n))
+            total = len(self.df)
+            shown = f'{self._rows[self._view[self._offset]]}–{self._rows[self._view[min(self._offset + self._page, n) - 1]]}'
+            self.info.set(f'Redovi {shown}; prikazano {n:,} od {total:,}' if n != total else f'Redovi {shown} od {total:,}')
+        else:
+            self.vbar.set(0.0, 1.0)
+            self.info.set('Nema redova' if self.df is None or len(self.df) == 0 else f'Nema redova za filter (ukupno {len(self.df):,})')
+
+    def _scroll_to(self, k):
+        if self.df is None: return
+        new = max(0, min(k, len(self._view) - self._page))
+        if new != self._offset:
+            self._offset = new
+            self._render()
+
+    def _scroll_by(self, k):
+        self._scroll_to(self._offset + k)
+
+    def _on_scroll(self, *args):
+        if self.df is None or not len(self._view): return
+        if args[0] == 'moveto':
+            self._scroll_to(int(float(args[1]) * len(self._view)))
+        elif args[0] == 'scroll':
+            self._scroll_by(int(args[1]) * (self._page if args[2] == 'pages' else 1))
+
+    def _on_wheel(self, event):
+        if event.num == 4: step = -3
+        elif event.num == 5: step = 3
+        else: step = -3 if event.delta > 0 else 3
+        self._scroll_by(step)
+        return 'break'
+
+    def _on_resize(self, event):
+        try: rowheight = int(ttk.Style(self).lookup('Treeview', 'rowheight') or 20)
+        except (ValueError, tk.TclError): rowheight = 20
+        page = max(5, (event.height - 25) // rowheight)
+        if page != self._page:
+            self._page = page
+            if self.df is not None:
+                self._offset = max(0, min(self._offset, len(self._view) - self._page))
+                self._render()
+
 class App(tk.Tk):
     def __init__(self):
+        self._startup = RunMetrics('Start')
+        self._startup.add('import', self._startup._t0 - START_T0)
+        self._first_frame = False
         super().__init__()
         self.title('Dalibor Bogicevic: PSIT MPP XLSX u XML generator')
         self.geometry('1400x1000')
@@ -112,26 +2111,48 @@ class App(tk.Tk):
         self.configure(bg='#e0e8f0')
 
         # --- Promenljive ---
+        self._settings = load_settings()
+        sql = self._settings.get('sql') or {}
         self.xlsx_path = tk.StringVar()
         self.out_path = tk.StringVar()
         self.napomena = tk.StringVar(value='Generisano iz XLSX')
         self.tip_naloga_var = tk.StringVar(value='Tekući promet')
         self.preduzece_var = tk.StringVar(value='(Nije učitano)')
         self.sifra_preduzeca = tk.StringVar(value='')
-        self.sql_server = tk.StringVar(value='GTRS24MPP')
-        self.sql_instance = tk.StringVar(value='')
-        self.sql_port = tk.StringVar(value='1433')
-        self.sql_database = tk.StringVar(value='mAS2')
-        self.sql_windows_auth = tk.BooleanVar(value=True)
-        self.sql_username = tk.StringVar(value='sa')
+        self.sql_server = tk.StringVar(value=sql.get('server', 'GTRS24MPP'))
+        self.sql_instance = tk.StringVar(value=sql.get('instance', ''))
+        self.sql_port = tk.StringVar(value=sql.get('port', '1433'))
+        self.sql_database = tk.StringVar(value=sql.get('database', 'mAS2'))
+        self.sql_windows_auth = tk.BooleanVar(value=sql.get('windows_auth', True))
+        self.sql_username = tk.StringVar(value=sql.get('username', 'sa'))
         self.sql_password = tk.StringVar(value='')
+        self.sql_konta_lookup = tk.BooleanVar(value=False)
+        self.sql_auto_connect = tk.BooleanVar(value=bool(self._settings.get('auto_connect', False)))
+        self.split_var = tk.StringVar(value='Bez podele')
+        self.max_stavki_var = tk.StringVar(value=str(MAX_STAVKI_PER_NALOG))
         self.status = tk.StringVar(value=f'Spremno. Fallback mapa: {len(EMBEDDED_KONTA_MAP)} konta.')
         
         self.preduzeca = []
         self.df = None
-        self._debug_rows = []
+        self.data = None  # ceo list za pregled (PreviewGrid)
+        self.reader = None
         self._sql_konta_map = None
         self._sql_konta_meta = None
+        self._konta_cache = KontaCache()
+        self._konta_index = KontaIndex()  # kontni planovi svih baza učitanih u ovoj sesiji
+        for var in (self.sql_server, self.sql_instance, self.sql_port, self.sql_database):
+            var.trace_add('write', self._switch_konta_chart)
+        self._fragments = FragmentCache()  # ponovno generisanje istog XLSX-a obrađuje samo izmenjene redove
+        self._sql = SqlSession()
+        self._job = None
+        self._preview_cancel = None  # prekida čitanje celog lista za pregled (load_preview)
+        self._ui_queue = queue.Queue()
+        self._log_pending = collections.deque()
+        self._log_flushed = 0.0
+        self._log_file_lock = threading.Lock()
+        self._log_file = self._open_log_file()
+        self.progress_text = tk.StringVar(value='')
+        self.protocol('WM_DELETE_WINDOW', self._on_close)
 
         # --- Glavni okvir ---
         main_frame = ttk.Frame(self, padding="15", style='App.TFrame')
@@ -150,7 +2171,7 @@ class App(tk.Tk):
         input_frame.grid(row=0, column=0, sticky='ns', padx=(0, 10))
         pad = {'padx': 5, 'pady': 6}
 
-        ttk.Label(input_frame, text='Ulazni XLSX:').grid(row=0, column=0, sticky='w', **pad)
+        ttk.Label(input_frame, text='Ulazni fajl (XLSX, CSV, Parquet):').grid(row=0, column=0, sticky='w', **pad)
         ttk.Entry(input_frame, textvariable=self.xlsx_path, width=50).grid(row=1, column=0, sticky='ew', **pad)
         ttk.Button(input_frame, text='Odaberi…', command=self.choose_xlsx).grid(row=1, column=1, sticky='ew', **pad)
 
@@ -161,6 +2182,7 @@ class App(tk.Tk):
         ttk.Label(input_frame, text='Preduzeće:').grid(row=4, column=0, sticky='w', **pad)
         self.preduzece_combo = ttk.Combobox(input_frame, textvariable=self.preduzece_var, state='readonly', width=48)
         self.preduzece_combo.grid(row=5, column=0, sticky='ew', **pad)
+        self.preduzece_combo.bind('<<ComboboxSelected>>', self._on_preduzece_selected)
         ttk.Button(input_frame, text='Učitaj iz SQL', command=self.load_preduzeca_sql).grid(row=5, column=1, sticky='ew', **pad)
         
         # --- SQL okvir (desno) ---
@@ -177,6 +2199,7 @@ class App(tk.Tk):
         ttk.Entry(sql_frame, textvariable=self.sql_port, width=8).grid(row=0, column=5, sticky='w', **pad)
 
         ttk.Checkbutton(sql_frame, text='Windows autentikacija', variable=self.sql_windows_auth).grid(row=1, column=0, columnspan=2, sticky='w', **pad)
+        ttk.Checkbutton(sql_frame, text='Konta samo iz učitanog XLSX-a', variable=self.sql_konta_lookup).grid(row=1, column=2, columnspan=2, sticky='w', **pad)
         ttk.Label(sql_frame, text='Korisnik:').grid(row=2, column=0, sticky='e', **pad)
         ttk.Entry(sql_frame, textvariable=self.sql_username).grid(row=2, column=1, sticky='ew', **pad)
         ttk.Label(sql_frame, text='Lozinka:').grid(row=2, column=2, sticky='e', **pad)
@@ -188,6 +2211,8 @@ class App(tk.Tk):
         btn_frame.grid(row=3, column=0, columnspan=6, sticky='e', pady=(10,0))
         ttk.Button(btn_frame, text='Test konekcije', command=self.test_sql).pack(side=tk.LEFT, padx=5)
         ttk.Button(btn_frame, text='Učitaj konta iz SQL', command=self.load_konta_sql).pack(side=tk.LEFT)
+        ttk.Checkbutton(sql_frame, text='Poveži se automatski pri pokretanju', variable=self.sql_auto_connect,
+                        command=self._save_settings).grid(row=3, column=0, columnspan=3, sticky='w', pady=(10, 0))
 
         # --- Akcije i izlaz ---
         action_frame = ttk.LabelFrame(main_frame, text="Izlaz i Generisanje", padding="10")
@@ -202,30 +2227,67 @@ class App(tk.Tk):
         ttk.Entry(action_frame, textvariable=self.out_path).grid(row=1, column=1, sticky='ew', **pad)
         ttk.Button(action_frame, text='Sačuvaj kao…', command=self.choose_xml).grid(row=1, column=2, padx=5)
         
-        ttk.Button(action_frame, text='Generiši XML', command=self.generate, style='Accent.TButton').grid(row=2, column=1, columnspan=2, pady=(10,0), sticky='e')
+        ttk.Label(action_frame, text='Podela izlaza:').grid(row=2, column=0, sticky='w', **pad)
+        split_frame = ttk.Frame(action_frame)
+        split_frame.grid(row=2, column=1, columnspan=2, sticky='w')
+        ttk.Combobox(split_frame, textvariable=self.split_var, values=list(SPLIT_OPCIJE), state='readonly', width=18).pack(side=tk.LEFT, padx=5)
+        ttk.Label(split_frame, text='Najviše stavki po nalogu:').pack(side=tk.LEFT, padx=(10, 5))
+        ttk.Entry(split_frame, textvariable=self.max_stavki_var, width=8).pack(side=tk.LEFT)
+
+        self.progress = ttk.Progressbar(action_frame, mode='determinate', maximum=100)
+        self.progress.grid(row=3, column=0, columnspan=2, sticky='ew', padx=5, pady=(10,0))
+        ttk.Button(action_frame, text='Generiši XML', command=self.generate, style='Accent.TButton').grid(row=3, column=2, pady=(10,0), sticky='e')
+        ttk.Label(action_frame, textvariable=self.progress_text).grid(row=4, column=0, columnspan=2, sticky='w', **pad)
+        self.cancel_btn = ttk.Button(action_frame, text='Prekini', command=self.cancel_job, state='disabled')
+        self.cancel_btn.grid(row=4, column=2, sticky='e', padx=5)
 
         # --- Statusna linija ---
         ttk.Label(main_frame, textvariable=self.status, style='Status.TLabel').grid(row=2, column=0, sticky='ew', pady=5)
 
         # --- Pregled (Preview) ---
-        preview_frame = ttk.LabelFrame(main_frame, text="Pregled XLSX (prvih 20 redova)", padding="10")
+        preview_frame = ttk.LabelFrame(main_frame, text="Pregled XLSX (svi redovi; crveno: konto nije u mapi, žuto: nula iznosi, sivo: prazan konto)", padding="10")
         preview_frame.grid(row=3, column=0, sticky='nsew', pady=5)
-        self.tree = ttk.Treeview(preview_frame, show='headings')
-        yscroll = ttk.Scrollbar(preview_frame, orient='vertical', command=self.tree.yview)
-        xscroll = ttk.Scrollbar(preview_frame, orient='horizontal', command=self.tree.xview)
-        self.tree.configure(yscrollcommand=yscroll.set, xscrollcommand=xscroll.set)
-        
-        yscroll.pack(side='right', fill='y')
-        xscroll.pack(side='bottom', fill='x')
-        self.tree.pack(fill='both', expand=True)
+        self.grid_view = PreviewGrid(preview_frame)
+        self.grid_view.pack(fill='both', expand=True)
+        self.tree = self.grid_view.tree
 
         # --- Log ---
         log_frame = ttk.LabelFrame(main_frame, text="Log (uživo)", padding="10")
         log_frame.grid(row=4, column=0, sticky='nsew', pady=5)
+        ttk.Button(log_frame, text='Ceo log…', command=self.open_log_file).pack(side='bottom', anchor='e', pady=(5, 0))
         self.log = ScrolledText(log_frame, height=10, wrap='word', state='disabled', relief='flat',
                                 bg='#ffffff', fg='#333333', font=('Consolas', 10))
         self.log.pack(fill='both', expand=True)
 
+        self.after(50, self._pump_ui)
+        self.bind('<Map>', self._on_first_frame, add='+')
+
+    def _on_first_frame(self, event):
+        """Prozor je prikazan: teški moduli se uvoze u pozadini, a konta dolaze iz lokalnog keša (i SQL-a)."""
+        if event.widget is not self or self._first_frame: return
+        self._first_frame = True
+        self.update_idletasks()
+        first_frame = time.perf_counter() - START_T0
+        self._startup.add('window', time.perf_counter() - self._startup._t0)
+        self._startup.info['first_frame_s'] = round(first_frame, 3)
+        self._log(f'Prozor prikazan za {first_frame:.2f} s od pokretanja')
+        if first_frame > STARTUP_TARGET_S:
+            self._log(f'Start je sporiji od cilja ({STARTUP_TARGET_S:.1f} s).')
+        def done(times, err):
+            if err is not None:
+                self._log(f'Pozadinski uvoz modula nije uspeo: {err}')
+            else:
+                self._startup.add('warmup', sum(times.values()))
+                self._startup.info['warmup'] = {k: round(v, 3) for k, v in times.items()}
+            self._startup.finish('ok' if err is None else 'error')
+            self._log(self._startup.summary())
+            try:
+                self._startup.append(METRICS_FILE)
+            except Exception as e:
+                self._log(f'Ne mogu da upišem metrike: {e}')
+        self._run_bg(warm_up_modules, done)
+        self.after_idle(self.load_konta_cache)
+
     def setup_styles(self):
         """Konfiguriše stilove za moderan izgled aplikacije."""
         BG_COLOR = '#e0e8f0'
@@ -279,162 +2341,458 @@ class App(tk.Tk):
         style.configure("Treeview.Heading", background="#d0d8e0", foreground=TEXT_COLOR, font=FONT_BOLD, padding=8, relief='flat')
         style.map("Treeview.Heading", background=[('active', '#c0c8d0')])
         
+    @staticmethod
+    def _open_log_file():
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            if os.path.exists(LOG_FILE) and os.path.getsize(LOG_FILE) > LOG_FILE_MAX_BYTES:
+                os.replace(LOG_FILE, LOG_FILE + '.1')
+            f = open(LOG_FILE, 'a', encoding='utf-8')
+            f.write(f"\n===== {datetime.now().isoformat(timespec='seconds')} =====\n")
+            return f
+        except Exception:
+            return None
+
     def _log(self, msg):
+        line = f"{datetime.now().strftime('%H:%M:%S')}  {msg}\n"
+        # Ceo log ide na disk odmah; widget se osvežava u glavnoj niti, u paketima (_flush_log)
+        if self._log_file is not None:
+            with self._log_file_lock:
+                try:
+                    self._log_file.write(line); self._log_file.flush()
+                except Exception:
+                    pass
+        self._log_pending.append(line)
+
+    def _flush_log(self):
+        """Upisuje nagomilane linije u widget jednim insert-om i drži u njemu najviše LOG_MAX_LINES linija."""
+        self._log_flushed = time.monotonic()
+        if not self._log_pending: return
+        lines = []
+        while self._log_pending:
+            lines.append(self._log_pending.popleft())
+        lines = lines[-LOG_MAX_LINES:]
         try:
             self.log.configure(state='normal')
-            self.log.insert('end', f"{datetime.now().strftime('%H:%M:%S')}  {msg}\n")
+            self.log.insert('end', ''.join(lines))
+            extra = int(self.log.index('end-1c').split('.')[0]) - LOG_MAX_LINES
+            if extra > 0: self.log.delete('1.0', f'{extra + 1}.0')
             self.log.see('end')
             self.log.configure(state='disabled')
         except Exception:
             pass
 
+    def open_log_file(self):
+        self._flush_log()
+        if hasattr(os, 'startfile') and os.path.exists(LOG_FILE):
+            try:
+                os.startfile(LOG_FILE); return
+            except Exception:
+                pass
+        messagebox.showinfo('Log', f'Ceo log je u fajlu:\n{LOG_FILE}')
+
+    def _pump_ui(self):
+        """Prazni red poruka iz pozadinskih poslova (završeci), osvežava log i napredak."""
+        try:
+            for _ in range(500):
+                msg = self._ui_queue.get_nowait()
+                try: msg[1](*msg[2])
+                except Exception: self._log('Greška u obradi rezultata\n' + traceback.format_exc())
+        except queue.Empty:
+            pass
+        if time.monotonic() - self._log_flushed >= LOG_FLUSH_S:
+            self._flush_log()
+        job = self._job
+        if job is not None:
+            elapsed = max(time.monotonic() - job.started, 1e-6)
+            rate = job.done_rows / elapsed
+            if job.total:
+                self.progress.configure(mode='determinate', value=min(100.0, 100.0 * job.done_rows / job.total))
+                self.progress_text.set(f'{job.name}: {job.done_rows:,} / {job.total:,} redova, {rate:,.0f} red/s')
+            else:
+                self.progress_text.set(f'{job.name}: {job.done_rows:,} redova, {rate:,.0f} red/s' if job.done_rows else f'{job.name}…')
+        self.after(50, self._pump_ui)
+
+    def _start_job(self, name, work, done, total=None):
+        """Pokreće work(job) u pozadinskoj niti; done(result, error) se poziva u glavnoj niti."""
+        if self._job is not None:
+            messagebox.showwarning('Zauzeto', f'Već je u toku: {self._job.name}')
+            return
+        job = Job(name, total)
+        self._job = job
+        self.cancel_btn.state(['!disabled'])
+        if not total:
+            self.progress.configure(mode='indeterminate'); self.progress.start(15)
+        self._log(f'Pokrenuto: {name}')
+        def runner():
+            with job.metrics.active():
+                try: result, err = work(job), None
+                except Exception as e: result, err = None, e
+            self._ui_queue.put(('call', self._finish_job, (job, done, result, err)))
+        threading.Thread(target=runner, name=name, daemon=True).start()
+
+    def _finish_job(self, job, done, result, err):
+        self._job = None
+        self.progress.stop()
+        self.progress.configure(mode='determinate', value=0)
+        self.progress_text.set('')
+        self.cancel_btn.state(['disabled'])
+        # Prekid koji stigne posle upisa ne menja ishod: fajlovi su već na disku, pa se posao prikazuje kao završen
+        cancelled = isinstance(err, JobCancelled)
+        if not cancelled and job.cancel_event.is_set():
+            self._log(f'Prekid je stigao posle završetka: {job.name}')
+        self._record_metrics(job.metrics, 'cancelled' if cancelled else 'error' if err is not None else 'ok')
+        if cancelled:
+            self._log(f'Prekinuto: {job.name}')
+            self.status.set(f'Prekinuto: {job.name}')
+            return
+        done(result, err)
+
+    def _record_metrics(self, metrics, status):
+        metrics.finish(status)
+        self._log(metrics.summary())
+        try:
+            metrics.append()
+        except Exception as e:
+            self._log(f'Ne mogu da upišem metrike ({METRICS_FILE}): {e}')
+
+    def cancel_job(self):
+        if self._job is not None:
+            self._job.cancel_event.set()
+            self._log(f'Prekidam: {self._job.name}…')
+
     def choose_xlsx(self):
-        path = filedialog.askopenfilename(title='Odaberite XLSX', filetypes=[('Excel','*.xlsx')])
+        path = filedialog.askopenfilename(title='Odaberite XLSX, CSV ili Parquet', filetypes=INPUT_FILETYPES)
         if path:
             self.xlsx_path.set(path)
             self._log(f'Odabran XLSX: {path}')
             self.load_preview()
 
     def choose_xml(self):
-        path = filedialog.asksaveasfilename(title='Sačuvaj XML kao', defaultextension='.xml', filetypes=[('XML','*.xml')])
+        path = filedialog.asksaveasfilename(title='Sačuvaj XML kao', defaultextension='.xml', filetypes=OUTPUT_FILETYPES)
         if path:
             self.out_path.set(path)
             self._log(f'Odabrana izlazna putanja: {path}')
 
-    def _open_sql(self):
-        server = self.sql_server.get().strip()
-        instance = self.sql_instance.get().strip()
-        port = self.sql_port.get().strip()
-        database = self.sql_database.get().strip()
-        self._log(f"Priprema konekcije: server='{server}', instance='{instance}', port='{port}', baza='{database}'")
-        if self.sql_windows_auth.get():
-            if not pyodbc:
-                raise RuntimeError("Windows auth tražen, ali pyodbc nije instaliran. 'pip install pyodbc'")
-            target = server
-            if instance: target = f"{server}\\{instance}"
-            elif port: target = f"{server},{port}"
-            drivers_pref = ['ODBC Driver 18 for SQL Server','ODBC Driver 17 for SQL Server','SQL Server Native Client 11.0','SQL Server']
-            try: available = list(pyodbc.drivers())
-            except Exception: available = []
-            self._log(f'Dostupni ODBC driveri: {available}')
-            for drv in drivers_pref:
-                if (not available) or (drv in available):
-                    cs = f"DRIVER={{{drv}}};SERVER={target};DATABASE={database};Trusted_Connection=Yes;TrustServerCertificate=Yes;Encrypt=No;"
-                    self._log(f"Pokušavam ODBC driver: '{drv}' → SERVER={target}; DATABASE={database} (Windows auth)")
-                    try:
-                        cn = pyodbc.connect(cs, timeout=5)
-                        self._log(f"ODBC uspeh sa driverom: '{drv}'")
-                        return cn
-                    except Exception as e:
-                        self._log(f"ODBC neuspeh sa '{drv}': {e}")
-                        continue
-            raise RuntimeError('ODBC Windows auth nije dostupan ili konekcija odbijena.')
-        if not pymssql:
-            raise RuntimeError("pymssql nije instaliran. 'pip install pymssql'")
-        user = self.sql_username.get().strip()
-        pwd = self.sql_password.get()
-        port_i = int(port or '1433')
-        self._log(f'Pokušavam pymssql (SQL auth) → server={server}, port={port_i}, baza={database}, user={user}')
-        cn = pymssql.connect(server=server, user=user, password=pwd, database=database, port=port_i, tds_version='7.4', login_timeout=5)
-        self._log('pymssql konekcija uspešna.')
-        return cn
+    def _sql_params(self):
+        return {
+            'server': self.sql_server.get().strip(),
+            'instance': self.sql_instance.get().strip(),
+            'port': self.sql_port.get().strip(),
+            'database': self.sql_database.get().strip(),
+            'windows_auth': bool(self.sql_windows_auth.get()),
+            'username': self.sql_username.get().strip(),
+            'password': self.sql_password.get(),
+        }
 
-    def test_sql(self):
+    def _on_close(self):
+        # Ne gasimo proces usred upisa: prvo prekid posla (briše .part fajl), pa zatvaranje
+        if self._job is not None:
+            self.cancel_job()
+            self.after(100, self._on_close)
+            return
+        if self._preview_cancel is not None: self._preview_cancel.set()
+        self._sql.close()
+        self._save_settings()
+        if self._log_file is not None:
+            with self._log_file_lock: self._log_file.close()
+            self._log_file = None
+        self.destroy()
+
+    def _save_settings(self):
+        params = self._sql_params()
+        params.pop('password')
+        self._settings.update(sql=params, auto_connect=bool(self.sql_auto_connect.get()))
+        if self.sifra_preduzeca.get(): self._settings['preduzece'] = self.sifra_preduzeca.get()
+        try:
+            save_settings(self._settings)
+        except Exception as e:
+            self._log(f'Ne mogu da sačuvam podešavanja: {e}')
+
+    def _run_bg(self, work, done):
+        """Pokreće work() u pozadinskoj niti bez trake napretka; done(result, error) se poziva u glavnoj niti."""
+        def runner():
+            try: result, err = work(), None
+            except Exception as e: result, err = None, e
+            self._ui_queue.put(('call', done, (result, err)))
+        threading.Thread(target=runner, daemon=True).start()
+
+    def _set_konta(self, m, meta, src, key=None):
+        """Postavlja mapu konta. key je server|baza iz kojih je ceo kontni plan preuzet: plan se pamti u
+        KontaIndex, a postaje trenutni samo ako parametri SQL-a i dalje pokazuju na tu bazu.
+        Delimična mapa (samo konta iz XLSX-a) nema key i ne pamti se kao plan baze.
+        """
+        chart = KontaChart.from_maps(m, meta)
+        if key is not None:
+            self._konta_index.add(key, chart)
+            if key != konta_cache_key(self._sql_params()):
+                self._log(f'Kontni plan za {key} je zapamćen, ali je u međuvremenu izabrana druga baza; mapa se ne menja.')
+                return False
+        self._sql_konta_map = chart
+        self._sql_konta_meta = chart.meta
+        self.status.set(f'Učitano iz {src}: {len(chart)} konta')
+        self._refresh_skip_reasons()
+        return True
+
+    def _switch_konta_chart(self, *_):
+        """Pri promeni servera/baze odmah prelazi na kontni plan te baze ako je već učitan u ovoj sesiji."""
+        chart = self._konta_index.get(konta_cache_key(self._sql_params()))
+        if chart is not None and chart is not self._sql_konta_map:
+            self._sql_konta_map = chart
+            self._sql_konta_meta = chart.meta
+            self.status.set(f'Kontni plan za {self.sql_database.get().strip()}: {len(chart)} konta (iz memorije)')
+            self._log(f'Prelazak na već učitan kontni plan ({self.sql_database.get().strip()}): {len(chart)} konta')
+            self._refresh_skip_reasons()
+
+    def load_konta_cache(self):
+        """Pri startu: odmah učitava konta iz lokalnog keša. SQL se proverava samo uz automatsko povezivanje
+        i upotrebljive kredencijale (Windows autentikacija ili unesena lozinka); inače nema pokušaja prijave.
+        """
+        params = self._sql_params()
+        key = konta_cache_key(params)
+        cached = None
         try:
-            cn = self._open_sql()
-            cn.close()
+            cached = self._konta_cache.load(key)
+        except Exception as e:
+            self._log(f'Ne mogu da pročitam keš konta: {e}')
+        if cached:
+            rows, _, fetched_at = cached
+            m, meta = build_konta_maps(rows)
+            self._set_konta(m, meta, 'keša', key)
+            self._log(f'Mapa konta iz keša ({fetched_at}): {len(m)} unosa')
+        if not self.sql_auto_connect.get():
+            if not cached: self._log('Konta nisu u kešu; učitajte ih iz SQL-a (automatsko povezivanje je isključeno).')
+            return
+        if not params['windows_auth'] and not params['password']:
+            self._log('Automatsko povezivanje preskočeno: SQL autentikacija traži lozinku'
+                      + (', radim sa kešom konta.' if cached else '.'))
+            return
+        self._auto_connect(params, key, cached[1] if cached else None)
+
+    def _auto_connect(self, params, key, cached_sig):
+        """Pri startu, jedna konekcija i jedan batch: preduzeća, potpis konta i (bez keša) sama konta.
+
+        Combobox sa preduzećima se puni čim taj skup stigne; greške idu samo u log, bez prozora.
+        """
+        t0 = time.perf_counter()
+        self.status.set(f'Povezujem se na {sql_target(params)}…')
+        def work():
+            def fetch(cn):
+                queries = [PREDUZECA_SQL, KONTA_SIG_SQL] + ([KONTA_SQL] if cached_sig is None else [])
+                sets = sql_fetch_sets(cn, queries)
+                self._ui_queue.put(('call', self._fill_preduzeca, (sets[0],)))
+                sig = konta_signature(sets[1][0])
+                if sig == cached_sig: return None, sig
+                return (sets[2] if len(sets) > 2 else sql_fetchall(cn, KONTA_SQL)), sig
+            rows, sig = self._sql.run(params, self._log, fetch)
+            if rows is not None: self._konta_cache.save(key, rows, sig)
+            return rows
+        def done(rows, err):
+            if err is not None:
+                self._log(f'Automatsko povezivanje nije uspelo (radim sa kešom/offline): {err}')
+                self.status.set('SQL nije dostupan, radim sa kešom konta.')
+                return
+            if rows is None:
+                self._log('Keš konta je ažuran (SQL nije menjan).')
+            else:
+                m, meta = build_konta_maps(rows)
+                if self._set_konta(m, meta, 'SQL', key): self._log(f'Mapa konta iz SQL: {len(m)} unosa')
+            self._log(f'Automatsko povezivanje završeno za {time.perf_counter() - t0:.2f} s')
+            self.status.set(f'Spremno. Preduzeća: {len(self.preduzeca)}, konta: {len(self._sql_konta_map or {})}.')
+        self._run_bg(work, done)
+
+    def test_sql(self):
+        params = self._sql_params()
+        def work(job):
+            self._sql.run(params, self._log, lambda cn: sql_fetchall(cn, 'SELECT 1'))
+        def done(_, err):
+            if err is not None:
+                self._log('Test konekcije: NEUSPEH\n' + ''.join(traceback.format_exception_only(type(err), err)).strip())
+                messagebox.showerror('Greška', f'Neuspešna konekcija:\n{err}'); return
             self._log('Test konekcije: USPEH')
             messagebox.showinfo('Uspeh', 'Konekcija uspešna! (HYBRID)')
-        except Exception as e:
-            self._log('Test konekcije: NEUSPEH\n' + ''.join(traceback.format_exception_only(type(e), e)).strip())
-            messagebox.showerror('Greška', f'Neuspešna konekcija:\n{e}')
+        self._start_job('Test konekcije', work, done)
 
     def load_preduzeca_sql(self):
-        try:
-            cn = self._open_sql()
-            cur = cn.cursor()
-            q = 'SELECT cp_preduzece_id, CAST(sifra AS varchar(64)) AS sifra, CAST(naziv AS varchar(255)) AS naziv FROM dbo.cp_preduzece ORDER BY sifra'
-            self._log(f'SQL upit: {q}')
-            cur.execute(q)
-            rows = cur.fetchall()
-            cn.close()
-            self.preduzeca = [{'id': int(r[0]), 'sifra': str(r[1] or ''), 'naziv': str(r[2] or '')} for r in rows]
-            if not self.preduzeca:
-                self._log('cp_preduzece: 0 redova')
+        params = self._sql_params()
+        def work(job):
+            self._log(f'SQL upit: {PREDUZECA_SQL}')
+            return self._sql.run(params, self._log, lambda cn: sql_fetchall(cn, PREDUZECA_SQL))
+        def done(rows, err):
+            if err is not None:
+                self._log('Greška pri učitavanju preduzeća\n' + ''.join(traceback.format_exception_only(type(err), err)).strip())
+                messagebox.showerror('Greška', f'Neuspešno učitavanje preduzeća:\n{err}'); return
+            n = self._fill_preduzeca(rows)
+            if not n:
                 messagebox.showwarning('Info', 'Nije pronađeno nijedno preduzeće u cp_preduzece.'); return
-            disp = [f"{p['sifra']} — {p['naziv']}" for p in self.preduzeca]
-            self.preduzece_combo.configure(values=disp)
-            self.preduzece_combo.current(0)
-            self.preduzece_var.set(disp[0])
-            self.sifra_preduzeca.set(self.preduzeca[0]['sifra'])
-            self._log(f'Učitano preduzeća: {len(disp)}')
-            messagebox.showinfo('OK', f'Učitano preduzeća: {len(disp)}')
-        except Exception as e:
-            self._log('Greška pri učitavanju preduzeća\n' + ''.join(traceback.format_exception_only(type(e), e)).strip())
-            messagebox.showerror('Greška', f'Neuspešno učitavanje preduzeća:\n{e}')
+            messagebox.showinfo('OK', f'Učitano preduzeća: {n}')
+        self._start_job('Učitavanje preduzeća', work, done)
+
+    def _fill_preduzeca(self, rows):
+        """Puni combobox iz redova cp_preduzece; ostaje izabrano prethodno (ili zapamćeno) preduzeće."""
+        self.preduzeca = [{'id': int(r[0]), 'sifra': str(r[1] or ''), 'naziv': str(r[2] or '')} for r in rows]
+        if not self.preduzeca:
+            self._log('cp_preduzece: 0 redova')
+            return 0
+        disp = [f"{p['sifra']} — {p['naziv']}" for p in self.preduzeca]
+        prev = self.sifra_preduzeca.get() or self._settings.get('preduzece')
+        i = next((i for i, p in enumerate(self.preduzeca) if p['sifra'] == prev), 0)
+        self.preduzece_combo.configure(values=disp)
+        self.preduzece_combo.current(i)
+        self.preduzece_var.set(disp[i])
+        self.sifra_preduzeca.set(self.preduzeca[i]['sifra'])
+        self._log(f'Učitano preduzeća: {len(disp)}')
+        return len(disp)
+
+    def _on_preduzece_selected(self, event=None):
+        i = self.preduzece_combo.current()
+        if 0 <= i < len(self.preduzeca):
+            self.sifra_preduzeca.set(self.preduzeca[i]['sifra'])
 
     def load_konta_sql(self):
-        try:
-            cn = self._open_sql()
-            cur = cn.cursor()
-            q = ('SELECT fk_kp_konto_id, CAST(Broj AS varchar(64)) AS Broj, '
-                 'CAST(Naziv AS varchar(255)) AS Naziv FROM dbo.fk_kp_konto')
-            self._log('SQL upit (konta): ' + q)
-            cur.execute(q)
-            rows = cur.fetchall()
-            cn.close()
-            m = {}
-            meta = {}
-            for r in rows:
-                kid = int(r[0]); broj = str(r[1] or '').strip(); broj_norm = norm_konto(broj)
-                if not broj_norm: continue
-                m[broj_norm] = kid
-                meta[kid] = {'Broj': broj_norm, 'Naziv': str(r[2] or '')}
-            self._sql_konta_map = m
-            self._sql_konta_meta = meta
-            self.status.set(f'Učitano iz SQL: {len(m)} konta')
+        if self.sql_konta_lookup.get() and self.reader is not None:
+            return self.load_konta_lookup_sql()
+        params = self._sql_params()
+        key = konta_cache_key(params)  # plan se vodi pod bazom iz koje je preuzet, ne pod onom izabranom na kraju
+        def work(job):
+            self._log('SQL upit (konta): ' + KONTA_SQL)
+            with job.metrics.stage('sql_konta') as st:
+                rows, sig = self._sql.run(params, self._log, lambda cn: (sql_fetchall(cn, KONTA_SQL), fetch_konta_signature(cn)))
+                st['rows'] = len(rows)
+            with job.metrics.stage('cache_save'):
+                try:
+                    self._konta_cache.save(key, rows, sig)
+                except Exception as e:
+                    self._log(f'Ne mogu da upišem keš konta: {e}')
+            with job.metrics.stage('build_map') as st:
+                st['rows'] = len(rows)
+                return build_konta_maps(rows)
+        def done(res, err):
+            if err is not None:
+                self._log('Greška pri učitavanju konta\n' + ''.join(traceback.format_exception_only(type(err), err)).strip())
+                if self._sql_konta_map:
+                    self._log(f'Zadržavam postojeću mapu konta: {len(self._sql_konta_map)} unosa')
+                    messagebox.showerror('Greška', f'Neuspelo učitavanje konta iz SQL:\n{err}\n\nKoristi se postojeća mapa ({len(self._sql_konta_map)} konta).')
+                    return
+                self._sql_konta_map = None
+                self._sql_konta_meta = None
+                messagebox.showerror('Greška', f'Neuspelo učitavanje konta iz SQL:\n{err}'); return
+            m, meta = res
+            if not self._set_konta(m, meta, 'SQL', key):
+                messagebox.showinfo('OK', f'Učitano iz SQL ({key}): {len(m)} konta.\nU međuvremenu je izabrana druga baza, pa trenutna mapa nije promenjena.')
+                return
             self._log(f'Mapa konta iz SQL: {len(m)} unosa')
             messagebox.showinfo('OK', f'Učitano iz SQL: {len(m)} konta')
-        except Exception as e:
-            self._sql_konta_map = None
-            self._sql_konta_meta = None
-            self._log('Greška pri učitavanju konta\n' + ''.join(traceback.format_exception_only(type(e), e)).strip())
-            messagebox.showerror('Greška', f'Neuspelo učitavanje konta iz SQL:\n{e}')
+        self._start_job('Učitavanje konta', work, done)
+
+    def load_konta_lookup_sql(self):
+        """Učitava iz SQL-a samo konta koja se pojavljuju u učitanom XLSX-u i dodaje ih u postojeću mapu."""
+        mapping, missing = find_columns(self.df, ['konto'])
+        if missing:
+            messagebox.showerror('Greška', 'Nedostaje kolona: konto'); return
+        params, reader = self._sql_params(), self.reader
+        key = konta_cache_key(params)
+        def work(job):
+            with job.metrics.stage('read_konta') as st:
+                konta = workbook_konta(reader, mapping['konto'])
+                st['rows'] = len(konta)
+            self._log(f'Konta u XLSX-u: {len(konta)} jedinstvenih; tražim ih u SQL-u u grupama po {KONTA_LOOKUP_BATCH}')
+            with job.metrics.stage('sql_konta') as st:
+                rows = self._sql.run(params, self._log, lambda cn: fetch_konta_for(cn, konta))
+                st['rows'] = len(rows)
+            found, found_meta = build_konta_maps(rows)
+            return konta, {k: v for k, v in found.items() if k in konta}, found_meta
+        def done(res, err):
+            if err is not None:
+                self._log('Greška pri učitavanju konta\n' + ''.join(traceback.format_exception_only(type(err), err)).strip())
+                messagebox.showerror('Greška', f'Neuspelo učitavanje konta iz SQL:\n{err}'); return
+            konta, found, found_meta = res
+            if key != konta_cache_key(self._sql_params()):
+                self._log(f'Konta iz XLSX-a pronađena u {key}, ali je u međuvremenu izabrana druga baza; mapa se ne menja.')
+                return
+            m = dict(self._sql_konta_map or {}); m.update(found)
+            meta = dict(self._sql_konta_meta or {}); meta.update({kid: found_meta[kid] for kid in found.values()})
+            self._set_konta(m, meta, 'SQL')  # bez key: delimična mapa nije kontni plan baze
+            self._log(f'Pronađeno u SQL: {len(found)} od {len(konta)} konta. Mapa konta: {len(m)} unosa')
+            messagebox.showinfo('OK', f'Pronađeno u SQL: {len(found)} od {len(konta)} konta iz XLSX-a')
+        self._start_job('Učitavanje konta iz XLSX-a', work, done)
 
     def load_preview(self):
-        try:
-            df = pd.read_excel(self.xlsx_path.get(), dtype=str)
-            df = df.dropna(how='all')
-            self.df = df
-            self.show_preview(df)
-            n = len(self._sql_konta_map) if self._sql_konta_map else len(EMBEDDED_KONTA_MAP)
-            src = 'SQL' if self._sql_konta_map else 'EMBEDDED'
-            self.status.set(f'Učitan XLSX. Konta dostupno: {n} (izvor: {src})')
-            self._log(f'XLSX učitan. Kolone: {list(df.columns)}. Redova (ukupno): {len(df)}')
-            missing = [c for c in MAIN_REQUIRED if normalize_header(c) not in [normalize_header(x) for x in df.columns]]
-            if missing: self._log(f'UPOZORENJE: Moguće nedostaju kolone: {missing}')
-        except Exception as e:
-            self._log('Ne može da učita XLSX\n' + ''.join(traceback.format_exception_only(type(e), e)).strip())
-            messagebox.showerror('Greška', f'Ne može da učita XLSX:\n{e}')
+        """Prvi redovi odmah, pa ceo list u pozadini za pregled.
 
-    def show_preview(self, df):
-        for c in self.tree.get_children(): self.tree.delete(c)
-        self.tree['columns'] = list(df.columns)
-        for col in df.columns:
-            self.tree.heading(col, text=col)
-            self.tree.column(col, width=140, stretch=True)
-        for _, row in df.head(20).iterrows():
-            self.tree.insert('', 'end', values=[str(v) for v in row])
+        Čitanje celog lista nije posao (_start_job): generate i SQL mogu odmah, a novi fajl prekida staro čitanje.
+        """
+        path = self.xlsx_path.get()
+        konta_map = self._current_konta_map()
+        self.data = None
+        if self._preview_cancel is not None: self._preview_cancel.set()
+        cancel = self._preview_cancel = threading.Event()
+        metrics = RunMetrics('Učitavanje XLSX-a')
+        def work():
+            with metrics.active():
+                with metrics.stage('open'):
+                    reader = open_reader(path)
+                with metrics.stage('preview') as st:
+                    df = reader.preview(PREVIEW_ROWS)
+                    st['rows'] = len(df)
+                metrics.info.update(input=path, rows_estimate=max((reader.total_rows or 1) - 1, 0))
+                self._ui_queue.put(('call', self._show_first_rows, (reader, df)))
+                chunks, n = [], 0
+                with metrics.stage('read') as st:
+                    for chunk in reader.iter_chunks(cancel=cancel):
+                        chunks.append(chunk)
+                        n += len(chunk)
+                        if not cancel.is_set():
+                            self._ui_queue.put(('call', self.grid_view.info.set, (f'Učitavam ceo list u pregled… {n:,} redova',)))
+                    st['rows'] = n
+                data = pd.concat(chunks) if chunks else df.iloc[0:0]
+                with metrics.stage('skip_reasons') as st:
+                    st['rows'] = len(data)
+                    return reader, data, self._skip_reasons(data, konta_map)
+        def done(res, err):
+            cancelled = isinstance(err, JobCancelled)
+            self._record_metrics(metrics, 'cancelled' if cancelled else 'error' if err is not None else 'ok')
+            if cancelled: return
+            if err is not None:
+                self._log('Ne može da učita XLSX\n' + ''.join(traceback.format_exception_only(type(err), err)).strip())
+                messagebox.showerror('Greška', f'Ne može da učita XLSX:\n{err}'); return
+            reader, data, reasons = res
+            if reader is not self.reader: return
+            self.data = data
+            self.grid_view.set_data(data, reasons)
+            msg = f'Pregled: učitano svih {len(data):,} redova.'
+            if reasons is not None:
+                msg += f" Generate bi preskočio {int((reasons != '').sum()):,} (istaknuti u pregledu)."
+            self._log(msg)
+        self._log(f'Učitavam {path}')
+        self._run_bg(work, done)
 
-    def _write_debug_csv(self, path):
-        try:
-            with open(path, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.DictWriter(f, fieldnames=['row','status','reason','konto_raw','konto_norm'])
-                writer.writeheader()
-                for r in self._debug_rows: writer.writerow(r)
-            self._log(f'Debug log zapisan: {path}')
-        except Exception as e:
-            self._log(f'Ne mogu da upišem debug CSV: {e}')
+    def _show_first_rows(self, reader, df):
+        self.reader = reader
+        self.df = df
+        self.show_preview(df)
+        n = len(self._sql_konta_map) if self._sql_konta_map else len(EMBEDDED_KONTA_MAP)
+        src = 'SQL' if self._sql_konta_map else 'EMBEDDED'
+        self.status.set(f'Učitan XLSX. Konta dostupno: {n} (izvor: {src})')
+        self._log(f'XLSX učitan. Kolone: {list(df.columns)}. Redova (procena iz lista): {max((reader.total_rows or 1) - 1, 0)}')
+        missing = [c for c in MAIN_REQUIRED if normalize_header(c) not in [normalize_header(x) for x in df.columns]]
+        if missing: self._log(f'UPOZORENJE: Moguće nedostaju kolone: {missing}')
+
+    @staticmethod
+    def _skip_reasons(data, konta_map):
+        mapping, missing = find_columns(data, MAIN_REQUIRED)
+        return None if missing else skip_reasons(data, mapping, konta_map)
+
+    def _refresh_skip_reasons(self):
+        """Posle promene mape konta ponovo (u pozadini, za ceo list odjednom) računa istaknute redove."""
+        data, konta_map = self.data, self._current_konta_map()
+        if data is None: return
+        def done(reasons, err):
+            if err is None and data is self.data: self.grid_view.set_reasons(reasons)
+        self._run_bg(lambda: self._skip_reasons(data, konta_map), done)
+
+    def show_preview(self, df):
+        self.grid_view.set_data(df)
 
     def _current_konta_map(self):
         return self._sql_konta_map if self._sql_konta_map else EMBEDDED_KONTA_MAP
@@ -443,107 +2801,447 @@ class App(tk.Tk):
         return self._sql_konta_meta if self._sql_konta_meta else EMBEDDED_KONTA_META
 
     def generate(self):
-        self._debug_rows = [] # Clear debug rows for each run
+        if self.df is None:
+            messagebox.showwarning('Upozorenje', 'Prvo učitaj XLSX.')
+            self._log('Generate: nema učitanog XLSX-a')
+            return
+        if not self.sifra_preduzeca.get().strip():
+            messagebox.showwarning('Upozorenje', 'Prvo učitaj i odaberi preduzeće iz SQL-a.')
+            self._log('Generate: nije odabrano preduzeće')
+            return
+        mapping, missing = find_columns(self.df, MAIN_REQUIRED)
+        if missing:
+            self._log(f'Generate: nedostaju kolone: {missing}')
+            messagebox.showerror('Greška', 'Nedostaju kolone: ' + ', '.join(missing)); return
+        reader = self.reader
+        xlsx_path = self.xlsx_path.get()
+        sifra = self.sifra_preduzeca.get().strip()
+        tip_name = self.tip_naloga_var.get().strip()
+        note = self.napomena.get().strip() or 'Generisano iz XLSX'
+        konta_map = self._current_konta_map()
+        konta_meta = self._current_konta_meta()
+        src = ('SQL' if self._sql_konta_map else 'EMBEDDED')
+        out_path = self.out_path.get() or (os.path.splitext(xlsx_path)[0] + '_HYBRID_v4c_FIXED.xml')
+        self.out_path.set(out_path)
+        debug_csv = debug_log_path(out_path)
+        split_by = SPLIT_OPCIJE.get(self.split_var.get())
         try:
-            if self.df is None:
-                messagebox.showwarning('Upozorenje', 'Prvo učitaj XLSX.')
-                self._log('Generate: nema učitanog XLSX-a')
+            max_stavki = int(self.max_stavki_var.get() or MAX_STAVKI_PER_NALOG)
+            if not 1 <= max_stavki <= MAX_STAVKI_PER_NALOG: raise ValueError
+        except ValueError:
+            messagebox.showerror('Greška', f'Najviše stavki po nalogu mora biti broj od 1 do {MAX_STAVKI_PER_NALOG}.'); return
+        # MPPXML_PROFILE=1 (promenljiva okruženja) uključuje cProfile dump generisanja
+        profile = (os.path.join(CACHE_DIR, f"generate_{datetime.now():%Y%m%d_%H%M%S}.prof")
+                   if os.environ.get('MPPXML_PROFILE') else None)
+        def work(job):
+            if profile: os.makedirs(CACHE_DIR, exist_ok=True)
+            res = convert_file(xlsx_path, out_path, sifra, konta_map, konta_meta, tip_name, note,
+                               debug_csv=debug_csv, progress=job.progress, cancel=job.cancel_event,
+                               split_by=split_by, max_stavki=max_stavki, metrics=job.metrics, profile=profile,
+                               fragments=self._fragments)
+            if profile: self._log(f'cProfile zapisan: {profile}')
+            self._log(f'Debug log zapisan: {debug_csv}')
+            return res
+        def done(res, err):
+            if err is not None:
+                self._log('Greška u generate()\n' + ''.join(traceback.format_exception(type(err), err, err.__traceback__)))
+                messagebox.showerror('Greška', f'Neuspeh generisanja XML-a:\n{err}'); return
+            stavki, not_in_map = res['stavki'], res['not_in_map']
+            for line in skip_summary_lines(res['skip_summary']): self._log(line)
+            frag = res.get('fragments')
+            if frag and frag['reused']:
+                self._log(f"Iz keša prethodnog generisanja: {frag['reused']:,} redova; ponovo obrađeno: {frag['prepared']:,}")
+            if stavki == 0:
+                self._log('Nijedna stavka nije generisana — verovatno neprepoznata konta ili nula iznosi.')
+                messagebox.showerror('Greška', 'Nijedna stavka nije generisana. Pogledaj debug log:\n' + debug_csv)
                 return
-            if not self.sifra_preduzeca.get().strip():
-                messagebox.showwarning('Upozorenje', 'Prvo učitaj i odaberi preduzeće iz SQL-a.')
-                self._log('Generate: nije odabrano preduzeće')
+            checked = res.get('verify')
+            if checked:
+                for line in verify_lines(checked): self._log(line)
+            if checked and not checked['ok']:
+                more = f"\n… i još {checked['error_count'] - 5}" if checked['error_count'] > 5 else ''
+                messagebox.showwarning('Provera XML-a', f"XML je upisan, ali nije prošao proveru pre uvoza u MPP:\n{res['output']}\n\n"
+                                       + '\n'.join(checked['errors'][:5]) + more)
                 return
-            mapping, missing = find_columns(self.df, MAIN_REQUIRED)
-            if missing:
-                self._log(f'Generate: nedostaju kolone: {missing}')
-                messagebox.showerror('Greška', 'Nedostaju kolone: ' + ', '.join(missing)); return
-            tip_name = self.tip_naloga_var.get().strip()
-            tip_id = TIP_MAP.get(tip_name, 24)
-            dates_iso = [d for d in (parse_date_to_iso_tz(v) for v in self.df[mapping['datum promene']]) if d]
-            header_date = dates_iso[0] if dates_iso else datetime.now().strftime('%Y-%m-%dT00:00:00+02:00')
-            nalog_id = 900000
-            root = ET.Element('Dokumenti')
-            nalog = ET.SubElement(root, 'Nalog_za_knjiženje')
-            ET.SubElement(nalog, 'Šifra_x0020_preduzeca').text = self.sifra_preduzeca.get().strip()
-            ET.SubElement(nalog, 'fk_nk_nalog_za_knjizenje_id').text = str(nalog_id)
-            ET.SubElement(nalog, 'Status').text = '2'
-            ET.SubElement(nalog, 'tip_x0020_id').text = str(tip_id)
-            ET.SubElement(nalog, 'Tip').text = tip_name
-            ET.SubElement(nalog, 'Broj').text = f'<{nalog_id}>'
-            ET.SubElement(nalog, 'Org_x0020_broj').text = f'<{nalog_id}>'
-            ET.SubElement(nalog, 'Datum').text = header_date
-            note = self.napomena.get().strip() or 'Generisano iz XLSX'
-            ET.SubElement(nalog, 'Napomena').text = note
-            ET.SubElement(nalog, 'Spoljni_x0020_broj').text = note
-            used_kids = set()
-            konta_map = self._current_konta_map()
-            konta_meta = self._current_konta_meta()
-            rb = 1
-            not_in_map = 0
-            for idx, row in self.df.iterrows():
-                row_num = int(idx) + 2 # Excel row number (1-based index + header)
-                konto_raw = row.get(mapping['konto'], '')
-                konto_broj = norm_konto(konto_raw)
-                if not konto_broj:
-                    self._debug_rows.append({'row': row_num, 'status':'SKIP','reason':'konto empty','konto_raw':str(konto_raw),'konto_norm':konto_broj})
-                    continue
-                if konto_broj not in konta_map:
-                    not_in_map += 1
-                    self._debug_rows.append({'row': row_num, 'status':'SKIP','reason':'konto not in map','konto_raw':str(konto_raw),'konto_norm':konto_broj})
-                    continue
-                konto_id = konta_map[konto_broj]
-                used_kids.add(konto_id)
-                stavka = ET.SubElement(root, 'Stavka_naloga_za_knjizenje')
-                ET.SubElement(stavka, 'fk_nk_stavka_naloga_za_knjizenje_id').text = str(nalog_id + rb)
-                ET.SubElement(stavka, 'fk_nk_nalog_za_knjizenje_id').text = str(nalog_id)
-                ET.SubElement(stavka, 'fk_kp_konto_id').text = str(konto_id)
-                ET.SubElement(stavka, 'Redni_x0020_broj').text = str(rb)
-                d_prom = parse_date_to_iso_tz(row.get(mapping['datum promene']))
-                if d_prom: ET.SubElement(stavka, 'Datum_x0020_promene').text = d_prom
-                doc = '' if pd.isna(row.get(mapping['dokument'])) else str(row.get(mapping['dokument'])).strip()
-                if doc: ET.SubElement(stavka, 'Broj_x0020_dokumenta').text = doc
-                duguje = parse_amount(row.get(mapping['duguje']))
-                potrazuje = parse_amount(row.get(mapping['potražuje']))
-                added = False
-                if duguje and float(duguje) != 0.0:
-                    ET.SubElement(stavka, 'Duguje').text = duguje; added = True
-                if potrazuje and float(potrazuje) != 0.0:
-                    ET.SubElement(stavka, 'Potrazuje').text = potrazuje; added = True
-                if not added:
-                    root.remove(stavka)
-                    self._debug_rows.append({'row': row_num, 'status':'SKIP','reason':'zero amounts','konto_raw':str(konto_raw),'konto_norm':konto_broj})
-                    continue
-                opis = '' if pd.isna(row.get(mapping['opis'])) else str(row.get(mapping['opis'])).strip()
-                if opis: ET.SubElement(stavka, 'Opis').text = opis
-                ET.SubElement(stavka, 'Subanalitika').text = ''
-                ET.SubElement(stavka, 'Valuta_x0020_ID').text = '1'
-                ET.SubElement(stavka, 'Kurs').text = '0'
-                rb += 1
-            for kid in sorted(used_kids):
-                meta = konta_meta.get(kid, {'Broj':'', 'Naziv':''})
-                kb = ET.SubElement(root, 'Konto')
-                ET.SubElement(kb, 'fk_kp_konto_id').text = str(kid)
-                ET.SubElement(kb, 'Broj').text = str(meta.get('Broj',''))
-                ET.SubElement(kb, 'Naziv').text = str(meta.get('Naziv',''))
-                ET.SubElement(kb, 'Dozvoljeno_x0020_knjiženje').text = '1'
-                ET.SubElement(kb, 'Devizni').text = '0'
-            out_path = self.out_path.get() or (os.path.splitext(self.xlsx_path.get())[0] + '_HYBRID_v4c_FIXED.xml')
-            self.out_path.set(out_path)
-            debug_csv = os.path.join(os.path.dirname(out_path) or '.', 'xml_import_debug.csv')
-            ET.ElementTree(root).write(out_path, encoding='utf-8', xml_declaration=True)
-            self._write_debug_csv(debug_csv)
-            if rb == 1:
-                try: os.remove(out_path)
-                except Exception: pass
-                self._log('Nijedna stavka nije generisana — verovatno neprepoznata konta ili nula iznosi.')
-                messagebox.showerror('Greška', 'Nijedna stavka nije generisana. Pogledaj \'xml_import_debug.csv\'.')
+            if 'shards' in res:
+                self._log(f"GENERISANO OK: {len(res['shards'])} naloga, manifest {res['output']}. Stavki: {stavki}. Konto not-in-map: {not_in_map}.")
+                messagebox.showinfo('Gotovo', f"Generisano {len(res['shards'])} XML fajlova (" + src + ' mapa).\nManifest:\n' + res['output'] + '\n\nDebug log:\n' + debug_csv)
                 return
-            self._log(f'GENERISANO OK: {out_path}. Stavki: {rb-1}. Konto not-in-map: {not_in_map}.')
-            src = ('SQL' if self._sql_konta_map else 'EMBEDDED')
+            self._log(f"GENERISANO OK: {out_path} ({res['output_bytes'] / 2**20:.1f} MB). Stavki: {stavki}. Konto not-in-map: {not_in_map}.")
             messagebox.showinfo('Gotovo', 'XML generisan (' + src + ' mapa):\n' + out_path + '\n\nDebug log:\n' + debug_csv)
+        total = (reader.total_rows - 1) if reader.total_rows else None
+        self._start_job('Generisanje XML-a', work, done, total=total)
+
+def _cli_log(msg):
+    print(f"{datetime.now().strftime('%H:%M:%S')}  {msg}", file=sys.stderr)
+
+def _append_metrics(metrics, path=METRICS_FILE, log=_cli_log):
+    log(metrics.summary())
+    try:
+        metrics.append(path)
+    except Exception as e:
+        log(f'Ne mogu da upišem metrike: {e}')
+
+def load_konta_rows(params, sql, log, known_sig=None, offline=False, fallback=True):
+    """Kontni plan za rad bez GUI-ja: (redovi, potpis, izvor). Iz SQL-a (i osvežava keš), a ako server nije
+    dostupan (ili offline) — iz lokalnog keša. Redovi su None kad je potpis na SQL-u jednak known_sig.
+    Sa fallback=False greška SQL-a se prosleđuje pozivaocu umesto čitanja keša.
+    """
+    cache, key = KontaCache(), konta_cache_key(params)
+    if not offline:
+        def fetch(cn):
+            sig = fetch_konta_signature(cn)
+            return (None if sig == known_sig else sql_fetchall(cn, KONTA_SQL)), sig
+        try:
+            rows, sig = sql.run(params, log, fetch)
+        except Exception as e:
+            if not fallback: raise
+            log(f'SQL nije dostupan ({e}), koristim lokalni keš konta.')
+        else:
+            if rows is not None:
+                try: cache.save(key, rows, sig)
+                except Exception as e: log(f'Ne mogu da upišem keš konta: {e}')
+            return rows, sig, 'SQL'
+    cached = cache.load(key)
+    if not cached:
+        raise RuntimeError(f'Nema konta: SQL nije dostupan, a keš za {key} ne postoji.')
+    return cached[0], cached[1], f'keša ({cached[2]})'
+
+def load_konta_headless(params, offline=False, log=_cli_log):
+    """Mapa konta za convert: load_konta_rows sa jednokratnom konekcijom."""
+    sql = SqlSession()
+    try:
+        rows, _, src = load_konta_rows(params, sql, log, offline=offline)
+    finally:
+        sql.close()
+    m, meta = build_konta_maps(rows)
+    log(f'Mapa konta iz {src}: {len(m)} unosa')
+    return m, meta
+
+def _cli_sql_params(a):
+    return {'server': a.server, 'instance': a.instance, 'port': a.port, 'database': a.database,
+            'windows_auth': not a.user, 'username': a.user or '', 'password': a.password or ''}
+
+def _add_sql_args(p):
+    g = p.add_argument_group('SQL Server (konta)')
+    g.add_argument('--server', default='GTRS24MPP')
+    g.add_argument('--instance', default='')
+    g.add_argument('--port', default='1433')
+    g.add_argument('--database', default='mAS2')
+    g.add_argument('--user', help='SQL autentikacija (bez ovoga: Windows autentikacija)')
+    g.add_argument('--password')
+    g.add_argument('--offline', action='store_true', help='konta samo iz lokalnog keša')
+
+# --- Servis: praćenje ulaznog direktorijuma ---
+WATCH_DIRS = ('inbox', 'out', 'done', 'failed')
+WATCH_RECENT = 20  # poslednjih rezultata u status fajlu
+WATCH_RATE_WINDOW_S = 300  # protok u status fajlu je za poslednjih 5 minuta
+
+def _unique_path(path, taken=()):
+    """path, ili ime sa vremenom (i brojem) ako fajl već postoji ili je rezervisan."""
+    if not os.path.exists(path) and path not in taken: return path
+    stem, ext = split_output_ext(path)
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    for i in itertools.count():
+        p = f'{stem}_{stamp}{ext}' if i == 0 else f'{stem}_{stamp}_{i}{ext}'
+        if not os.path.exists(p) and p not in taken: return p
+
+class WatchFolder:
+    """Servis bez GUI-ja: fajlovi iz root/inbox idu u red i konvertuju se u ograničenom pool-u procesa.
+
+    Konverzija je ista kao za convert i generate (convert_file). Mapa konta se učitava jednom po procesu
+    (initializer) i menja samo kad se potpis konta na SQL-u promeni. XML ide u root/out, ulaz sa debug
+    CSV-om u root/done ili root/failed, a red, protok i poslednji rezultati u root/status.json.
+    """
+    def __init__(self, root, sifra, params, offline=False, tip_name='Tekući promet', napomena='Generisano iz XLSX',
+                 workers=None, split_by=None, max_stavki=MAX_STAVKI_PER_NALOG, poll_s=2.0, settle_s=2.0,
+                 konta_refresh_s=600, metrics_path=METRICS_FILE, log=_cli_log, compress=None):
+        self.root = os.path.abspath(root)
+        self.dirs = {d: os.path.join(self.root, d) for d in WATCH_DIRS}
+        self.status_path = os.path.join(self.root, 'status.json')
+        self.sifra, self.params, self.offline = sifra, params, offline
+        self.tip_name, self.napomena = tip_name, napomena
+        self.workers = workers or os.cpu_count() or 1
+        self.split_by, self.max_stavki = split_by, max_stavki
+        self.out_ext = OUTPUT_FORMATS[compress or 'xml']
+        self.poll_s, self.settle_s, self.konta_refresh_s = poll_s, settle_s, konta_refresh_s
+        self.metrics_path, self.log = metrics_path, log
+        self.queue = collections.deque()
+        self.processed = self.failed = self.stavki = 0
+        self.started = datetime.now()
+        self._t0 = time.monotonic()
+        self._seen = {}  # putanja -> (veličina, mtime) iz prethodnog pregleda
+        self._queued = set()  # u redu ili u obradi (ili zaglavljeni: ne mogu da se premeste)
+        self._running = {}  # future -> (ulaz, xml, debug CSV)
+        self._recent = collections.deque(maxlen=WATCH_RECENT)
+        self._rate = collections.deque()  # (vreme završetka, redova, stavki)
+        self._pool = None
+        self._konta = None
+        self._konta_sig = None
+        self._konta_checked = 0.0
+        self._sql = SqlSession()
+        self._stop = threading.Event()
+
+    def _load_konta(self):
+        """Pri startu i svakih konta_refresh_s: potpis konta na SQL-u; nova mapa (i pool) samo ako se promenio."""
+        self._konta_checked = time.monotonic()
+        if self.offline and self._konta is not None: return
+        try:
+            # dok mapa postoji, greška SQL-a ne vraća stari keš: ostaje mapa koja već radi
+            rows, sig, src = load_konta_rows(self.params, self._sql, self.log, self._konta_sig, self.offline,
+                                             fallback=self._konta is None)
         except Exception as e:
-            self._log('Greška u generate()\n' + traceback.format_exc())
-            messagebox.showerror('Greška', f'Neuspeh generisanja XML-a:\n{e}')
+            if self._konta is None: raise
+            self.log(f'Provera konta nije uspela ({e}), radim sa postojećom mapom.'); return
+        if rows is None: return  # potpis isti, mapa ostaje
+        self._konta = build_konta_maps(rows)
+        self._konta_sig = sig
+        self.log(f'Mapa konta iz {src}: {len(self._konta[0])} unosa')
+        self._start_pool()
+
+    def _start_pool(self):
+        # Poslovi koji već rade završavaju u starom pool-u; novi idu u pool sa novom mapom
+        if self._pool is not None: self._pool.shutdown(wait=False)
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=self._konta)
+
+    def scan(self, settled=False):
+        """Novi fajlovi iz inbox-a ulaze u red (po vremenu izmene) kad se bar settle_s ne menjaju."""
+        now, current = time.time(), {}
+        with os.scandir(self.dirs['inbox']) as it:
+            for e in it:
+                if not e.is_file() or e.name.startswith(('~$', '.')): continue
+                if os.path.splitext(e.name)[1].lower() not in INPUT_READERS: continue
+                st = e.stat()
+                current[e.path] = (st.st_size, st.st_mtime)
+        for path, sig in sorted(current.items(), key=lambda kv: kv[1][1]):
+            if path in self._queued: continue
+            if settled or (self._seen.get(path) == sig and now - sig[1] >= self.settle_s):
+                self.queue.append(path)
+                self._queued.add(path)
+        self._seen = current
+
+    def dispatch(self):
+        """Iz reda u pool, najviše workers fajlova istovremeno (ostali čekaju u redu)."""
+        while self.queue and len(self._running) < self.workers:
+            path = self.queue.popleft()
+            stem = os.path.splitext(os.path.basename(path))[0]
+            taken = {v[1] for v in self._running.values()}
+            out_path = _unique_path(os.path.join(self.dirs['out'], stem + self.out_ext), taken)
+            debug_csv = debug_log_path(out_path)
+            fut = self._pool.submit(_convert_job, path, out_path, debug_csv, self.sifra, self.tip_name,
+                                    self.napomena, self.split_by, self.max_stavki)
+            self._running[fut] = (path, out_path, debug_csv)
+            self.log(f'Obrađujem {os.path.basename(path)} (u redu još {len(self.queue)})')
+
+    def collect(self):
+        """Završeni poslovi: ulaz i debug CSV u done/failed, rezultat u status i metrike."""
+        for fut in [f for f in self._running if f.done()]:
+            path, out_path, debug_csv = self._running.pop(fut)
+            try:
+                res = fut.result()
+            except Exception as e:  # proces je pao (BrokenProcessPool) ili se posao nije pokrenuo
+                res = {'input': path, 'output': None, 'debug_csv': None, 'error': f'{type(e).__name__}: {e}'}
+                if isinstance(e, BrokenProcessPool): self._start_pool()
+            extras = [debug_csv, res.get('suggestions_csv')]
+            if not res.get('error') and not res.get('verify', {}).get('ok', True):
+                # XML koji nije prošao proveru ne ostaje u out, da ne bi bio uvezen u MPP
+                res['error'] = 'Provera XML-a: ' + '; '.join(res['verify']['errors'][:3])
+                out_dir = os.path.dirname(res['output'])
+                extras += [res['output']] + [os.path.join(out_dir, sh) for sh in res.get('shards', [])]
+            ok = not res.get('error')
+            dest = self.dirs['done' if ok else 'failed']
+            try:
+                moved = _unique_path(os.path.join(dest, os.path.basename(path)))
+                os.replace(path, moved)
+                self._queued.discard(path)
+            except OSError as e:
+                self.log(f'Ne mogu da premestim {path} ({e}); ostaje u inbox-u i ne obrađuje se ponovo.')
+                moved = path
+            for extra in extras:
+                if extra and os.path.exists(extra):
+                    try: os.replace(extra, _unique_path(os.path.join(dest, os.path.basename(extra))))
+                    except OSError as e: self.log(f'Ne mogu da premestim {extra}: {e}')
+            if not ok:
+                self.failed += 1
+                self.log(f"GREŠKA {os.path.basename(path)}: {res['error']}")
+                try:
+                    with open(os.path.splitext(moved)[0] + '_greska.txt', 'w', encoding='utf-8') as f: f.write(res['error'] + '\n')
+                except OSError:
+                    pass
+            else:
+                self.processed += 1
+                self.stavki += res['stavki']
+                self._rate.append((time.monotonic(), res['stavki'] + res['skipped'], res['stavki']))
+                self.log(f"OK {os.path.basename(path)} → {res['output']}: stavki {res['stavki']}, "
+                         f"preskočeno {res['skipped']}, {res['seconds']} s")
+                if res.get('metrics'):
+                    try: append_jsonl(self.metrics_path, res['metrics'])
+                    except Exception as e: self.log(f'Ne mogu da upišem metrike: {e}')
+            self._recent.appendleft({
+                'input': os.path.basename(path), 'finished': datetime.now().isoformat(timespec='seconds'),
+                'output': res.get('output'), 'stavki': res.get('stavki'), 'skipped': res.get('skipped'),
+                'seconds': res.get('seconds'), 'error': res.get('error'),
+            })
+
+    def status(self, state='running'):
+        now = time.monotonic()
+        while self._rate and now - self._rate[0][0] > WATCH_RATE_WINDOW_S: self._rate.popleft()
+        window = max(min(WATCH_RATE_WINDOW_S, now - self._t0), 1.0)
+        return {
+            'state': state,
+            'pid': os.getpid(),
+            'started': self.started.isoformat(timespec='seconds'),
+            'updated': datetime.now().isoformat(timespec='seconds'),
+            'inbox': self.dirs['inbox'],
+            'workers': self.workers,
+            'queue_depth': len(self.queue),
+            'in_progress': [os.path.basename(v[0]) for v in self._running.values()],
+            'processed': self.processed,
+            'failed': self.failed,
+            'stavki': self.stavki,
+            'throughput': {
+                'window_s': round(window),
+                'files_per_min': round(len(self._rate) * 60 / window, 2),
+                'rows_per_s': round(sum(r[1] for r in self._rate) / window),
+                'stavki_per_s': round(sum(r[2] for r in self._rate) / window),
+            },
+            'konta': len(self._konta[0]) if self._konta else 0,
+            'recent': list(self._recent),
+        }
+
+    def write_status(self, state='running'):
+        tmp = self.status_path + '.part'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f: json.dump(self.status(state), f, ensure_ascii=False, indent=1)
+            os.replace(tmp, self.status_path)
+        except OSError:
+            pass  # npr. status.json je trenutno otvoren za čitanje; upisuje se ponovo u sledećem krugu
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self, once=False):
+        """Glavna petlja (Ctrl+C, SIGTERM ili stop() završava posle poslova u obradi); once=True obradi inbox i izađe."""
+        for d in self.dirs.values(): os.makedirs(d, exist_ok=True)
+        prev_term = None
+        if threading.current_thread() is threading.main_thread():
+            prev_term = signal.signal(signal.SIGTERM, lambda *_: self.stop())
+        self._load_konta()
+        self.log(f"Pratim {self.dirs['inbox']} ({self.workers} procesa); status: {self.status_path}")
+        state = 'stopped'
+        try:
+            if once: self.scan(settled=True)
+            while not self._stop.is_set():
+                if time.monotonic() - self._konta_checked >= self.konta_refresh_s: self._load_konta()
+                self.collect()
+                if not once: self.scan()
+                self.dispatch()
+                self.write_status()
+                if once and not self.queue and not self._running: break
+                if self._running: wait(list(self._running), timeout=self.poll_s, return_when=FIRST_COMPLETED)
+                else: self._stop.wait(self.poll_s)
+        except KeyboardInterrupt:
+            self.log('Zaustavljam servis; čekam poslove koji su u obradi…')
+        except Exception:
+            state = 'error'
+            raise
+        finally:
+            wait(list(self._running))
+            self.collect()
+            self.write_status(state)
+            if self._pool is not None: self._pool.shutdown()
+            self._sql.close()
+            if prev_term is not None: signal.signal(signal.SIGTERM, prev_term)
+        self.log(f'Servis zaustavljen: obrađeno {self.processed}, neuspešnih {self.failed}, stavki {self.stavki}.')
+        return 1 if self.failed else 0
+
+def verify_files(paths, json_path=None, log=_cli_log):
+    """Samostalna provera (komanda verify): 0 ako su svi fajlovi ispravni, inače 1."""
+    results = []
+    for path in paths:
+        r = dict(verify_output(path), path=path)
+        results.append(r)
+        log(f"{path}: {r['bytes'] / 2**20:.1f} MB, {r['bytes'] / 2**20 / max(r['seconds'], 1e-9):.0f} MB/s")
+        for line in verify_lines(r, top=VERIFY_MAX_MESSAGES): log('   ' + line)
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as f: json.dump(results, f, ensure_ascii=False, indent=1)
+    return 0 if all(r['ok'] for r in results) else 1
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        App().mainloop(); return 0
+    ap = argparse.ArgumentParser(description='PSIT MPP: XLSX u XML (bez GUI-ja)')
+    sub = ap.add_subparsers(dest='cmd', required=True)
+    c = sub.add_parser('convert', help='konvertuj jedan ili više XLSX fajlova (fajlovi, direktorijumi, glob)')
+    c.add_argument('inputs', nargs='+')
+    c.add_argument('-o', '--out-dir', default='.', help='direktorijum za XML, debug CSV i rezime')
+    c.add_argument('--sifra', required=True, help='šifra preduzeća')
+    c.add_argument('--tip', default='Tekući promet', choices=TIP_OPCIJE)
+    c.add_argument('--napomena', default='Generisano iz XLSX')
+    c.add_argument('-j', '--workers', type=int, default=None, help='broj procesa (podrazumevano: broj jezgara)')
+    c.add_argument('--split', choices=SPLIT_MODES, help='podeli izlaz na više naloga/fajlova: po broju stavki, dokumentu ili mesecu')
+    c.add_argument('--max-stavki', type=int, default=MAX_STAVKI_PER_NALOG, help=f'najviše stavki po nalogu (do {MAX_STAVKI_PER_NALOG})')
+    c.add_argument('--compress', choices=('gzip', 'zip'), help='XML komprimovan dok se piše: <ime>.xml.gz ili <ime>.zip')
+    c.add_argument('--metrics', default=METRICS_FILE, help='JSON-lines fajl u koji se dopisuju metrike svakog posla')
+    c.add_argument('--profile', action='store_true', help='cProfile dump (<ime>.prof) za svaki fajl')
+    _add_sql_args(c)
+    w = sub.add_parser('watch', help='servis: prati inbox direktorijum i konvertuje nove fajlove')
+    w.add_argument('root', help='radni direktorijum: inbox, out, done, failed i status.json')
+    w.add_argument('--sifra', required=True, help='šifra preduzeća')
+    w.add_argument('--tip', default='Tekući promet', choices=TIP_OPCIJE)
+    w.add_argument('--napomena', default='Generisano iz XLSX')
+    w.add_argument('-j', '--workers', type=int, default=None, help='najviše fajlova u obradi istovremeno (podrazumevano: broj jezgara)')
+    w.add_argument('--split', choices=SPLIT_MODES, help='podeli izlaz na više naloga/fajlova: po broju stavki, dokumentu ili mesecu')
+    w.add_argument('--max-stavki', type=int, default=MAX_STAVKI_PER_NALOG, help=f'najviše stavki po nalogu (do {MAX_STAVKI_PER_NALOG})')
+    w.add_argument('--compress', choices=('gzip', 'zip'), help='XML komprimovan dok se piše: <ime>.xml.gz ili <ime>.zip')
+    w.add_argument('--metrics', default=METRICS_FILE, help='JSON-lines fajl u koji se dopisuju metrike svakog posla')
+    w.add_argument('--poll', type=float, default=2.0, help='na koliko sekundi se pregleda inbox')
+    w.add_argument('--settle', type=float, default=2.0, help='fajl se obrađuje tek kad se ovoliko sekundi ne menja (kopiranje)')
+    w.add_argument('--konta-refresh', type=float, default=600, help='na koliko sekundi se proverava da li su se konta na SQL-u promenila')
+    w.add_argument('--once', action='store_true', help='obradi ono što je u inbox-u i izađi')
+    _add_sql_args(w)
+    v = sub.add_parser('verify', help='proveri generisani XML (.xml, .xml.gz, .zip ili *_manifest.json) pre uvoza u MPP')
+    v.add_argument('files', nargs='+')
+    v.add_argument('--json', help='rezultati provere u JSON fajl')
+    a = ap.parse_args(argv)
+    if a.cmd == 'verify':
+        return verify_files(a.files, a.json)
+    if a.cmd == 'watch':
+        service = WatchFolder(a.root, a.sifra, _cli_sql_params(a), a.offline, a.tip, a.napomena, a.workers, a.split,
+                              a.max_stavki, a.poll, a.settle, a.konta_refresh, a.metrics, compress=a.compress)
+        return service.run(once=a.once)
+    inputs = expand_inputs(a.inputs)
+    if not inputs:
+        _cli_log('Nema ulaznih XLSX fajlova.'); return 2
+    m = RunMetrics('Učitavanje konta')
+    with m.active():
+        konta_map, konta_meta = load_konta_headless(_cli_sql_params(a), a.offline)
+    _append_metrics(m.finish(), a.metrics)
+    _cli_log(f'Konvertujem {len(inputs)} fajl(ova) → {os.path.abspath(a.out_dir)}')
+    t0 = time.perf_counter()
+    results = convert_many(inputs, a.out_dir, a.sifra, konta_map, konta_meta, a.tip, a.napomena, a.workers,
+                           log=_cli_log, split_by=a.split, max_stavki=a.max_stavki, profile=a.profile,
+                           compress=a.compress)
+    for r in results:
+        if r.get('metrics'):
+            try:
+                append_jsonl(a.metrics, r['metrics'])
+            except Exception as e:
+                _cli_log(f'Ne mogu da upišem metrike: {e}')
+    summary = {
+        'finished_at': datetime.now().isoformat(timespec='seconds'),
+        'seconds': round(time.perf_counter() - t0, 3),
+        'files': len(results),
+        'failed': sum(1 for r in results if r.get('error') or not r.get('verify', {}).get('ok', True)),
+        'stavki': sum(r.get('stavki', 0) for r in results),
+        'results': results,
+    }
+    summary_path = os.path.join(a.out_dir, 'batch_summary.json')
+    with open(summary_path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=1)
+    _cli_log(f"Gotovo za {summary['seconds']} s: fajlova {summary['files']}, neuspešnih {summary['failed']}, stavki {summary['stavki']}. Rezime: {summary_path}")
+    return 1 if summary['failed'] else 0
 
 if __name__ == '__main__':
-    App().mainloop()
\ No newline at end of file
+    sys.exit(main())
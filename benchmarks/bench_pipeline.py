@@ -0,0 +1,219 @@
+"""Benchmark XLSX -> XML pipeline-a na sintetičkim podacima.
+
+Pravi radne sveske u obliku template_knjizenje_sa_kontom.xlsx (1k, 10k, 100k i 1M redova),
+sa iznosima sa decimalnim zarezom, mešanim formatima datuma, nepoznatim kontima i nultim
+redovima, pa posebno meri učitavanje, prepoznavanje kolona, parsiranje, mapiranje konta i
+pisanje XML-a (vreme i vršna memorija). SQL deo (dbo.cp_preduzece, dbo.fk_kp_konto) ide
+preko lokalne SQLite baze umesto MPP servera. Rezultat je JSON, da bi se pokretanja mogla
+porediti kroz vreme.
+
+    python benchmarks/bench_pipeline.py                      # 1k, 10k, 100k, 1M
+    python benchmarks/bench_pipeline.py --sizes 1000 10000 -o rezultat.json
+"""
+import os, sys, json, time, random, argparse, platform, tracemalloc, subprocess, sqlite3, tempfile, zlib
+from datetime import datetime, timedelta
+
+import openpyxl
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import Redizajnknjizenje_xml_gui_SQL_v4c_hybrid_log_FIXED as app  # noqa: E402
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+HEADERS = ['konto', 'duguje', 'potražuje', 'poslovni partner', 'dokument', 'datum promene', 'opis']
+N_KONTA = 3000
+UNKNOWN_SHARE = 0.05
+ZERO_SHARE = 0.05
+
+# --- SQLite zamena za MPP bazu ---
+def _binary_checksum(*vals):
+    return zlib.crc32(repr(vals).encode('utf-8'))
+
+class _ChecksumAgg:
+    def __init__(self): self.v = 0
+    def step(self, x): self.v ^= (x or 0)
+    def finalize(self): return self.v
+
+def konta_rows(n=N_KONTA, seed=7):
+    rnd = random.Random(seed)
+    broj = set()
+    while len(broj) < n:
+        broj.add(str(rnd.randint(100, 999999)))
+    return [(i + 1, b, f'Konto {b}') for i, b in enumerate(sorted(broj))]
+
+def standin_db(path, konta):
+    """Baza sa šemom 'dbo' (ATTACH), pa upiti iz aplikacije rade bez izmene."""
+    dbo = path + '.dbo'
+    for p in (path, dbo):
+        if os.path.exists(p): os.remove(p)
+    cn = sqlite3.connect(path, check_same_thread=False)
+    cn.execute('ATTACH DATABASE ? AS dbo', (dbo,))
+    cn.create_function('BINARY_CHECKSUM', -1, _binary_checksum)
+    cn.create_aggregate('CHECKSUM_AGG', 1, _ChecksumAgg)
+    cn.execute('CREATE TABLE dbo.fk_kp_konto (fk_kp_konto_id INTEGER PRIMARY KEY, Broj TEXT, Naziv TEXT)')
+    cn.execute('CREATE TABLE dbo.cp_preduzece (cp_preduzece_id INTEGER PRIMARY KEY, sifra TEXT, naziv TEXT)')
+    cn.executemany('INSERT INTO dbo.fk_kp_konto VALUES (?, ?, ?)', konta)
+    cn.executemany('INSERT INTO dbo.cp_preduzece VALUES (?, ?, ?)',
+                   [(i, f'{i:02d}', f'Preduzeće {i}') for i in range(1, 21)])
+    cn.commit()
+    return cn
+
+# --- Sintetička radna sveska ---
+def _amount(rnd):
+    v = rnd.randint(1, 5_000_000) / 100
+    kind = rnd.random()
+    if kind < 0.5: return v                                       # broj u ćeliji
+    if kind < 0.8: return f'{v:,.2f}'.replace(',', ' ').replace('.', ',').replace(' ', '.')  # 1.234,56
+    return f'{v:.2f}'.replace('.', ',')                           # 1234,56
+
+def _date(rnd, base=datetime(2024, 1, 1)):
+    d = base + timedelta(days=rnd.randint(0, 364))
+    kind = rnd.random()
+    if kind < 0.6: return d
+    if kind < 0.8: return d.strftime('%d.%m.%Y')
+    if kind < 0.95: return d.strftime('%Y-%m-%d')
+    return None
+
+def make_workbook(path, rows, konta, seed=1):
+    rnd = random.Random(seed)
+    brojevi = [k[1] for k in konta]
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(HEADERS)
+    for i in range(rows):
+        r = rnd.random()
+        konto = str(rnd.randint(10_000_000, 99_999_999)) if r < UNKNOWN_SHARE else rnd.choice(brojevi)
+        if rnd.random() < 0.1: konto = konto[:2] + '.' + konto[2:]
+        if rnd.random() < ZERO_SHARE:
+            dug, pot = rnd.choice([0, '0,00', None]), rnd.choice([0, None])
+        elif rnd.random() < 0.5:
+            dug, pot = _amount(rnd), None
+        else:
+            dug, pot = None, _amount(rnd)
+        ws.append([konto, dug, pot, None, f'DOK-{i // 50:06d}', _date(rnd), rnd.choice(['Promet', 'Službenost', None])])
+    wb.save(path)
+
+# --- Merenje ---
+class Stages:
+    def __init__(self, memory=True):
+        self.memory = memory
+        self.results = {}
+
+    def run(self, name, fn, rows=None):
+        if self.memory:
+            tracemalloc.start()
+        t0 = time.perf_counter()
+        try:
+            value = fn()
+        finally:
+            seconds = time.perf_counter() - t0
+            peak = tracemalloc.get_traced_memory()[1] if self.memory else None
+            if self.memory: tracemalloc.stop()
+        r = {'seconds': round(seconds, 4)}
+        if rows: r['rows_per_s'] = round(rows / seconds) if seconds else None
+        if peak is not None: r['peak_mb'] = round(peak / 2**20, 2)
+        self.results[name] = r
+        return value
+
+def bench_sql(db, stages):
+    stages.run('sql_preduzeca', lambda: app.sql_fetchall(db, app.PREDUZECA_SQL))
+    stages.run('sql_konta_full', lambda: app.build_konta_maps(app.sql_fetchall(db, app.KONTA_SQL)))
+    stages.run('sql_konta_signature', lambda: app.fetch_konta_signature(db))
+
+def bench_size(rows, data_dir, db, konta, memory):
+    path = os.path.join(data_dir, f'bench_{rows}.xlsx')
+    if not os.path.exists(path):
+        t0 = time.perf_counter()
+        make_workbook(path, rows, konta)
+        print(f'  napravljen {path} ({time.perf_counter() - t0:.1f} s)', file=sys.stderr)
+    stages = Stages(memory)
+    konta_map, konta_meta = app.build_konta_maps(konta)
+
+    reader = app.XlsxReader(path)
+    mapping, missing = stages.run('detect_columns', lambda: app.find_columns(reader.preview(1), app.MAIN_REQUIRED))
+    if missing: raise RuntimeError(f'nedostaju kolone: {missing}')
+    cols = list(dict.fromkeys(mapping.values()))
+    chunks = stages.run('load', lambda: list(reader.iter_chunks(columns=cols)), rows)
+
+    def parse():
+        for c in chunks:
+            app.parse_amount_series(c[mapping['duguje']])
+            app.parse_amount_series(c[mapping['potražuje']])
+            app.parse_date_series(c[mapping['datum promene']])
+    stages.run('parse', parse, rows)
+
+    def konto_mapping():
+        for c in chunks:
+            norm = app.norm_konto_series(c[mapping['konto']])
+            norm.map({k: konta_map.get(k) for k in norm.unique()})
+    stages.run('konto_mapping', konto_mapping, rows)
+
+    used = stages.run('sql_konta_lookup', lambda: app.fetch_konta_for(
+        db, {k for c in chunks for k in app.norm_konto_series(c[mapping['konto']]).unique() if k}))
+
+    prepared = stages.run('prepare', lambda: [app.prepare_frame(c, mapping, konta_map) for c in chunks], rows)
+    with tempfile.TemporaryDirectory() as tmp:
+        out = os.path.join(tmp, 'out.xml')
+        stavki, not_in_map = stages.run('serialize', lambda: app.write_nalog_xml(
+            prepared, out, '01', 'Tekući promet', 'benchmark', konta_meta, []), rows)
+        xml_bytes = os.path.getsize(out)
+    return {
+        'rows': rows,
+        'stavki': stavki,
+        'not_in_map': not_in_map,
+        'konta_lookup_rows': len(used),
+        'xml_bytes': xml_bytes,
+        'stages': stages.results,
+    }
+
+def _git_rev():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='broj redova po radnoj svesci')
+    ap.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'mppXML_bench'),
+                    help='gde se čuvaju napravljene radne sveske (ponovo se koriste)')
+    ap.add_argument('-o', '--out', help='JSON sa rezultatima (podrazumevano: benchmarks/results/<vreme>.json)')
+    ap.add_argument('--no-memory', action='store_true', help='bez tracemalloc-a (tačnija vremena, bez vršne memorije)')
+    a = ap.parse_args(argv)
+
+    os.makedirs(a.data_dir, exist_ok=True)
+    konta = konta_rows()
+    db = standin_db(os.path.join(a.data_dir, 'standin.sqlite'), konta)
+    sql_stages = Stages(not a.no_memory)
+    bench_sql(db, sql_stages)
+    runs = []
+    for rows in a.sizes:
+        print(f'{rows} redova…', file=sys.stderr)
+        r = bench_size(rows, a.data_dir, db, konta, not a.no_memory)
+        runs.append(r)
+        print('  ' + ', '.join(f"{k} {v['seconds']} s" for k, v in r['stages'].items()), file=sys.stderr)
+    db.close()
+
+    result = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'git': _git_rev(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'pandas': pd.__version__,
+        'openpyxl': openpyxl.__version__,
+        'memory_traced': not a.no_memory,
+        'sql': sql_stages.results,
+        'runs': runs,
+    }
+    out = a.out or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results',
+                                datetime.now().strftime('%Y%m%d_%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=1)
+    print(f'Rezultati: {out}', file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
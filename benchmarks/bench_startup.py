@@ -0,0 +1,101 @@
+"""Provera brzine starta aplikacije (regresioni test za STARTUP_TARGET_S).
+
+Svako merenje je novi Python proces: uvoz modula aplikacije i, ako postoji ekran, vreme do prvog
+prikaza prozora. Ni pri uvozu ni do prvog prikaza (<Map>) ne sme da se učita nijedan od odloženih
+modula (pandas, numpy, openpyxl, pyodbc, pymssql) — to je najčešći uzrok sporog starta. Pozadinsko
+zagrevanje modula se u merenju isključuje, da bi se videlo samo ono što uvozi pravljenje prozora.
+Izlazni kod je 1 ako je medijana iznad cilja ili ako se neki odloženi modul uvozi unapred.
+
+    python benchmarks/bench_startup.py                   # 5 merenja, cilj iz aplikacije
+    python benchmarks/bench_startup.py -n 10 --target 0.8 --no-gui
+"""
+import os, sys, json, argparse, platform, statistics, subprocess
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULE = 'Redizajnknjizenje_xml_gui_SQL_v4c_hybrid_log_FIXED'
+HEAVY = ('pandas', 'numpy', 'openpyxl', 'pyodbc', 'pymssql')
+
+# Izvršava se u novom procesu; ispisuje jednu JSON liniju
+PROBE = r'''
+import sys, json, time
+t0 = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import {module} as app
+r = {{'import_s': time.perf_counter() - t0,
+      'heavy_loaded': [m for m in {heavy!r} if m in sys.modules]}}
+if sys.argv[2] == '1':
+    app.warm_up_modules = lambda *a, **k: {{}}
+    shown = []
+    def on_map(e):
+        if e.widget is a and not shown:
+            shown.append(time.perf_counter())
+            r['heavy_loaded_at_frame'] = [m for m in {heavy!r} if m in sys.modules]
+    a = app.App()
+    a.bind('<Map>', on_map, add='+')
+    while not shown: a.update()
+    a.update_idletasks()
+    r['first_frame_s'] = time.perf_counter() - t0
+    a.destroy()
+print(json.dumps(r))
+'''.format(module=MODULE, heavy=HEAVY)
+
+def has_display():
+    return sys.platform in ('win32', 'darwin') or bool(os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY'))
+
+def probe(gui):
+    out = subprocess.run([sys.executable, '-c', PROBE, ROOT, '1' if gui else '0'],
+                         capture_output=True, text=True, timeout=120, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def _target():
+    sys.path.insert(0, ROOT)
+    import importlib
+    return importlib.import_module(MODULE).STARTUP_TARGET_S
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('-n', '--runs', type=int, default=5, help='broj merenja (novih procesa)')
+    ap.add_argument('--target', type=float, help='cilj u sekundama (podrazumevano: STARTUP_TARGET_S iz aplikacije)')
+    ap.add_argument('--no-gui', action='store_true', help='meri samo uvoz modula, bez otvaranja prozora')
+    ap.add_argument('-o', '--out', help='JSON sa rezultatima (podrazumevano: benchmarks/results/startup_<vreme>.json)')
+    a = ap.parse_args(argv)
+
+    gui = not a.no_gui and has_display()
+    target = a.target if a.target is not None else _target()
+    runs = []
+    for i in range(a.runs):
+        r = probe(gui)
+        runs.append(r)
+        print(f"  {i + 1}: uvoz {r['import_s']:.3f} s" + (f", prozor {r['first_frame_s']:.3f} s" if gui else ''), file=sys.stderr)
+    measured = 'first_frame_s' if gui else 'import_s'
+    median = statistics.median(r[measured] for r in runs)
+    heavy = sorted({m for r in runs for m in r['heavy_loaded']})
+    heavy_frame = sorted({m for r in runs for m in r.get('heavy_loaded_at_frame', ())})
+    ok = median <= target and not heavy and not heavy_frame
+
+    result = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'measured': measured,
+        'target_s': target,
+        'median_s': round(median, 3),
+        'heavy_loaded_at_import': heavy,
+        'heavy_loaded_at_frame': heavy_frame,
+        'ok': ok,
+        'runs': [{k: round(v, 3) if isinstance(v, float) else v for k, v in r.items()} for r in runs],
+    }
+    out = a.out or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results',
+                                'startup_' + datetime.now().strftime('%Y%m%d_%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=1)
+    print(f"{measured}: medijana {median:.3f} s, cilj {target:.2f} s → {'OK' if ok else 'PREKORAČENO'}", file=sys.stderr)
+    if heavy: print(f"Pri uvozu su učitani odloženi moduli: {', '.join(heavy)}", file=sys.stderr)
+    if heavy_frame: print(f"Do prvog prikaza prozora su učitani odloženi moduli: {', '.join(heavy_frame)}", file=sys.stderr)
+    print(f'Rezultati: {out}', file=sys.stderr)
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,447 @@
+"""Regresioni testovi konverzije (convert_file), bez GUI-ja i bez SQL servera.
+
+    python -m pytest tests
+"""
+import os, io, sys, csv, json, zipfile, threading
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import Redizajnknjizenje_xml_gui_SQL_v4c_hybrid_log_FIXED as app  # noqa: E402
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+KONTA_MAP = {'2410': 11, '4350': 12, '5520': 13, '02211': 14}
+KONTA_META = {11: {'Broj': '2410', 'Naziv': 'Tekući račun'}, 12: {'Broj': '4350', 'Naziv': 'Dobavljači <u zemlji>'},
+              13: {'Broj': '5520', 'Naziv': 'Troškovi'}, 14: {'Broj': '02211', 'Naziv': 'Zalihe'}}
+
+def convert(src, out, **kw):
+    return app.convert_file(os.path.join(DATA, src), out if isinstance(out, io.BytesIO) else str(out), '01', KONTA_MAP, KONTA_META, **kw)
+
+def test_xml_matches_baseline(tmp_path):
+    # knjizenje_osnovno_baseline.xml je napisala prvobitna verzija programa (ElementTree); konta 5520 i 02211
+    # imaju samo redove sa nultim iznosom, pa nemaju stavke, ali imaju Konto blok
+    out = tmp_path / 'nalog.xml'
+    res = convert('knjizenje_osnovno.xlsx', out)
+    assert res['stavki'] == 6
+    with open(os.path.join(DATA, 'knjizenje_osnovno_baseline.xml'), 'rb') as f:
+        assert out.read_bytes() == f.read()
+
+def test_convert_many_same_stem(tmp_path):
+    # x.xlsx, x.csv i drugi/x.xlsx u istom pokretanju: svaki ulaz dobija svoj XML
+    (tmp_path / 'drugi').mkdir()
+    xlsx = os.path.join(DATA, 'knjizenje_osnovno.xlsx')
+    for dest in (tmp_path / 'x.xlsx', tmp_path / 'drugi' / 'x.xlsx'):
+        dest.write_bytes(open(xlsx, 'rb').read())
+    (tmp_path / 'x.csv').write_text('konto;duguje;potražuje;poslovni partner;dokument;datum promene;opis\n'
+                                    '2410;10,00;;P;D1;01.03.2024;a\n4350;;10,00;P;D1;01.03.2024;b\n', encoding='utf-8')
+    inputs = app.expand_inputs([str(tmp_path / 'x.xlsx'), str(tmp_path / 'x.csv'), str(tmp_path / 'drugi' / 'x.xlsx')])
+    out_dir = tmp_path / 'out'
+    results = app.convert_many(inputs, str(out_dir), '01', KONTA_MAP, KONTA_META, workers=2, log=lambda *_: None)
+    assert [r.get('error') for r in results] == [None] * 3
+    outputs = [r['output'] for r in results]
+    assert len(set(outputs)) == 3 and all(os.path.exists(p) for p in outputs)
+    assert len({r['debug_csv'] for r in results}) == 3
+    assert sorted(os.path.basename(p) for p in outputs) == ['x.xml', 'x_2.xml', 'x_3.xml']
+    stavki = {os.path.basename(r['input']): r['stavki'] for r in results}
+    assert stavki == {'x.xlsx': 6, 'x.csv': 2}
+    for r in results:
+        assert r['verify']['stavki'] == r['stavki']
+
+def test_split_by_dokument_packs_whole_documents(tmp_path):
+    # dokumenti RN-1, IZ 2 i red bez dokumenta imaju po dve stavke: sa 4 stavke po nalogu staju u dva dela
+    res = convert('knjizenje_osnovno.xlsx', tmp_path / 'nalog.xml', split_by='dokument', max_stavki=4)
+    assert res['shards'] == ['nalog_001.xml', 'nalog_002.xml']
+    with open(res['output'], encoding='utf-8') as f:
+        manifest = json.load(f)
+    assert [sh['stavki'] for sh in manifest['shards']] == [4, 2]
+    assert manifest['shards'][0]['key'] == 'RN-1 … IZ 2'
+    assert res['verify']['ok'] and res['verify']['naloga'] == 2
+
+@pytest.mark.parametrize('split_by', ['rows', 'month'])
+def test_split_keeps_documents_whole(tmp_path, split_by):
+    # sa 3 stavke po nalogu ni jedan dokument (po dve stavke) ne sme da se preseče: svaki deo je uravnotežen
+    res = convert('knjizenje_osnovno.xlsx', tmp_path / 'nalog.xml', split_by=split_by, max_stavki=3)
+    with open(res['output'], encoding='utf-8') as f:
+        manifest = json.load(f)
+    assert [sh['stavki'] for sh in manifest['shards']] == [2, 2, 2]
+    assert all(sh['duguje'] == sh['potrazuje'] for sh in manifest['shards'])
+    assert res['verify']['ok'] and not res['verify']['warnings']
+    keys = [sh['key'] for sh in manifest['shards']]
+    assert keys == (['RN-1', 'IZ 2', ''] if split_by == 'rows' else ['2024-01', '2024-02', '2024-02'])
+
+def test_pack_bounds(monkeypatch):
+    np = pytest.importorskip('numpy')
+    assert app._pack_bounds(np.array([2, 2, 5, 1]), 4) == [(0, 4), (4, 9), (9, 10)]
+    assert app._pack_bounds(np.array([1, 1, 1]), 10, np.array([False, True, False])) == [(0, 1), (1, 3)]
+    monkeypatch.setattr(app, 'MAX_STAVKI_PER_NALOG', 3)  # tek dokument preko ove granice se deli
+    assert app._pack_bounds(np.array([1, 7]), 3) == [(0, 1), (1, 4), (4, 7), (7, 8)]
+
+def test_split_rows_streams_documents_across_chunks(tmp_path):
+    reader = app.open_reader(os.path.join(DATA, 'knjizenje_osnovno.xlsx'))
+    df = pd.concat(reader.iter_chunks())
+    prep = app.prepare_frame(df, app.find_columns(df, app.MAIN_REQUIRED)[0], KONTA_MAP)
+    chunks = (prep.iloc[i:i + 1] for i in range(len(prep)))  # svaki dokument preseca granicu bloka
+    res = app.write_sharded(chunks, str(tmp_path / 'nalog.xml'), '01', 'Tekući promet', 'N', KONTA_META, [],
+                            'rows', max_stavki=3)
+    assert [(sh['key'], sh['stavki'], sh['first_row']) for sh in res['shards']] == [('RN-1', 2, 2), ('IZ 2', 2, 8), ('', 2, 10)]
+    assert app.verify_output(res['manifest'])['ok']
+
+def test_verify_rejects_unbalanced_nalog(tmp_path):
+    res = convert('knjizenje_osnovno.xlsx', tmp_path / 'nalog.xml', split_by='dokument', max_stavki=2)
+    first, second = (tmp_path / 'nalog_001.xml', tmp_path / 'nalog_002.xml')
+    # zbir ostaje isti, ali ni jedan od dva naloga više nije uravnotežen
+    first.write_text(first.read_text(encoding='utf-8').replace('<Potrazuje>1234.5600', '<Potrazuje>12.5000'), encoding='utf-8')
+    second.write_text(second.read_text(encoding='utf-8').replace('<Potrazuje>12.5000', '<Potrazuje>1234.5600'), encoding='utf-8')
+    v = app.XmlVerifier()
+    v.feed(str(first)); v.feed(str(second))
+    checked = v.finish()
+    assert checked['difference'] == '0.0000' and not checked['ok'] and checked['error_count'] == 2
+    assert all('nije uravnotežen' in e for e in checked['errors'])
+
+def test_split_rejects_id_overflow(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'MAX_SHARDS', 2)
+    with pytest.raises(ValueError, match='int32'):
+        convert('knjizenje_osnovno.xlsx', tmp_path / 'nalog.xml', split_by='rows', max_stavki=1)
+    assert sorted(os.listdir(tmp_path)) == []
+
+def test_cancel_leaves_no_partial_files(tmp_path):
+    cancel = threading.Event()
+    cancel.set()
+    with pytest.raises(app.JobCancelled):
+        convert('knjizenje_osnovno.xlsx', tmp_path / 'nalog.xml', debug_csv=str(tmp_path / 'nalog_debug.csv'), cancel=cancel)
+    assert os.listdir(tmp_path) == []
+
+def test_debug_csv_written_on_success(tmp_path):
+    res = convert('knjizenje_osnovno.xlsx', tmp_path / 'nalog.xml', debug_csv=str(tmp_path / 'nalog_debug.csv'))
+    with open(res['debug_csv'], encoding='utf-8') as f:
+        assert [r['reason'] for r in csv.DictReader(f)] == [app.SKIP_ZERO, app.SKIP_ZERO, app.SKIP_NOT_IN_MAP, app.SKIP_KONTO_EMPTY]
+    assert not any(p.endswith('.part') for p in os.listdir(tmp_path))
+
+CSV_HEADER = 'konto;duguje;potražuje;poslovni partner;dokument;datum promene;opis\n'
+
+def test_csv_amounts_outside_thousands_pattern(tmp_path, monkeypatch):
+    # separator se prepoznaje iz početka fajla (decimalna tačka); kasnije '1,5' je 1.5 kao iz XLSX-a, ne 15
+    monkeypatch.setattr(app, 'CSV_SNIFF_BYTES', 200)
+    path = tmp_path / 'iznosi.csv'
+    path.write_text(CSV_HEADER + '2410;1,234.50;;P;D1;01.03.2024;a\n4350;;1,234.50;P;D1;01.03.2024;b\n'
+                    + '4350;;0;P;D1;01.03.2024;c\n' * 5 + '2410;1,5;;P;D2;02.03.2024;d\n4350;;1.5;P;D2;02.03.2024;e\n',
+                    encoding='utf-8')
+    reader = app.CsvReader(str(path))
+    assert reader.decimal == '.'
+    df = pd.concat(reader.iter_chunks())
+    prep = app.prepare_frame(df, app.find_columns(df, app.MAIN_REQUIRED)[0], KONTA_MAP)
+    assert prep['duguje'].dropna().tolist() == ['1234.5000', '1.5000']
+    assert prep['potrazuje'].dropna().tolist() == ['1234.5000', '1.5000']
+
+def test_csv_rejects_rows_wider_than_header(tmp_path):
+    path = tmp_path / 'los.csv'
+    path.write_text(CSV_HEADER + '2410;1;;P;D;01.03.2024;a\n\n4350;;1;P;D;01.03.2024;b;visak\n', encoding='utf-8')
+    with pytest.raises(ValueError, match='red 4 ima više kolona'):
+        convert(str(path), tmp_path / 'nalog.xml')
+    assert sorted(os.listdir(tmp_path)) == ['los.csv']
+
+def test_csv_row_numbers_count_blank_lines(tmp_path):
+    path = tmp_path / 'prazne.csv'
+    path.write_text('\n' + CSV_HEADER + '\n2410;10;;P;D;01.03.2024;a\n\n\n999;;10;P;D;01.03.2024;b\n', encoding='utf-8')
+    res = convert(str(path), tmp_path / 'nalog.xml', debug_csv=str(tmp_path / 'dbg.csv'))
+    with open(res['debug_csv'], encoding='utf-8') as f:
+        assert [(r['row'], r['konto_norm']) for r in csv.DictReader(f)] == [('7', '999')]
+
+def test_verify_rejects_bad_dates(tmp_path):
+    with open(os.path.join(DATA, 'knjizenje_osnovno_baseline.xml'), encoding='utf-8') as f:
+        xml = f.read()
+    assert app.verify_output(os.path.join(DATA, 'knjizenje_osnovno_baseline.xml'))['ok']
+    bad = (xml.replace('<Datum_x0020_promene>2024-01-15T00:00:00+02:00', '<Datum_x0020_promene>15.01.2024', 1)
+              .replace('<Datum_x0020_promene>2024-02-29T00:00:00+02:00', '<Datum_x0020_promene>2024-02-30T00:00:00+02:00', 1))
+    path = tmp_path / 'los.xml'
+    path.write_text(bad, encoding='utf-8')
+    res = app.verify_output(str(path))
+    assert not res['ok'] and res['error_count'] == 2
+    assert all('Datum_x0020_promene nije ispravan' in e for e in res['errors'])
+
+def test_debug_log_paths_unique(tmp_path):
+    out = str(tmp_path / 'nalog.xml.gz')
+    paths = [app.debug_log_path(out) for _ in range(3)]
+    assert len(set(paths)) == 3
+    assert all(os.path.basename(p).startswith('nalog_debug_') and f'_{os.getpid()}_' in p for p in paths)
+
+def test_compressed_and_memory_outputs(tmp_path):
+    with open(os.path.join(DATA, 'knjizenje_osnovno_baseline.xml'), 'rb') as f:
+        expected = f.read()
+    for name in ('nalog.xml.gz', 'nalog.zip'):
+        res = convert('knjizenje_osnovno.xlsx', tmp_path / name)
+        assert res['verify']['ok'] and res['output_bytes'] == os.path.getsize(res['output'])
+        with app.open_output(res['output']) as f:
+            assert f.read() == expected
+    with zipfile.ZipFile(tmp_path / 'nalog.zip') as zf:
+        (member,) = zf.infolist()
+        assert member.filename == 'nalog.xml' and member.compress_type == zipfile.ZIP_DEFLATED
+        assert member.date_time[0] > 1980
+    buf = io.BytesIO()
+    res = convert('knjizenje_osnovno.xlsx', buf)
+    assert buf.getvalue() == expected and res['output'] == app.MEMORY_OUTPUT and res['verify']['ok']
+    assert not any(p.endswith('.part') for p in os.listdir(tmp_path))
+
+def test_unique_path_keeps_compound_extension(tmp_path):
+    taken = {str(tmp_path / 'nalog.xml.gz')}
+    p = app._unique_path(str(tmp_path / 'nalog.xml.gz'), taken)
+    assert p != str(tmp_path / 'nalog.xml.gz') and p.endswith('.xml.gz') and os.path.basename(p).startswith('nalog_')
+
+AMOUNTS = ['1.234,56', '1,234.56', '1234', '1234.5', '-12,5', '0', '0,00', '  7 ', '12.34567', '1e3',
+           '1.000.000', 'abc', '', None, float('nan')]
+
+def test_parse_amount_series_matches_parse_amount():
+    got = app.parse_amount_series(pd.Series(AMOUNTS, dtype=object))
+    assert [None if pd.isna(v) else v for v in got] == [app.parse_amount(v) for v in AMOUNTS]
+
+def test_parse_date_series_matches_parse_date():
+    dates = ['15.01.2024', '31/12/2023', '3.2.2024', '29.02.2024', 'nije datum', '', None]
+    got = app.parse_date_series(pd.Series(dates, dtype=object))
+    assert list(got) == [app.parse_date_to_iso_tz(v) for v in dates]
+
+def test_parse_date_series_reads_iso_as_iso():
+    # Excel datum ćelije stižu kao ISO; dayfirst iz parse_date_to_iso_tz bi 2024-01-03 pročitao kao 1. mart
+    got = app.parse_date_series(pd.Series(['2024-01-03', '2024-01-03 00:00:00', '03.01.2024'], dtype=object))
+    assert list(got) == ['2024-01-03T00:00:00+02:00'] * 3
+    assert app.parse_date_to_iso_tz('2024-01-03') == '2024-03-01T00:00:00+02:00'
+
+def test_konta_cache_round_trip(tmp_path):
+    cache = app.KontaCache(str(tmp_path / 'konta.sqlite'))
+    assert cache.load('srv|baza') is None
+    rows = [(11, '2410', 'Tekući račun'), (12, '435.0', None)]
+    cache.save('srv|baza', rows, [2, 12345, 12])
+    cache.save('srv|druga', [(1, '100', 'x')], [1, 1, 1])
+    got, sig, fetched_at = cache.load('srv|baza')
+    assert sorted(got) == [(11, '2410', 'Tekući račun'), (12, '435.0', '')] and sig == [2, 12345, 12] and fetched_at
+    m, meta = app.build_konta_maps(got)
+    assert dict(m) == {'2410': 11, '435': 12} and meta[12] == {'Broj': '435', 'Naziv': ''}
+    # novi snimak zamenjuje stari za isti ključ, ostali ključevi ostaju
+    cache.save('srv|baza', rows[:1], [1, 1, 11])
+    assert cache.load('srv|baza')[:2] == ([(11, '2410', 'Tekući račun')], [1, 1, 11])
+    assert cache.load('srv|druga')[0] == [(1, '100', 'x')]
+
+class StubCursor:
+    def __init__(self, cn):
+        self.cn, self.rows = cn, []
+
+    def execute(self, q, args=()):
+        if self.cn.broken: raise OSError('veza prekinuta')
+        self.cn.queries.append((q, args))
+        if 'nema_tabele' in q: raise ValueError('Invalid object name')
+        self.rows = [(1,)] if q == 'SELECT 1' else [(int(k), k, f'konto {k}') for k in args]
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def fetchmany(self, n):
+        rows, self.rows = self.rows[:n], self.rows[n:]
+        return rows
+
+class StubConnection:
+    def __init__(self):
+        self.broken, self.closed, self.queries = False, False, []
+
+    def cursor(self):
+        return StubCursor(self)
+
+    def close(self):
+        self.closed = True
+
+SQL_PARAMS = {'server': 'srv', 'instance': '', 'port': '1433', 'database': 'baza', 'windows_auth': False,
+              'username': 'u', 'password': 'p'}
+
+def test_sql_session_reconnects_once(tmp_path, monkeypatch):
+    opened = []
+    monkeypatch.setattr(app, 'open_sql', lambda params, log, info=None: opened.append(StubConnection()) or opened[-1])
+    sql = app.SqlSession(str(tmp_path / 'drivers.json'))
+    select = lambda cn: app.sql_fetchall(cn, 'SELECT 1')
+    assert sql.run(SQL_PARAMS, print, select) == [(1,)]
+    assert sql.run(SQL_PARAMS, print, select) == [(1,)] and len(opened) == 1
+    opened[0].broken = True  # npr. server restartovan između dva posla
+    assert sql.run(SQL_PARAMS, print, select) == [(1,)] and len(opened) == 2 and opened[0].closed
+    with pytest.raises(ValueError):  # greška u upitu na zdravoj konekciji se ne ponavlja
+        sql.run(SQL_PARAMS, print, lambda cn: app.sql_fetchall(cn, 'SELECT * FROM nema_tabele'))
+    assert len(opened) == 2
+    sql.run(dict(SQL_PARAMS, database='druga'), print, select)  # drugi cilj, nova konekcija
+    assert len(opened) == 3 and opened[1].closed
+    sql.close()
+    assert opened[2].closed
+
+def test_fetch_konta_for_batches(tmp_path):
+    cn = StubConnection()
+    konta = {str(k) for k in range(100, 105)}
+    rows = app.fetch_konta_for(cn, konta, batch=2)
+    assert [args for _, args in cn.queries] == [('100', '101'), ('102', '103'), ('104',)]
+    assert all(q.startswith(app.KONTA_SQL) and q.count('?') == len(args) for q, args in cn.queries)
+    assert sorted(r[1] for r in rows) == sorted(konta)
+    xlsx = app.open_reader(os.path.join(DATA, 'knjizenje_osnovno.xlsx'))
+    assert app.workbook_konta(xlsx, 'Konto') == {'2410', '4350', '5520', '02211', '999'}
+
+def test_convert_without_stavki_fails(tmp_path, monkeypatch):
+    # sva konta nepoznata (npr. zastarela mapa): nema XML-a, a convert to broji kao neuspeh
+    (tmp_path / 'in').mkdir()
+    (tmp_path / 'in' / 'nepoznata.csv').write_text(CSV_HEADER + '777;10;;P;D;01.03.2024;a\n778;;10;P;D;01.03.2024;b\n',
+                                                   encoding='utf-8')
+    res = convert(str(tmp_path / 'in' / 'nepoznata.csv'), tmp_path / 'nalog.xml')
+    assert res['stavki'] == 0 and res['output'] is None and 'Nijedna stavka' in res['error']
+    assert not (tmp_path / 'nalog.xml').exists()
+    monkeypatch.setattr(app, 'load_konta_headless', lambda params, offline=False, log=None: (KONTA_MAP, KONTA_META))
+    out = tmp_path / 'out'
+    code = app.main(['convert', str(tmp_path / 'in'), '-o', str(out), '--sifra', '01', '--offline',
+                     '--metrics', str(tmp_path / 'metrics.jsonl')])
+    with open(out / 'batch_summary.json', encoding='utf-8') as f:
+        summary = json.load(f)
+    assert code == 1 and summary['failed'] == 1 and 'Nijedna stavka' in summary['results'][0]['error']
+
+class CrashingPool:
+    """ProcessPoolExecutor koji posao izvršava odmah, a za ulaz 'pada*' glumi pad procesa."""
+    def __init__(self, max_workers=None, initializer=None, initargs=()):
+        initializer(*initargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def submit(self, fn, *args):
+        from concurrent.futures import Future
+        fut = Future()
+        if os.path.basename(args[0]).startswith('pada'):
+            fut.set_exception(app.BrokenProcessPool('proces je neočekivano završen'))
+        else:
+            fut.set_result(fn(*args))
+        return fut
+
+def test_convert_many_survives_worker_crash(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'ProcessPoolExecutor', CrashingPool)
+    xlsx = os.path.join(DATA, 'knjizenje_osnovno.xlsx')
+    for name in ('a.xlsx', 'pada.xlsx'):
+        (tmp_path / name).write_bytes(open(xlsx, 'rb').read())
+    results = app.convert_many([str(tmp_path / 'a.xlsx'), str(tmp_path / 'pada.xlsx')], str(tmp_path / 'out'),
+                               '01', KONTA_MAP, KONTA_META, log=lambda *_: None)
+    assert [os.path.basename(r['input']) for r in results] == ['a.xlsx', 'pada.xlsx']
+    assert results[0]['stavki'] == 6 and 'error' not in results[0]
+    assert results[1]['error'].startswith('BrokenProcessPool')
+
+def test_fragment_cache_reuses_only_unchanged_rows(tmp_path):
+    openpyxl = pytest.importorskip('openpyxl')
+    src = tmp_path / 'k.xlsx'
+    src.write_bytes(open(os.path.join(DATA, 'knjizenje_osnovno.xlsx'), 'rb').read())
+    cache = app.FragmentCache()
+    def cached(name, konta_map=KONTA_MAP, konta_meta=KONTA_META):
+        res = app.convert_file(str(src), str(tmp_path / name), '01', konta_map, konta_meta, fragments=cache)
+        return res['fragments'], (tmp_path / name).read_bytes()
+    def fresh(konta_map=KONTA_MAP, konta_meta=KONTA_META):
+        app.convert_file(str(src), str(tmp_path / 'fresh.xml'), '01', konta_map, konta_meta)
+        return (tmp_path / 'fresh.xml').read_bytes()
+    first, xml = cached('1.xml')
+    assert first == {'reused': 0, 'prepared': 10} and xml == fresh()
+    assert cached('2.xml') == ({'reused': 10, 'prepared': 0}, xml)  # fajl nepromenjen: ni čitanja ni pripreme
+    wb = openpyxl.load_workbook(src)
+    ws = wb.active
+    opis = [c.value for c in ws[1]].index('Opis') + 1
+    ws.cell(row=8, column=opis, value='ispravljen opis')
+    wb.save(src)
+    st = os.stat(src)
+    os.utime(src, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    frag, xml = cached('3.xml')
+    assert frag == {'reused': 9, 'prepared': 1} and xml == fresh() and b'ispravljen opis' in xml
+    assert len(cache.rows) == 10  # stara verzija izmenjenog reda je izbačena iz keša
+    # nova mapa konta briše keš: 999 sada postaje stavka
+    konta_map, konta_meta = {**KONTA_MAP, '999': 15}, {**KONTA_META, 15: {'Broj': '999', 'Naziv': 'Novi'}}
+    frag, xml = cached('4.xml', konta_map, konta_meta)
+    assert frag == {'reused': 0, 'prepared': 10} and xml == fresh(konta_map, konta_meta)
+    assert xml.count(b'<Stavka_naloga_za_knjizenje>') == 7
+
+def test_set_konta_files_chart_under_fetch_key():
+    selected = dict(SQL_PARAMS)
+    gui = SimpleNamespace(_konta_index=app.KontaIndex(), _sql_params=lambda: selected, _log=lambda msg: None,
+                          status=SimpleNamespace(set=lambda v: None), _refresh_skip_reasons=lambda: None,
+                          _sql_konta_map=None, _sql_konta_meta=None)
+    key = app.konta_cache_key(SQL_PARAMS)
+    selected['database'] = 'druga'  # baza je promenjena dok se plan učitavao
+    assert not app.App._set_konta(gui, KONTA_MAP, KONTA_META, 'SQL', key)
+    assert gui._sql_konta_map is None and len(gui._konta_index.get(key)) == 4
+    assert gui._konta_index.get(app.konta_cache_key(selected)) is None
+    # delimična mapa (samo konta iz XLSX-a) postaje trenutna, ali se ne pamti kao plan baze
+    assert app.App._set_konta(gui, {'2410': 11}, KONTA_META, 'SQL')
+    assert len(gui._sql_konta_map) == 1 and len(gui._konta_index) == 1
+
+@pytest.mark.parametrize('auto, windows_auth, password, connects', [
+    (False, True, '', False), (True, False, '', False), (True, False, 'tajna', True), (True, True, '', True)])
+def test_startup_connects_only_with_auto_connect_and_credentials(auto, windows_auth, password, connects):
+    params = dict(SQL_PARAMS, windows_auth=windows_auth, password=password)
+    calls = []
+    gui = SimpleNamespace(_sql_params=lambda: params, _log=lambda msg: None,
+                          _konta_cache=SimpleNamespace(load=lambda key: None), sql_auto_connect=SimpleNamespace(get=lambda: auto),
+                          _auto_connect=lambda *a: calls.append(a))
+    app.App.load_konta_cache(gui)
+    assert bool(calls) == connects
+
+def test_konta_chart_suggest_ranking():
+    chart = app.KontaChart([(1, '241', 'Sintetika'), (2, '2410', 'Tekući'), (3, '24100', 'Tekući RSD'), (4, '2411', 'Devizni'),
+                            (5, '2420', 'Blagajna'), (6, '4350', 'Dobavljači'), (7, '9', 'Vanbilansno')])
+    # najduži zajednički prefiks prvi, pa sličnija dužina, pa abecedno; broj se normalizuje kao u XLSX-u
+    assert [b for b, _, _ in chart.suggest('241.05', n=3)] == ['24100', '2410', '2411']
+    assert chart.suggest('24105', n=1) == [('24100', 3, 'Tekući RSD')]
+    # konto ispod sintetike koja postoji: analitike i sama sintetika
+    assert [b for b, _, _ in chart.suggest('2412')] == ['2410', '2411', '241', '24100', '2420']
+    # sintetika se nalazi i kad je daleko od konta u sortiranom redosledu
+    wide = app.KontaChart([(1, '5', 'Klasa 5')] + [(i, f'5{i:04d}', '') for i in range(10, 40)])
+    assert wide.suggest('51', n=2) == [('5', 1, 'Klasa 5'), ('50038', 38, '')]
+    assert '2410' not in [b for b, _, _ in chart.suggest('2410', n=10)]
+    assert chart.suggest('') == [] and chart.suggest('777') == []
+    assert app.suggest_konta(KONTA_MAP, KONTA_META, ['2411'], n=1) == {'2411': [('2410', 11, 'Tekući račun')]}
+
+KONTA_ROWS = [(kid, meta['Broj'], meta['Naziv']) for kid, meta in KONTA_META.items()]
+
+def seeded_cache(tmp_path, monkeypatch):
+    """KontaCache u tmp_path sa KONTA_ROWS pod ključem SQL_PARAMS; app.KontaCache() ga vraća."""
+    cache = app.KontaCache(str(tmp_path / 'konta.sqlite'))
+    cache.save(app.konta_cache_key(SQL_PARAMS), KONTA_ROWS, [4, 123, 14])
+    monkeypatch.setattr(app, 'KontaCache', lambda path=None: cache)
+    return cache
+
+def test_load_konta_rows_falls_back_to_cache(tmp_path, monkeypatch):
+    seeded_cache(tmp_path, monkeypatch)
+    def down(*a):
+        raise ConnectionError('server nije dostupan')
+    rows, sig, src = app.load_konta_rows(SQL_PARAMS, SimpleNamespace(run=down), lambda msg: None)
+    assert sorted(rows) == sorted(KONTA_ROWS) and sig == [4, 123, 14] and src.startswith('keša')
+    with pytest.raises(ConnectionError):
+        app.load_konta_rows(SQL_PARAMS, SimpleNamespace(run=down), lambda msg: None, fallback=False)
+    # isti potpis na SQL-u: redovi se ne preuzimaju
+    same = SimpleNamespace(run=lambda params, log, fetch: (None, [4, 123, 14]))
+    assert app.load_konta_rows(SQL_PARAMS, same, lambda msg: None, known_sig=[4, 123, 14]) == (None, [4, 123, 14], 'SQL')
+    with pytest.raises(RuntimeError, match='Nema konta'):
+        app.load_konta_rows(dict(SQL_PARAMS, database='druga'), SimpleNamespace(run=down), lambda msg: None)
+
+def test_watch_once_routes_done_and_failed(tmp_path, monkeypatch):
+    seeded_cache(tmp_path, monkeypatch)
+    root = tmp_path / 'watch'
+    (root / 'inbox').mkdir(parents=True)
+    (root / 'inbox' / 'dobar.xlsx').write_bytes(open(os.path.join(DATA, 'knjizenje_osnovno.xlsx'), 'rb').read())
+    # sva konta nepoznata: nema stavki, pa ni XML-a, i ulaz ide u failed
+    (root / 'inbox' / 'nepoznata.csv').write_text(CSV_HEADER + '777;10;;P;D;01.03.2024;a\n778;;10;P;D;01.03.2024;b\n',
+                                                  encoding='utf-8')
+    code = app.main(['watch', str(root), '--sifra', '01', '--once', '--offline', '--workers', '2', '--poll', '0.1',
+                     '--server', 'srv', '--database', 'baza', '--user', 'u', '--metrics', str(tmp_path / 'metrics.jsonl')])
+    assert code == 1
+    assert os.listdir(root / 'inbox') == []
+    assert os.listdir(root / 'out') == ['dobar.xml']
+    done, failed = sorted(os.listdir(root / 'done')), sorted(os.listdir(root / 'failed'))
+    assert 'dobar.xlsx' in done and any(n.startswith('dobar_debug_') and n != 'dobar_debug.csv' for n in done)
+    assert 'nepoznata.csv' in failed and 'nepoznata_greska.txt' in failed
+    assert 'Nijedna stavka' in (root / 'failed' / 'nepoznata_greska.txt').read_text(encoding='utf-8')
+    with open(root / 'status.json', encoding='utf-8') as f:
+        status = json.load(f)
+    assert status['state'] == 'stopped' and status['queue_depth'] == 0 and status['in_progress'] == []
+    assert (status['processed'], status['failed'], status['stavki'], status['konta']) == (1, 1, 6, 4)
+    recent = {r['input']: r for r in status['recent']}
+    assert recent['dobar.xlsx']['error'] is None and recent['dobar.xlsx']['output'].endswith('dobar.xml')
+    assert recent['nepoznata.csv']['output'] is None and 'Nijedna stavka' in recent['nepoznata.csv']['error']